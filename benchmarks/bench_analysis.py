@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# Offline trace analysis, vectorized decode_pdus() against feeding the same
+# frames through a live Transport.
+#
+# Usage: python benchmarks/bench_analysis.py [--frames N]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lindiagnostics.transport import Transport
+from lindiagnostics.event import LinEvent, LinEventBatch
+from lindiagnostics.trace import TraceWriter, TraceReader
+from lindiagnostics.analysis import decode_pdus
+
+
+def write_trace(path, frame_count):
+    segmenter = Transport(True, None)
+    exchange = LinEventBatch()
+    timestamp = 0.0
+    for sid, data in ((0x22, bytes(range(2))), (0x62, bytes(range(64))), (0x10, bytes([3])), (0x50, bytes(range(4)))):
+        frame_id = 0x3C if sid < 0x40 else 0x3D
+        direction = LinEvent.Direction.TX if sid < 0x40 else LinEvent.Direction.RX
+        for event in segmenter._segment(0x01, sid, data):
+            exchange.append_frame(frame_id, event.event_payload, event.checksum_type, direction, timestamp)
+            timestamp += 0.005
+    with TraceWriter(path) as writer:
+        written = 0
+        while written < frame_count:
+            for index in range(len(exchange.timestamps)):
+                exchange.timestamps[index] += timestamp
+            writer.write_batch(exchange)
+            written += len(exchange)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline trace decoding benchmark")
+    parser.add_argument("--frames", type=int, default=1000000, help="Number of frames in the trace")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.lintrace")
+        write_trace(path, args.frames)
+
+        with TraceReader(path) as reader:
+            start = time.perf_counter()
+            table = decode_pdus(reader)
+            vectorized = time.perf_counter() - start
+            pdu_count = len(table)
+            del table
+
+            receiver = Transport(True, None)
+            start = time.perf_counter()
+            for event in reader:
+                receiver._receive_from_driver(event.replace(direction=LinEvent.Direction.RX, event_id=0x3C))
+            live = time.perf_counter() - start
+
+        frames = len(reader)
+    print(f"{frames:,} frames, {pdu_count:,} PDUs")
+    print(f"{'decode_pdus':<12}{frames / vectorized:>16,.0f} frames/s")
+    print(f"{'Transport':<12}{frames / live:>16,.0f} frames/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Benchmark of the simulated LIN network: frames/second against the number of
+# registered slaves, for diagnostic requests addressed to a single NAD.
+#
+# Usage: python benchmarks/bench_simulated.py [--seconds N] [--slaves 1,10,100]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lindiagnostics.drivers import SimulatedLinNetwork
+from lindiagnostics.event import LinEvent
+from lindiagnostics.constants import *
+
+TARGET_NAD = 1
+
+
+def bench_network(slave_count, seconds):
+    network = SimulatedLinNetwork()
+    for nad in range(TARGET_NAD, TARGET_NAD + slave_count):
+        network.register_slave(nad, 2, 3, 4, serial_number=bytes([1, 2, 3, 4]))
+    master_driver = network.get_master_driver()
+
+    # Read serial number request addressed to a single slave
+    request = LinEvent(MASTER_DIAGNOSTIC_FRAME_ID,
+                       bytes([TARGET_NAD, 0x06, READ_BY_IDENTIFIER_SID, DATA_IDENTIFIER_SERIAL_NUMBER, 0xff, 0x7f, 0xff, 0xff]),
+                       LinEvent.ChecksumType.CLASSIC)
+
+    frames = 0
+    start = time.perf_counter()
+    while True:
+        network.write_message(request)
+        network.request_slave_response(SLAVE_DIAGNOSTIC_FRAME_ID)
+        frames += 2
+        while master_driver.read_event(0) is not None:
+            pass
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return frames / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated LIN network benchmark")
+    parser.add_argument("--seconds", type=float, default=1.0, help="Time spent on each measurement")
+    parser.add_argument("--slaves", default="1,10,100,1000", help="Comma separated numbers of registered slaves")
+    args = parser.parse_args()
+
+    results = []
+    for slave_count in [int(count) for count in args.slaves.split(",")]:
+        results.append((slave_count, bench_network(slave_count, args.seconds)))
+
+    print(f"{'slaves':>8}{'frames/s':>14}")
+    for slave_count, frames_per_second in results:
+        print(f"{slave_count:>8}{frames_per_second:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# Micro-benchmark of LIN-TP segmentation and reassembly.
+#
+# Usage: python benchmarks/bench_transport.py [--seconds N]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from lindiagnostics.transport import Transport
+from lindiagnostics.event import LinEvent
+
+PAYLOADS = {
+    "SF (5 B)": bytes(range(5)),
+    "FF+CF (64 B)": bytes(range(64)),
+    "max (4095 B)": bytes(i & 0xff for i in range(4095)),
+}
+
+
+def measure(function, seconds):
+    frames = 0
+    iterations = 0
+    start = time.perf_counter()
+    while True:
+        frames += function()
+        iterations += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return frames / elapsed
+
+
+def bench_segment(payload, seconds):
+    transport = Transport(False, None)
+
+    def run():
+        events = transport._segment(0x01, 0x31, payload)
+        return len(events)
+
+    return measure(run, seconds)
+
+
+def bench_reassemble(payload, seconds):
+    transmitter = Transport(False, None)
+    receiver = Transport(True, None)
+    events = [LinEvent(event.event_id, event.event_payload, event.checksum_type, direction=LinEvent.Direction.RX)
+              for event in transmitter._segment(0x01, 0x31, payload)]
+
+    def run():
+        for event in events:
+            receiver._receive_from_driver(event)
+        receiver.receive()
+        return len(events)
+
+    return measure(run, seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LIN-TP segmentation and reassembly micro-benchmark")
+    parser.add_argument("--seconds", type=float, default=1.0, help="Time spent on each measurement")
+    args = parser.parse_args()
+
+    results = []
+    for name, payload in PAYLOADS.items():
+        results.append((name, bench_segment(payload, args.seconds), bench_reassemble(payload, args.seconds)))
+
+    print(f"{'PDU':<16}{'segment frames/s':>20}{'reassemble frames/s':>22}")
+    for name, segment, reassemble in results:
+        print(f"{name:<16}{segment:>20,.0f}{reassemble:>22,.0f}")
+
+
+if __name__ == "__main__":
+    main()
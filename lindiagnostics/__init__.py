@@ -1,2 +1,4 @@
-from .master import LinMaster
-from .slave import LinSlave, LinSlaveThread
\ No newline at end of file
+from .master import LinMaster, NegativeResponseError
+from .async_master import AsyncLinMaster
+from .slave import LinSlave, LinSlaveThread
+from .schedule import ScheduleTable
\ No newline at end of file
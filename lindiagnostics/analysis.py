@@ -0,0 +1,124 @@
+from functools import lru_cache
+from .constants import MASTER_DIAGNOSTIC_FRAME_ID, SLAVE_DIAGNOSTIC_FRAME_ID
+from .transport import Transport
+
+_SF, _CF = int(Transport.PCIType.SF), int(Transport.PCIType.CF)
+
+
+def _numpy():
+    # numpy is optional, and only imported once an analysis runs
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("numpy is required for offline trace analysis") from None
+    return numpy
+
+
+@lru_cache(maxsize=None)
+def pdu_dtype():
+    # One row per reassembled diagnostic PDU. first_record and last_record are
+    # trace indices of its first and last frame, latency is the time from the
+    # end of the latest request to the start of a response (NaN for requests).
+    return _numpy().dtype([("timestamp", "f8"), ("end_timestamp", "f8"), ("frame_id", "u1"),
+                           ("nad", "u1"), ("sid", "u1"), ("length", "u2"), ("frame_count", "u2"),
+                           ("first_record", "i8"), ("last_record", "i8"), ("latency", "f8")])
+
+
+def decode_pdus(trace):
+    # Reassembles every diagnostic PDU of a trace (a TraceReader or an array of
+    # trace_dtype() records) with array operations over all frames at once.
+    # Frames are expected in time order. PDUs that are incomplete or whose
+    # consecutive frames are out of order are left out, like the live
+    # transport discards them.
+    numpy = _numpy()
+    records = trace.as_array() if hasattr(trace, "as_array") else trace
+
+    event_ids = records["event_id"]
+    diagnostic = ((event_ids == MASTER_DIAGNOSTIC_FRAME_ID) | (event_ids == SLAVE_DIAGNOSTIC_FRAME_ID)) & (records["length"] == 8)
+    record_index = numpy.flatnonzero(diagnostic)
+    frame_ids = event_ids[record_index]
+
+    table = numpy.concatenate([_decode_stream(records, record_index[frame_ids == frame_id], frame_id)
+                               for frame_id in (MASTER_DIAGNOSTIC_FRAME_ID, SLAVE_DIAGNOSTIC_FRAME_ID)])
+    table = table[numpy.argsort(table["first_record"], kind="stable")]
+
+    requests = table["frame_id"] == MASTER_DIAGNOSTIC_FRAME_ID
+    responses = ~requests
+    request_ends = table["end_timestamp"][requests]
+    response_starts = table["timestamp"][responses]
+    latest_request = numpy.searchsorted(request_ends, response_starts, side="right") - 1
+    latency = numpy.full(len(response_starts), numpy.nan)
+    answered = latest_request >= 0
+    latency[answered] = response_starts[answered] - request_ends[latest_request[answered]]
+    table["latency"][responses] = latency
+    return table
+
+
+def _decode_stream(records, record_index, frame_id):
+    # Every frame of one frame ID, in order. Frames belong to the PDU of the
+    # latest SF or FF before them
+    numpy = _numpy()
+    payload = records["payload"][record_index]
+    timestamps = records["timestamp"][record_index]
+    pci = payload[:, 1]
+    pci_type = pci >> 4
+
+    known = pci_type <= _CF
+    payload, timestamps, pci, pci_type, record_index = \
+        payload[known], timestamps[known], pci[known], pci_type[known], record_index[known]
+    frame_count = len(record_index)
+
+    is_sf = pci_type == _SF
+    is_cf = pci_type == _CF
+    is_start = ~is_cf
+    starts = numpy.flatnonzero(is_start)
+    if len(starts) == 0:
+        return numpy.zeros(0, dtype=pdu_dtype())
+    pdu = numpy.cumsum(is_start) - 1
+    # Consecutive frames before the first SF or FF belong to nothing
+    in_pdu = pdu >= 0
+
+    following = numpy.append(starts[1:], frame_count) - starts - 1
+    start_pci = pci[starts].astype(numpy.int64)
+    start_is_sf = is_sf[starts]
+    sf_length = (start_pci & 0x0f) - 1
+    ff_length = ((start_pci & 0x0f) << 8) | payload[starts, 2]
+    length = numpy.where(start_is_sf, sf_length, ff_length)
+    expected_following = numpy.where(start_is_sf, 0, (ff_length - 4 + 5) // 6)
+
+    # Each consecutive frame's counter is its position in the PDU modulo 16
+    position = numpy.arange(frame_count) - starts[numpy.maximum(pdu, 0)]
+    bad_counter = in_pdu & is_cf & ((pci & 0x0f) != position % 16)
+    bad_counters = numpy.bincount(pdu[bad_counter], minlength=len(starts))
+
+    valid = (following == expected_following) & (bad_counters == 0)
+    valid &= numpy.where(start_is_sf, (sf_length >= 0) & (sf_length <= 5), ff_length > 5)
+
+    starts, following, length = starts[valid], following[valid], length[valid]
+    ends = starts + following
+    table = numpy.zeros(len(starts), dtype=pdu_dtype())
+    table["timestamp"] = timestamps[starts]
+    table["end_timestamp"] = timestamps[ends]
+    table["frame_id"] = frame_id
+    table["nad"] = payload[starts, 0]
+    table["sid"] = numpy.where(start_is_sf[valid], payload[starts, 2], payload[starts, 3])
+    table["length"] = length
+    table["frame_count"] = following + 1
+    table["first_record"] = record_index[starts]
+    table["last_record"] = record_index[ends]
+    table["latency"] = numpy.nan
+    return table
+
+
+def pdu_data(trace, pdu):
+    # The data bytes of one row of decode_pdus(), after the SID
+    numpy = _numpy()
+    records = trace.as_array() if hasattr(trace, "as_array") else trace
+    frames = records[pdu["first_record"]:pdu["last_record"] + 1]
+    payload = frames["payload"]
+    payload = payload[(frames["event_id"] == pdu["frame_id"]) & (frames["length"] == 8) & ((payload[:, 1] >> 4) <= _CF)]
+    length = int(pdu["length"])
+    if pdu["frame_count"] == 1:
+        return payload[0, 3:3 + length].tobytes()
+    data = numpy.concatenate([payload[0, 4:8], payload[1:, 2:8].ravel()])
+    return data[:length].tobytes()
@@ -0,0 +1,108 @@
+import asyncio
+from queue import Full
+from .master import LinMasterBase
+from .constants import *
+
+class AsyncLinMaster(LinMasterBase):
+    # Requests are futures completed by the transport thread, so awaiting them
+    # costs no thread per in-flight request: one event loop can drive as many
+    # buses as it has AsyncLinMaster instances.
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        self.close()
+
+    async def assign_slave_frame_ids(self, start_index, frame_ids, nad=None, timeout=None):
+        return await self._run(self._assign_slave_frame_ids(start_index, frame_ids, nad), timeout)
+
+    async def assign_slave_nad(self, new_nad, supplier_id=BROADCAST_SUPPLIER_ID, function_id=BROADCAST_FUNCTION_ID, nad=BROADCAST_NAD, timeout=None):
+        return await self._run(self._assign_slave_nad(new_nad, supplier_id, function_id, nad), timeout)
+
+    async def save_slave_configuration(self, nad=None, timeout=None):
+        return await self._run(self._save_slave_configuration(nad), timeout)
+
+    async def slave_data_dump(self, payload, nad=None, timeout=None):
+        return await self._run(self._slave_data_dump(payload, nad), timeout)
+
+    async def get_slave_serial_number(self, supplier_id=BROADCAST_SUPPLIER_ID, function_id=BROADCAST_FUNCTION_ID, nad=BROADCAST_NAD, timeout=None):
+        return await self._run(self._get_slave_serial_number(supplier_id, function_id, nad), timeout)
+
+    async def get_slave_product_identifier(self, supplier_id=BROADCAST_SUPPLIER_ID, function_id=BROADCAST_FUNCTION_ID, nad=BROADCAST_NAD, timeout=None):
+        return await self._run(self._get_slave_product_identifier(supplier_id, function_id, nad), timeout)
+
+    async def conditional_change_slave_nad(self, id_type, id_byte_index, id_mask, id_invert, new_nad, nad=None, timeout=None):
+        return await self._run(self._conditional_change_slave_nad(id_type, id_byte_index, id_mask, id_invert, new_nad, nad), timeout)
+
+    async def read_by_identifier(self, identifier, supplier_id=BROADCAST_SUPPLIER_ID, function_id=BROADCAST_FUNCTION_ID, nad=BROADCAST_NAD, timeout=None):
+        return await self._run(self._read_by_identifier(identifier, supplier_id, function_id, nad), timeout)
+
+    async def request_diagnostic(self, nad, sid, payload, timeout=None):
+        # Raw request (e.g. UDS over LIN): returns the positive response payload
+        # and raises NegativeResponseError for a 0x7F response
+        return await self._run(self._request_diagnostic(nad, sid, payload), timeout)
+
+    async def read_by_identifier_all(self, identifier, supplier_id=BROADCAST_SUPPLIER_ID, function_id=BROADCAST_FUNCTION_ID, window=0.1, expected=None):
+        payload = self._identifier_payload(identifier, supplier_id, function_id)
+        return self._positive_responses(await self.functional_request(READ_BY_IDENTIFIER_SID, payload, window=window, expected=expected))
+
+    async def functional_request(self, sid, payload, window=0.1, nad=None, expected=None):
+        request = self._request_functional(sid, payload, window, nad, expected)
+        try:
+            if self._transport.stepped:
+                while not request.done():
+                    self._transport.step()
+                    await asyncio.sleep(0)
+            return await asyncio.wrap_future(request)
+        except asyncio.CancelledError:
+            self._transport.cancel(request)
+            raise
+
+    async def _run(self, service, timeout):
+        # LinMaster._run(), awaiting each request
+        try:
+            args = next(service)
+            while True:
+                try:
+                    response = await self._request(*args, timeout)
+                except BaseException as e:
+                    args = service.throw(e)
+                else:
+                    args = service.send(response)
+        except StopIteration as stop:
+            return stop.value
+
+    async def _request(self, nad, sid, payload, name, response_nad, timeout):
+        if nad is None:
+            nad = BROADCAST_NAD
+        while True:
+            # Waiting for room in a full TX queue must not block the event loop
+            try:
+                request = self._transport.request(nad, sid, payload, timeout=timeout, response_nad=response_nad, block=False)
+                break
+            except Full:
+                if self._transport.stepped:
+                    self._transport.step()
+                    await asyncio.sleep(0)
+                else:
+                    await asyncio.sleep(self._transport.poll_interval)
+        try:
+            if self._transport.stepped:
+                # Virtual time: drive the transport from the event loop
+                deadline = None if timeout is None else self._transport.clock.time() + timeout
+                expired = False
+                while not request.done():
+                    if expired:
+                        raise TimeoutError()
+                    expired = deadline is not None and self._transport.clock.time() >= deadline
+                    self._transport.step()
+                    await asyncio.sleep(0)
+            # timeout bounds the whole wait, queueing included
+            result = await asyncio.wait_for(asyncio.wrap_future(request), timeout)
+        except asyncio.CancelledError:
+            self._transport.cancel(request)
+            raise
+        except (TimeoutError, asyncio.TimeoutError):
+            self._transport.cancel(request)
+            raise TimeoutError(f"Timed out waiting for slave to respond to {name}") from None
+        return self._complete(request, result, name)
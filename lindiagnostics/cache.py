@@ -0,0 +1,57 @@
+from collections import OrderedDict
+from threading import Lock
+from .clock import MonotonicClock
+from .constants import BROADCAST_NAD
+
+
+class IdentityCache:
+    # Read By Identifier responses keyed by (NAD, identifier, supplier ID,
+    # function ID). Entries expire `ttl` seconds after they were read and the
+    # least recently used one is evicted beyond `max_size` entries.
+    def __init__(self, ttl=60.0, max_size=256, clock=None):
+        if max_size < 1:
+            raise ValueError("IdentityCache max_size must be at least 1")
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock if clock is not None else MonotonicClock()
+        self.hits = 0
+        self.misses = 0
+        # key -> (expiry time, (response NAD, payload))
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        # Returns None on a miss
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self.ttl is None or self.clock.time() < entry[0]:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, response):
+        expiry = None if self.ttl is None else self.clock.time() + self.ttl
+        with self._lock:
+            self._entries[key] = (expiry, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, nad=None):
+        # Forgets everything known about nad, under the NAD it was read from or
+        # answered with, and every broadcast lookup, since which node answers
+        # one may have changed. nad=None or the broadcast NAD clears the cache
+        with self._lock:
+            if nad is None or nad == BROADCAST_NAD:
+                self._entries.clear()
+                return
+            for key, (_, (response_nad, _)) in list(self._entries.items()):
+                if key[0] in (nad, BROADCAST_NAD) or response_nad == nad:
+                    del self._entries[key]
@@ -0,0 +1,116 @@
+from .constants import MASTER_DIAGNOSTIC_FRAME_ID, SLAVE_DIAGNOSTIC_FRAME_ID, FLAG_CHECKSUM
+from .event import LinEvent
+
+
+def _parity(frame_id):
+    bits = [(frame_id >> n) & 1 for n in range(6)]
+    p0 = bits[0] ^ bits[1] ^ bits[2] ^ bits[4]
+    p1 = (bits[1] ^ bits[3] ^ bits[4] ^ bits[5]) ^ 1
+    return frame_id | (p0 << 6) | (p1 << 7)
+
+
+# Protected identifier of each of the 64 frame IDs, and the frame ID of each
+# valid protected identifier (0xff for parity errors)
+PID_TABLE = bytes(_parity(frame_id) for frame_id in range(64))
+FRAME_ID_TABLE = bytes(PID_TABLE.index(pid) if pid in PID_TABLE else 0xff for pid in range(256))
+
+def _inverted_carry_sum(total):
+    while total > 0xff:
+        total = (total & 0xff) + (total >> 8)
+    return ~total & 0xff
+
+
+# The LIN checksum is the inverted 8 bit sum with end-around carry. That sum
+# is associative, so it equals the plain sum of all bytes folded back into 8
+# bits, which is looked up here for every possible plain sum of up to 8 data
+# bytes plus the protected identifier
+CHECKSUM_TABLE = bytes(_inverted_carry_sum(total) for total in range(9 * 0xff + 1))
+
+_CLASSIC = int(LinEvent.ChecksumType.CLASSIC)
+_DIAGNOSTIC_FRAME_IDS = (MASTER_DIAGNOSTIC_FRAME_ID, SLAVE_DIAGNOSTIC_FRAME_ID)
+
+
+def protected_id(frame_id):
+    return PID_TABLE[frame_id]
+
+
+def frame_id_from_pid(pid):
+    frame_id = FRAME_ID_TABLE[pid]
+    if frame_id == 0xff:
+        raise ValueError(f"Parity error in protected identifier 0x{pid:02x}")
+    return frame_id
+
+
+def checksum(frame_id, payload, checksum_type=LinEvent.ChecksumType.ENHANCED):
+    # Diagnostic frames always use the classic checksum
+    if checksum_type == _CLASSIC or frame_id in _DIAGNOSTIC_FRAME_IDS:
+        return CHECKSUM_TABLE[sum(payload)]
+    return CHECKSUM_TABLE[sum(payload) + PID_TABLE[frame_id]]
+
+
+def verify(frame_id, payload, checksum_type, received):
+    return checksum(frame_id, payload, checksum_type) == received
+
+
+def event_checksum(event):
+    return checksum(event.event_id, event.event_payload, event.checksum_type)
+
+
+def with_checksum(event):
+    # The event with its checksum filled in, as a bus would carry it. Used by
+    # the simulated bus on every frame, hence no _replace()
+    event_id, payload, checksum_type = event[0], event[1], event[2]
+    total = sum(payload)
+    if checksum_type != _CLASSIC and event_id not in _DIAGNOSTIC_FRAME_IDS:
+        total += PID_TABLE[event_id]
+    return tuple.__new__(LinEvent, (event_id, payload, checksum_type, event[3], event[4], CHECKSUM_TABLE[total], False))
+
+
+def verify_event(event):
+    # Returns the event tagged with checksum_error if its checksum is known and
+    # wrong. Events without a checksum pass unchanged
+    if event.checksum is None or event.checksum_error:
+        return event
+    if event_checksum(event) != event.checksum:
+        return event._replace(checksum_error=True)
+    return event
+
+
+def verify_batch(batch):
+    # Checks every frame of a LinEventBatch with a known checksum, tags the
+    # bad ones in its checksum_errors column and returns their indices
+    bad = []
+    event_ids, lengths, checksum_types, checksums, errors = \
+        batch.event_ids, batch.lengths, batch.checksum_types, batch.checksums, batch.checksum_errors
+    payloads = batch.payloads
+    for index in range(len(event_ids)):
+        received = checksums[index]
+        if received < 0:
+            continue
+        start = index * 8
+        total = sum(payloads[start:start + lengths[index]])
+        event_id = event_ids[index]
+        if checksum_types[index] != _CLASSIC and event_id not in _DIAGNOSTIC_FRAME_IDS:
+            total += PID_TABLE[event_id]
+        if CHECKSUM_TABLE[total] != received:
+            errors[index] = 1
+            bad.append(index)
+    return bad
+
+
+def verify_records(records):
+    # Vectorized check of trace records (TraceReader.as_array()), returns a
+    # boolean array that is True for frames recorded with a wrong checksum
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("numpy is required for verify_records()") from None
+    payload = records["payload"].astype(numpy.uint16)
+    # Padding is zero, so summing all 8 slots is the sum of the data bytes
+    totals = payload.sum(axis=1)
+    event_ids = records["event_id"]
+    enhanced = (records["checksum_type"] != _CLASSIC) & (event_ids != MASTER_DIAGNOSTIC_FRAME_ID) & (event_ids != SLAVE_DIAGNOSTIC_FRAME_ID)
+    pid_table = numpy.frombuffer(PID_TABLE, dtype=numpy.uint8)
+    totals[enhanced] += pid_table[event_ids[enhanced] & 0x3f]
+    expected = numpy.frombuffer(CHECKSUM_TABLE, dtype=numpy.uint8)[totals]
+    return ((records["flags"] & FLAG_CHECKSUM) != 0) & (expected != records["checksum"])
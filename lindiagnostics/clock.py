@@ -0,0 +1,79 @@
+from threading import Lock
+import time
+
+class MonotonicClock:
+    is_virtual = False
+
+    def time(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def advance(self, seconds):
+        # Real time passes on its own
+        pass
+
+
+class VirtualClock:
+    # Discrete-event clock: time only moves when someone sleeps or when the
+    # simulated bus spends time transmitting a frame, and it moves instantly.
+    is_virtual = True
+
+    def __init__(self, start=0.0):
+        self._now = start
+        self._lock = Lock()
+
+    def time(self):
+        return self._now
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    def advance(self, seconds):
+        if seconds > 0:
+            with self._lock:
+                self._now += seconds
+
+
+def lin_frame_duration(payload_length, baud_rate):
+    # Nominal frame time from the LIN specification: a 34 bit header (break,
+    # sync and protected identifier) followed by the data bytes and checksum,
+    # 10 bits each. A header nobody answers occupies the whole maximum slot,
+    # 1.4 times the nominal time of an 8 byte frame.
+    if payload_length == 0:
+        return 1.4 * (34 + 10 * (8 + 1)) / baud_rate
+    return (34 + 10 * (payload_length + 1)) / baud_rate
+
+
+class TimestampMapper:
+    # Maps a device's timestamps onto the host's monotonic timebase. Each sample
+    # pairs a device timestamp with the host time it was read at. Frames can
+    # only be delayed on their way to the host, so the smallest offset seen is
+    # the best estimate. To follow the two clocks drifting apart, the offset
+    # may also grow by up to max_drift seconds per second.
+    def __init__(self, clock=None, max_drift=100e-6):
+        if clock is None:
+            clock = MonotonicClock()
+        self._clock = clock
+        self._max_drift = max_drift
+        self._offset = None
+        self._last_host_time = None
+
+    def map(self, device_time, host_time=None):
+        if host_time is None:
+            host_time = self._clock.time()
+        offset = host_time - device_time
+        if self._offset is None or offset < self._offset:
+            self._offset = offset
+        else:
+            allowance = self._max_drift * (host_time - self._last_host_time)
+            self._offset = min(offset, self._offset + allowance)
+        self._last_host_time = host_time
+        return device_time + self._offset
+
+    def reset(self):
+        # The device timer was restarted, e.g. after going bus on again
+        self._offset = None
+        self._last_host_time = None
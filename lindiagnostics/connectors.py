@@ -1,17 +1,32 @@
 from .constants import BROADCAST_NAD
 
-import time
+import logging
+from concurrent.futures import CancelledError
 from udsoncan.connections import BaseConnection
+from udsoncan.exceptions import TimeoutException
+
+logger = logging.getLogger(__name__)
 
 class LinDiagnosticsUDSConnector(BaseConnection):
-    def __init__(self, lin_master, slave_nad, name=None):
+    # Several connectors, each to a different slave, can share one LinMaster.
+    # Requests queue on the master's transport, which keeps one of them on the
+    # bus at a time, and each connector only receives the PDUs of its own NAD. response_timeout is how long the bus is held for a response
+    # nobody waits for, e.g. with suppressed positive responses
+    def __init__(self, lin_master, slave_nad, name=None, response_timeout=5.0):
         BaseConnection.__init__(self, name)
         self._lin_master = lin_master
         self._slave_nad = slave_nad
+        self.response_timeout = response_timeout
+        self._pending = None
+        # A connector to the broadcast NAD takes whatever no other connector does
+        self._receive_nad = None if slave_nad == BROADCAST_NAD else slave_nad
         self.opened = False
 
     def open(self):
+        if self._receive_nad is not None:
+            self._lin_master.subscribe(self._receive_nad)
         self.opened = True
+        return self
 
     def __enter__(self):
         return self
@@ -20,6 +35,9 @@ class LinDiagnosticsUDSConnector(BaseConnection):
         self.close()
 
     def close(self):
+        self._cancel_pending()
+        if self.opened and self._receive_nad is not None:
+            self._lin_master.unsubscribe(self._receive_nad)
         self.opened = False
 
     def is_open(self):
@@ -27,23 +45,45 @@ class LinDiagnosticsUDSConnector(BaseConnection):
 
     def specific_send(self, payload):
         sid = payload[0]
-        print(f"udsoncan requested to send SID: 0x{sid:X}, Payload: {payload}")
-        self._lin_master.send_diagnostic(self._slave_nad, sid, bytearray(payload[1:]))
-
-    def specific_wait_frame(self, timeout=2):
-        start_time = time.time()
-        while time.time() - start_time < 10:
-            result = self._lin_master.receive_diagnostic(timeout=timeout)
-            if result:
-                nad, sid, payload = result
-                print(f"Received: {nad}, {sid}, {payload}")
-                if (nad == BROADCAST_NAD) or (nad == self._slave_nad):
-                    return bytes([sid, *payload])
-        raise TimeoutError("Failed to receive response in time")
+        logger.debug(f"udsoncan requested to send SID: 0x{sid:X}, Payload: {payload}")
+        self._cancel_pending()
+        self._pending = self._lin_master.submit_diagnostic(self._slave_nad, sid, bytes(payload[1:]), response_timeout=self.response_timeout)
+
+    def specific_wait_frame(self, timeout=None):
+        # Blocks until a response arrives or the timeout given by udsoncan runs
+        # out. The first response completes the request, anything after it
+        # (e.g. the final response following a 0x78 response pending) arrives
+        # on this connector's receive queue
+        request, self._pending = self._pending, None
+        if request is not None:
+            try:
+                result = self._lin_master.wait_diagnostic(request, timeout)
+            except (TimeoutError, CancelledError):
+                result = None
+        else:
+            result = self._lin_master.receive_diagnostic(timeout=timeout, nad=self._receive_nad)
+        if result is None:
+            raise TimeoutException(f"Did not receive a response from NAD 0x{self._slave_nad:x} in time (timeout={timeout} sec)")
+        nad, sid, payload = result
+        logger.debug(f"Received: {nad}, {sid}, {payload}")
+        return bytes([sid, *payload])
+
+    def functional_request(self, payload, window=0.1, expected=None):
+        # Sends a UDS request once to every slave this connector addresses and
+        # returns a dict of NAD -> raw UDS response for those that answered
+        # within window seconds
+        responses = self._lin_master.functional_request(payload[0], payload[1:], window=window, nad=self._slave_nad, expected=expected)
+        return {nad: bytes([sid, *data]) for nad, (sid, data) in responses.items()}
+
+    def _cancel_pending(self):
+        request, self._pending = self._pending, None
+        if request is not None:
+            self._lin_master.cancel_diagnostic(request)
 
     def empty_rxqueue(self):
-        self._lin_master.empty_rxqueue()
+        # A response still owed to an earlier request is dropped as well
+        self._cancel_pending()
+        self._lin_master.empty_rxqueue(self._receive_nad)
 
     def empty_txqueue(self):
-        self._lin_master.empty_txqueue()
-
+        self._lin_master.empty_txqueue(self._slave_nad)
@@ -14,7 +14,15 @@ CONDITIONAL_CHANGE_NAD_SID = 0xB3
 ASSIGN_FRAME_IDENTIFIER_SID = 0xB1
 DATA_DUMP_SID = 0xB4
 ASSIGN_NAD_VIA_SNPD_SID = 0xb5
+NEGATIVE_RESPONSE_SID = 0x7F
 
 # Data Identifiers
 DATA_IDENTIFIER_LIN_PRODUCT_IDENTIFIER = 0
 DATA_IDENTIFIER_SERIAL_NUMBER = 1
+
+# Binary traces (see trace.py)
+TRACE_MAGIC = b"LINTRACE"
+TRACE_VERSION = 1
+# Record flags: the checksum byte is valid, and was wrong on the bus
+FLAG_CHECKSUM = 0x01
+FLAG_CHECKSUM_ERROR = 0x02
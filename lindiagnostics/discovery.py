@@ -0,0 +1,72 @@
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+import logging
+from .constants import *
+
+logger = logging.getLogger(__name__)
+
+# One slave found by a scan. The identifiers are None where the slave answered
+# negatively or stopped answering before they were read
+SlaveInfo = namedtuple("SlaveInfo", ("nad", "supplier_id", "function_id", "variant_id", "serial_number"))
+
+# NADs a slave can be configured to, 0x00 is for sleep commands and 0x7E-0x7F
+# are the functional and broadcast NADs
+SCAN_NADS = range(0x01, 0x7e)
+
+
+def _read_by_identifier(lin_master, nads, identifier, timeout):
+    # All requests are queued at once. The transport sends them back-to-back,
+    # each one holding the bus only until its slave answers or its deadline
+    # passes, so NADs nobody uses cost no more than the timeout
+    payload = bytes([identifier, BROADCAST_SUPPLIER_ID & 0xff, BROADCAST_SUPPLIER_ID >> 8,
+                     BROADCAST_FUNCTION_ID & 0xff, BROADCAST_FUNCTION_ID >> 8])
+    requests = [(nad, lin_master.submit_diagnostic(nad, READ_BY_IDENTIFIER_SID, payload, response_timeout=timeout)) for nad in nads]
+    responses = dict()
+    for nad, request in requests:
+        try:
+            responses[nad] = lin_master.wait_diagnostic(request)
+        except (TimeoutError, CancelledError):
+            pass
+    return responses
+
+
+def scan(lin_master, nads=SCAN_NADS, timeout=0.15, retries=1, serial_numbers=True):
+    # Finds the slaves on a bus by reading the product identifier of every NAD
+    # in nads, then the serial numbers of those that answered. timeout is the
+    # per request deadline. The default leaves room above the 50 ms P2_min a
+    # slave may take to respond. NADs that answered without their identity,
+    # negatively or cut short, are asked again up to retries times. Silent
+    # NADs are not, on a sparse cluster that would repeat most of the scan.
+    # Returns SlaveInfo tuples ordered by NAD
+    found = dict()
+    remaining = list(nads)
+    for attempt in range(1 + retries):
+        if not remaining:
+            break
+        responses = _read_by_identifier(lin_master, remaining, DATA_IDENTIFIER_LIN_PRODUCT_IDENTIFIER, timeout)
+        for nad, (_, rsid, payload) in responses.items():
+            if rsid == NEGATIVE_RESPONSE_SID or len(payload) < 5:
+                found[nad] = SlaveInfo(nad, None, None, None, None)
+            else:
+                found[nad] = SlaveInfo(nad, payload[0] | payload[1] << 8, payload[2] | payload[3] << 8, payload[4], None)
+        remaining = [nad for nad in responses if found[nad].supplier_id is None]
+
+    if serial_numbers and found:
+        responses = _read_by_identifier(lin_master, sorted(found), DATA_IDENTIFIER_SERIAL_NUMBER, timeout)
+        for nad, (_, rsid, payload) in responses.items():
+            if rsid != NEGATIVE_RESPONSE_SID and len(payload) >= 4:
+                found[nad] = found[nad]._replace(serial_number=bytes(payload[:4]))
+
+    logger.debug(f"Found {len(found)} slaves: {', '.join(f'0x{nad:02x}' for nad in sorted(found))}")
+    return [found[nad] for nad in sorted(found)]
+
+
+def scan_channels(lin_masters, **kwargs):
+    # Scans several buses at once, one thread per LinMaster. Takes the same
+    # keyword arguments as scan() and returns a list of inventories in the
+    # order of lin_masters
+    lin_masters = list(lin_masters)
+    if not lin_masters:
+        return []
+    with ThreadPoolExecutor(max_workers=len(lin_masters)) as executor:
+        return list(executor.map(lambda lin_master: scan(lin_master, **kwargs), lin_masters))
@@ -1,2 +1,3 @@
 from .simulated import SimulatedLinNetwork
-from .kvaser import KvaserLinDriver
\ No newline at end of file
+from .kvaser import KvaserLinDriver
+from .replay import ReplayLinDriver
\ No newline at end of file
@@ -1,8 +1,14 @@
-import queue
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from threading import Thread, Event, Condition
+import logging
 import time
 
-from ..event import LinEvent
+from ..event import LinEvent, LinEventBatch
 from ..constants import *
+from ..queues import RingBuffer, DropPolicy
+from ..clock import MonotonicClock, TimestampMapper
+from ..checksum import verify
 
 has_linlib = False
 try:
@@ -13,7 +19,45 @@ try:
 except ImportError:
     pass
 
+logger = logging.getLogger(__name__)
+
+class KvaserReaderThread(Thread):
+    def __init__(self, driver, read_timeout=0.050):
+        Thread.__init__(self, daemon=True)
+        self._driver = driver
+        self._read_timeout_ms = int(read_timeout * 1000)
+        self._running = Event()
+
+    def run(self):
+        self._running.clear()
+        while not self._running.is_set():
+            try:
+                frame = self._driver.channel.read(timeout=self._read_timeout_ms)
+            except linlib.exceptions.LinNoMessageError:
+                pass
+            except Exception as e:
+                # The channel cannot be read any more: stop, and let the driver
+                # fail everything that waits on it
+                self._driver._on_reader_error(e)
+                break
+            else:
+                try:
+                    self._driver._on_frame(frame, time.monotonic())
+                except Exception:
+                    # A frame that cannot be converted, or a failing event
+                    # callback, must not stop the reader
+                    logger.exception("Failed to handle a received LIN frame")
+            self._driver._expire_tx()
+
+    def stop(self):
+        self._running.set()
+
+
 class KvaserLinDriver:
+    # A reader thread converts frames as they arrive, read_events() packs the
+    # already converted events
+    native_batches = False
+
     @staticmethod
     def get_virtual_channel(serial, port):
         if not has_linlib:
@@ -33,11 +77,29 @@ class KvaserLinDriver:
         else:
             raise IOError(f"Kvaser serial {serial} was not found. Check your drivers.")
 
-    def __init__(self, virtual_channel, is_slave, baud_rate=19200, lin_2=True):
+    def __init__(self, virtual_channel, is_slave, baud_rate=19200, lin_2=True, buffer_size=4096, drop_policy=DropPolicy.DROP_OLDEST,
+                 tx_window=1, tx_timeout=1, on_tx_error=None):
         self.is_slave = is_slave
-        self.driver_event_queue = queue.Queue()
+        # Bounded: under sustained load the oldest (or newest, depending on the
+        # drop policy) events are discarded and counted in overflow_count
+        self.driver_event_queue = RingBuffer(buffer_size, drop_policy)
         self.baud_rate = baud_rate
         self.lin_2 = lin_2
+        self.event_callback = None
+        # Up to tx_window frames may be written before their TX echoes come
+        # back. With a window of one, write_message() waits for each echo
+        self.tx_window = tx_window
+        self.tx_timeout = tx_timeout
+        self.on_tx_error = on_tx_error
+        self._tx_lock = Condition()
+        self._pending_tx = deque()
+        # The error that stopped the reader thread, raised by read_event() once
+        # the events read before it have been delivered
+        self.reader_error = None
+        # Event timestamps come from the adapter and are mapped onto the host's
+        # monotonic clock, which is also what the transport uses
+        self.clock = MonotonicClock()
+        self._timestamps = TimestampMapper(self.clock)
 
         if self.is_slave:
             self.channel = linlib.openSlave(1)
@@ -53,67 +115,185 @@ class KvaserLinDriver:
 
         self.channel.busOn()
         self.channel.setupLIN(flags=self.flags, bps=self.baud_rate)
+        self._timestamps.reset()
 
-    def read_event(self, timeout=0):
+        # The reader thread is the only place the channel is read from
+        self._reader = KvaserReaderThread(self)
+        self._reader.start()
 
-        if timeout is None:
-            read_timeout_ms = 0xFFFFFFFF
-        else:
-            read_timeout_ms = int(timeout * 1000) # Seconds to milliseconds
+    @property
+    def overflow_count(self):
+        return self.driver_event_queue.overflow_count
 
-        try:
-            while True:
-                print("Reading event from driver, timeout", read_timeout_ms)
-                self.driver_event_queue.put(self.channel.read(timeout=read_timeout_ms))
-        except linlib.exceptions.LinNoMessageError:
-            pass
-
-        if self.driver_event_queue.empty():
-            return None
-        else:
-            # Convert linlib event into our standardized format
-            event = self.driver_event_queue.get()
+    def close(self):
+        if self._reader is not None:
+            self._reader.stop()
+            self._reader.join()
+            self._reader = None
+        self.channel.busOff()
+        self.channel.close()
+
+    def set_event_callback(self, callback):
+        self.event_callback = callback
 
-            direction = LinEvent.Direction.RX
-            if event.flags & linlib.MessageFlag.TX:
-                direction = LinEvent.Direction.TX
-            timestamp = time.time() # Todo: Use Kvaser IOCTL and magic
-            lin_id = event.id
-            if self.lin_2 and event.id not in (MASTER_DIAGNOSTIC_FRAME_ID, SLAVE_DIAGNOSTIC_FRAME_ID):
-                checksum_type = LinEvent.ChecksumType.ENHANCED
+    def _on_frame(self, frame, host_time=None):
+        event = LinEvent(*self._convert_frame(frame, host_time))
+        if event.direction == LinEvent.Direction.TX:
+            self._confirm_tx(event)
+        self.driver_event_queue.put(event)
+        if self.event_callback is not None:
+            self.event_callback()
+
+    def _confirm_tx(self, event):
+        # Echoes come back in the order frames were written, so the oldest
+        # pending write with the same frame is the one being confirmed
+        with self._tx_lock:
+            for pending in self._pending_tx:
+                event_id, payload, confirmation, _ = pending
+                if event_id == event.event_id and payload == event.event_payload:
+                    self._pending_tx.remove(pending)
+                    self._tx_lock.notify_all()
+                    break
             else:
-                checksum_type = LinEvent.ChecksumType.CLASSIC
+                return
+        confirmation.set_result(event)
+
+    def _expire_tx(self):
+        now = time.monotonic()
+        expired = []
+        with self._tx_lock:
+            # Frames written with different timeouts do not expire in the
+            # order they were written
+            for pending in self._pending_tx:
+                deadline = pending[3]
+                if deadline is not None and deadline <= now:
+                    expired.append(pending)
+            if expired:
+                for pending in expired:
+                    self._pending_tx.remove(pending)
+                self._tx_lock.notify_all()
+        for event_id, _, confirmation, _ in expired:
+            confirmation.set_exception(TimeoutError(f"Timed out waiting for frame 0x{event_id:X} to be confirmed"))
+
+    def _on_reader_error(self, error):
+        logger.error(f"Reading from the Kvaser channel failed, no more frames will be received: {error!r}")
+        self.reader_error = error
+        with self._tx_lock:
+            failed = list(self._pending_tx)
+            self._pending_tx.clear()
+            self._tx_lock.notify_all()
+        for event_id, _, confirmation, _ in failed:
+            confirmation.set_exception(ConnectionError(f"Frame 0x{event_id:X} cannot be confirmed, the channel is not read any more"))
+        # Wakes up a blocked read_event()
+        self.driver_event_queue.put(None)
+
+    def _report_tx_error(self, lin_event, confirmation):
+        if self.on_tx_error is not None and not confirmation.cancelled() and confirmation.exception() is not None:
+            self.on_tx_error(lin_event, confirmation.exception())
+
+    def read_event(self, timeout=0):
+        # timeout=None waits forever. Raises ConnectionError once the reader
+        # thread has failed and everything it read has been returned
+        block = (timeout is None or timeout > 0) and self.reader_error is None
+        event = self.driver_event_queue.get(block=block, timeout=timeout)
+        if event is None and self.reader_error is not None:
+            raise ConnectionError("The Kvaser channel is not read any more") from self.reader_error
+        return event
+
+    def read_events(self, timeout=0, max_events=None):
+        batch = LinEventBatch()
+        event = self.read_event(timeout)
+        while event is not None:
+            batch.append(event)
+            if max_events is not None and len(batch) >= max_events:
+                break
+            # A reader error is raised by the next call, not at the cost of
+            # the events already taken
+            event = self.driver_event_queue.get()
+        return batch
+
+    def _convert_frame(self, event, host_time=None):
+        direction = LinEvent.Direction.RX
+        if event.flags & linlib.MessageFlag.TX:
+            direction = LinEvent.Direction.TX
+        # canlib reports LIN frame timestamps in milliseconds
+        device_timestamp = event.timestamp
+        if device_timestamp is None:
+            device_timestamp = event.info.timestamp
+        timestamp = self._timestamps.map(device_timestamp / 1000, host_time)
+        lin_id = event.id
+        if self.lin_2 and event.id not in (MASTER_DIAGNOSTIC_FRAME_ID, SLAVE_DIAGNOSTIC_FRAME_ID):
+            checksum_type = LinEvent.ChecksumType.ENHANCED
+        else:
+            checksum_type = LinEvent.ChecksumType.CLASSIC
+        data = bytes(event.data)
+        checksum, checksum_error = None, False
+        if data and not event.flags & linlib.MessageFlag.NODATA:
             checksum = event.info.checkSum
-            return LinEvent(lin_id, event.data, checksum_type, direction=direction, timestamp=timestamp)
+            checksum_error = (bool(event.flags & (linlib.MessageFlag.CSUM_ERROR | linlib.MessageFlag.PARITY_ERROR)) or
+                              not verify(lin_id, data, checksum_type, checksum))
+        return lin_id, data, checksum_type, direction, timestamp, checksum, checksum_error
 
-    def write_message(self, lin_event, timeout=1):
+    def write_message(self, lin_event, timeout=None, block=None):
+        # Returns a future resolved with the TX echo, or failed with a
+        # TimeoutError (also reported through on_tx_error) if none arrives
+        # within timeout seconds. A TX window that stays full for timeout
+        # seconds raises TimeoutError, reported the same way. Unless block is
+        # given, only a window of one waits for the echo here, larger windows
+        # return as soon as the frame is written.
         # TODO: Error if event is not diagnostic and does not match checksum type
         # Kvaser can't send with mixed types
-        frame = LINFrame(lin_event.event_id, lin_event.event_payload)
-        if not self.is_slave:
-            print("Writing message")
-            print(lin_event)
+        if self.is_slave:
+            raise NotImplementedError("LIN Master's can call write_message()")
+        if self.reader_error is not None:
+            raise ConnectionError("The Kvaser channel is not read any more, frames cannot be confirmed") from self.reader_error
 
-            # Write the frame
+        if timeout is None:
+            timeout = self.tx_timeout
+        if block is None:
+            block = self.tx_window <= 1
+
+        frame = LINFrame(lin_event.event_id, lin_event.event_payload)
+        confirmation = Future()
+        confirmation.add_done_callback(lambda confirmation: self._report_tx_error(lin_event, confirmation))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        window_full = False
+        with self._tx_lock:
+            # Backpressure: wait for the window to have room
+            while len(self._pending_tx) >= self.tx_window:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    window_full = True
+                    break
+                self._tx_lock.wait(remaining)
+            if not window_full:
+                # Registered before writing so that a fast echo cannot be missed
+                pending = (lin_event.event_id, lin_event.event_payload, confirmation, deadline)
+                self._pending_tx.append(pending)
+        if window_full:
+            # Failing the confirmation reports the error through on_tx_error,
+            # outside the lock
+            confirmation.set_exception(TimeoutError("Timed out waiting for room in the TX window"))
+            raise confirmation.exception()
+        try:
             self.channel.writeMessage(frame)
-            # Read until timeout or confirmed
-            start_time = time.time()
-            while (timeout is None) or (time.time() - start_time < timeout):
-                read_timeout_ms = int(max(timeout - (time.time() - start_time), 0)) * 1000
-                if timeout is None:
-                    read_timeout_ms = 0xFFFFFFFF
-                try:
-                    event = self.channel.read(timeout=read_timeout_ms)
-                    print(event)
-                    self.driver_event_queue.put(event)
-                    if event.id == lin_event.event_id and (event.flags & linlib.MessageFlag.TX):
-                        print("Confirmed")
-                        return
-                except linlib.exceptions.LinNoMessageError:
-                    pass
-            raise TimeoutError("Timed out waiting for write message to confirm")
-        else:
-            raise NotImplementedError("LIN Master's can call write_message()")
+        except Exception as e:
+            # A frame that never went out frees its place in the window and
+            # fails with the real error, not a later timeout
+            with self._tx_lock:
+                if pending in self._pending_tx:
+                    self._pending_tx.remove(pending)
+                self._tx_lock.notify_all()
+            if not confirmation.done():
+                confirmation.set_exception(e)
+            raise
+
+        if block:
+            try:
+                confirmation.result(timeout)
+            except FutureTimeoutError:
+                raise TimeoutError("Timed out waiting for write message to confirm") from None
+        return confirmation
 
     def schedule_slave_response(self, lin_event):
         frame = LINFrame(lin_event.event_id, lin_event.event_payload)
@@ -123,8 +303,6 @@ class KvaserLinDriver:
             raise NotImplementedError("Only LIN Slave's can call schedule_slave_response()")
 
     def request_slave_response(self, message_id):
-        print(f"Requested ID: {message_id} from slave")
-
         if not self.is_slave:
             self.channel.requestMessage(message_id)
         else:
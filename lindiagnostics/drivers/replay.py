@@ -0,0 +1,153 @@
+from collections import deque, namedtuple
+from threading import Condition
+import os
+from ..event import LinEvent, LinEventBatch
+from ..constants import MASTER_DIAGNOSTIC_FRAME_ID
+from ..clock import MonotonicClock
+from ..trace import TraceReader
+
+ReplayMismatch = namedtuple("ReplayMismatch", ("index", "expected", "actual"))
+
+
+class ReplayLinDriver:
+    # Plays a recorded master-side trace back to a Transport or LinMaster.
+    #
+    # Recorded events are delivered at their original spacing divided by speed,
+    # or as fast as possible when speed is None. Diagnostic frames the recorded
+    # master sent are sync points: replay holds there until the master under
+    # test writes its own frame, and the timing restarts from that moment, so
+    # slave response times are kept however long the master took. Frames that
+    # differ from the recording are collected in `mismatches`.
+    native_batches = False
+    is_slave = False
+
+    def __init__(self, trace, speed=1.0, clock=None, sync=True):
+        if speed is not None and speed <= 0:
+            raise ValueError("Replay speed must be positive, or None to replay as fast as possible")
+        self._owns_trace = isinstance(trace, (str, os.PathLike))
+        if self._owns_trace:
+            trace = TraceReader(trace)
+        self.trace = trace
+        self.speed = speed
+        self.sync = sync
+        if clock is None:
+            clock = MonotonicClock()
+        self.clock = clock
+        self.mismatches = []
+        self.event_callback = None
+        self._index = 0
+        self._next_event = None
+        self._echoes = deque()
+        self._condition = Condition()
+        self._base_time = clock.time()
+        self._base_timestamp = None
+
+    @property
+    def finished(self):
+        return self._index >= len(self.trace) and not self._echoes
+
+    def set_event_callback(self, callback):
+        self.event_callback = callback
+
+    def close(self):
+        if self._owns_trace:
+            self.trace.close()
+
+    def _peek(self):
+        # Decoding a trace record is not free, and the same record is looked at
+        # on every poll until it is due
+        if self._next_event is None and self._index < len(self.trace):
+            self._next_event = self.trace[self._index]
+        return self._next_event
+
+    def _pop(self):
+        event = self._peek()
+        self._index += 1
+        self._next_event = None
+        return event
+
+    def _is_sync_point(self, event):
+        return (self.sync and event.event_id == MASTER_DIAGNOSTIC_FRAME_ID and
+                event.direction == LinEvent.Direction.TX)
+
+    def _due(self, event):
+        timestamp = event.timestamp
+        if self.speed is None or timestamp is None:
+            return None
+        if self._base_timestamp is None:
+            self._base_timestamp = timestamp
+        return self._base_time + (timestamp - self._base_timestamp) / self.speed
+
+    def _rebase(self, event, now):
+        if event.timestamp is not None:
+            self._base_time = now
+            self._base_timestamp = event.timestamp
+
+    def read_event(self, timeout):
+        # timeout=None waits forever. Nothing blocks on a virtual clock, time
+        # only moves when the transport sleeps
+        with self._condition:
+            deadline = None
+            if timeout is not None:
+                deadline = self.clock.time() + timeout
+            while True:
+                if self._echoes:
+                    return self._echoes.popleft()
+
+                now = self.clock.time()
+                wait = None
+                event = self._peek()
+                if event is not None:
+                    if not self._is_sync_point(event):
+                        due = self._due(event)
+                        if due is None or due <= now:
+                            self._pop()
+                            return event.stamped(event.direction, now if due is None else due)
+                        wait = due - now
+
+                if self.clock.is_virtual or (timeout is not None and now >= deadline):
+                    return None
+                if deadline is not None:
+                    remaining = deadline - now
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._condition.wait(wait)
+
+    def read_events(self, timeout, max_events=None):
+        batch = LinEventBatch()
+        event = self.read_event(timeout)
+        while event is not None:
+            batch.append(event)
+            if max_events is not None and len(batch) >= max_events:
+                break
+            event = self.read_event(0)
+        return batch
+
+    def write_message(self, lin_event):
+        with self._condition:
+            now = self.clock.time()
+            expected = None
+            while self._peek() is not None:
+                event = self._pop()
+                if self._is_sync_point(event):
+                    expected = event
+                    self._rebase(event, now)
+                    break
+                # The master went ahead of the recording, whatever it skipped
+                # is still delivered in order
+                self._echoes.append(event.stamped(event.direction, now))
+
+            if (expected is None or expected.event_id != lin_event.event_id or
+                    bytes(expected.event_payload) != bytes(lin_event.event_payload)):
+                self.mismatches.append(ReplayMismatch(self._index - 1 if expected is not None else None, expected, lin_event))
+
+            self._echoes.append(lin_event.stamped(LinEvent.Direction.TX, now))
+            self._condition.notify_all()
+        if self.event_callback is not None:
+            self.event_callback()
+
+    def schedule_slave_response(self, lin_event):
+        # Slave responses come from the recording
+        pass
+
+    def request_slave_response(self, message_id):
+        pass
@@ -1,28 +1,107 @@
-from copy import deepcopy
-import queue
-import time
+from collections import deque, OrderedDict
+from threading import Event
 from ..slave import LinSlave
-from ..event import LinEvent
+from ..event import LinEvent, LinEventBatch
+from ..constants import BROADCAST_NAD, MASTER_DIAGNOSTIC_FRAME_ID
+from ..clock import MonotonicClock, lin_frame_duration
+from ..checksum import with_checksum
+from ..queues import DropPolicy
+
+# Zero padding of a payload of each length to its 8 byte batch slot
+_PADDING = [bytes(LinEventBatch.PAYLOAD_SIZE - length) for length in range(LinEventBatch.PAYLOAD_SIZE + 1)]
+_NAN = float("nan")
+
 
 class SimulatedLinDriver:
-    def __init__(self, network, is_slave):
+    # The transport reads whatever is queued as one LinEventBatch per cycle
+    native_batches = True
+
+    def __init__(self, network, is_slave, buffer_size=4096, drop_policy=DropPolicy.DROP_OLDEST):
         self.is_slave = is_slave
         self.network = network
-        self.event_queue = queue.Queue()
+        self.clock = network.clock
+        # deque append/popleft are atomic, so the common non-blocking path needs
+        # no locking. The event is only used by blocking readers. Bounded like
+        # the hardware drivers: a full deque discards its oldest event on
+        # append, or the new one is dropped, and either is counted
+        self.event_queue = deque(maxlen=buffer_size)
+        self.drop_policy = DropPolicy(drop_policy)
+        self.overflow_count = 0
+        self.event_available = Event()
+        self.event_callback = None
+
+    def set_event_callback(self, callback):
+        self.event_callback = callback
+
+    def put_event(self, lin_event):
+        if len(self.event_queue) == self.event_queue.maxlen:
+            self.overflow_count += 1
+            if self.drop_policy == DropPolicy.DROP_NEWEST:
+                return
+        self.event_queue.append(lin_event)
+        self.event_available.set()
+        if self.event_callback is not None:
+            self.event_callback()
+
+    def has_events(self):
+        return len(self.event_queue) > 0
 
     def read_event(self, timeout):
         try:
-            return self.event_queue.get(block=True, timeout=timeout)
-        except queue.Empty:
+            return self.event_queue.popleft()
+        except IndexError:
+            if not timeout and timeout is not None:
+                return None
+        self.event_available.clear()
+        # An event put between the first attempt and the clear must not be missed
+        if not self.event_queue:
+            self.event_available.wait(timeout)
+        try:
+            return self.event_queue.popleft()
+        except IndexError:
             return None
 
+    def read_events(self, timeout, max_events=None):
+        # Drains the queue into the batch columns, the events already hold
+        # what the columns store so no conversion is needed
+        batch = LinEventBatch()
+        event = self.read_event(timeout)
+        if event is None:
+            return batch
+        event_ids, payloads, lengths, checksum_types = batch.event_ids, batch.payloads, batch.lengths, batch.checksum_types
+        directions, timestamps, checksums, checksum_errors = batch.directions, batch.timestamps, batch.checksums, batch.checksum_errors
+        event_queue = self.event_queue
+        count = 0
+        while True:
+            event_id, payload, checksum_type, direction, timestamp, checksum, checksum_error = event
+            length = len(payload)
+            if length > LinEventBatch.PAYLOAD_SIZE:
+                raise ValueError(f"LIN frames carry at most {LinEventBatch.PAYLOAD_SIZE} bytes, got {length}")
+            event_ids.append(event_id)
+            payloads += payload
+            payloads += _PADDING[length]
+            lengths.append(length)
+            checksum_types.append(checksum_type)
+            directions.append(-1 if direction is None else direction)
+            timestamps.append(_NAN if timestamp is None else timestamp)
+            checksums.append(-1 if checksum is None else checksum)
+            checksum_errors.append(1 if checksum_error else 0)
+            count += 1
+            if count == max_events:
+                break
+            try:
+                event = event_queue.popleft()
+            except IndexError:
+                break
+        return batch
+
     def write_message(self, lin_event):
         if not self.is_slave:
             self.network.write_message(lin_event)
 
     def schedule_slave_response(self, lin_event):
         if self.is_slave:
-            self.network.schedule_slave_response(lin_event)
+            self.network.schedule_slave_response(lin_event, self)
 
     def request_slave_response(self, message_id):
         if not self.is_slave:
@@ -30,69 +109,117 @@ class SimulatedLinDriver:
 
 
 class SimulatedLinNetwork:
-    def __init__(self):
+    # With a VirtualClock every frame advances time by its duration at
+    # baud_rate, and masters on the network run in stepped mode
+    def __init__(self, clock=None, baud_rate=19200, buffer_size=4096, drop_policy=DropPolicy.DROP_OLDEST):
+        if clock is None:
+            clock = MonotonicClock()
+        self.clock = clock
+        self.baud_rate = baud_rate
+        # Event queue bounds of every driver on the network
+        self.buffer_size = buffer_size
+        self.drop_policy = drop_policy
+        # Frame ID -> OrderedDict of scheduling slave driver -> event. When
+        # several slaves have a response ready (e.g. to a functional request)
+        # they publish in the order they scheduled, each finishing its PDU
+        # before the next one starts
         self.slave_responses = dict()
-        self.slave_rx_queue = queue.Queue()
         self.master_driver = None
         self.slave_drivers = []
         self.slaves = []
         self.callbacks = []
+        # NAD -> [(slave driver, slave)], so that addressed diagnostic frames
+        # only reach their target regardless of how many slaves are registered
+        self.slaves_by_nad = dict()
+        self.slave_by_driver = dict()
 
     def write_message(self, lin_event):
-        print(f"Writing Message: {lin_event}")
-        event_time = time.time()
+        event_time = self.clock.time()
+        self.clock.advance(lin_frame_duration(len(lin_event.event_payload), self.baud_rate))
+        lin_event = with_checksum(lin_event)
 
-        master_tx_event = deepcopy(lin_event)
-        master_tx_event.timestamp = event_time
-        master_tx_event.direction = LinEvent.Direction.TX
-        self.master_driver.event_queue.put(lin_event)
+        # One stamped event per direction is shared by every receiver
+        self.master_driver.put_event(lin_event.stamped(LinEvent.Direction.TX, event_time))
 
-        slave_rx_event = deepcopy(lin_event)
-        slave_rx_event.direction = LinEvent.Direction.RX
-        slave_rx_event.timestamp = event_time
+        slave_rx_event = lin_event.stamped(LinEvent.Direction.RX, event_time)
+        payload = lin_event.event_payload
+        if lin_event.event_id == MASTER_DIAGNOSTIC_FRAME_ID and len(payload) > 0 and payload[0] != BROADCAST_NAD:
+            targets = list(self.slaves_by_nad.get(payload[0], ()))
+        else:
+            targets = list(zip(self.slave_drivers, self.slaves))
 
-        for slave_driver in self.slave_drivers:
-            slave_driver.event_queue.put(slave_rx_event)
+        for slave_driver, _ in targets:
+            slave_driver.put_event(slave_rx_event)
 
-        for slave in self.slaves:
-            slave.simulate()
+        self._simulate(targets)
 
     def request_slave_response(self, message_id):
-        print(f"Requesting Slave Response: {message_id}")
-        try:
-            result = self.slave_responses.pop(message_id)
-        except KeyError:
+        event_time = self.clock.time()
+        responses = self.slave_responses.get(message_id)
+        if not responses:
+            self.clock.advance(lin_frame_duration(0, self.baud_rate))
             return
-
-        event_time = time.time()
-
-        slave_tx_event = deepcopy(result)
-        slave_tx_event.direction = LinEvent.Direction.TX
-        slave_tx_event.timestamp = event_time
-        for slave_driver in self.slave_drivers:
-            slave_driver.event_queue.put(slave_tx_event)
-
-        master_rx_event = deepcopy(result)
-        master_rx_event.direction = LinEvent.Direction.RX
-        master_rx_event.timestamp = event_time
-
-        self.master_driver.event_queue.put(master_rx_event)
-
-        for slave in self.slaves:
-            slave.simulate()
-
-    def schedule_slave_response(self, lin_event):
-        print(f"Scheduling Slave Response: {lin_event}")
-        self.slave_responses[lin_event.event_id] = lin_event
+        slave_driver, result = responses.popitem(last=False)
+
+        self.clock.advance(lin_frame_duration(len(result.event_payload), self.baud_rate))
+        result = with_checksum(result)
+
+        # Only the publishing slave needs to see its own transmission, for
+        # everyone else it would be ignored input
+        if slave_driver is not None:
+            slave_driver.put_event(result.stamped(LinEvent.Direction.TX, event_time))
+        else:
+            slave_tx_event = result.stamped(LinEvent.Direction.TX, event_time)
+            for slave_driver in self.slave_drivers:
+                slave_driver.put_event(slave_tx_event)
+
+        self.master_driver.put_event(result.stamped(LinEvent.Direction.RX, event_time))
+
+        if slave_driver is not None:
+            self._simulate([(slave_driver, self.slave_by_driver[slave_driver])])
+            # The TX echo makes the slave schedule its next frame, which
+            # continues its PDU rather than waiting behind the other slaves
+            if slave_driver in responses:
+                responses.move_to_end(slave_driver, last=False)
+        else:
+            self._simulate(zip(self.slave_drivers, self.slaves))
+
+    def _simulate(self, targets):
+        for slave_driver, slave in targets:
+            if slave_driver.has_events():
+                nad = slave.nad
+                slave.simulate()
+                if slave.nad != nad:
+                    # Assign NAD or Conditional Change NAD took effect
+                    self._unindex_slave(slave_driver, slave, nad)
+                    self._index_slave(slave_driver, slave)
+
+    def _index_slave(self, slave_driver, slave):
+        self.slaves_by_nad.setdefault(slave.nad, []).append((slave_driver, slave))
+
+    def _unindex_slave(self, slave_driver, slave, nad):
+        entries = self.slaves_by_nad.get(nad, [])
+        entries.remove((slave_driver, slave))
+        if not entries:
+            del self.slaves_by_nad[nad]
+
+    def schedule_slave_response(self, lin_event, slave_driver=None):
+        # A slave rescheduling replaces its own response and keeps its turn
+        responses = self.slave_responses.get(lin_event.event_id)
+        if responses is None:
+            responses = self.slave_responses[lin_event.event_id] = OrderedDict()
+        responses[slave_driver] = lin_event
 
     def get_master_driver(self):
         if self.master_driver is None:
-            self.master_driver = SimulatedLinDriver(self, False)
+            self.master_driver = SimulatedLinDriver(self, False, self.buffer_size, self.drop_policy)
         return self.master_driver
 
     def register_slave(self, nad, supplier_id, function_id, variant_id, serial_number=None):
-        slave_driver = SimulatedLinDriver(self, True)
+        slave_driver = SimulatedLinDriver(self, True, self.buffer_size, self.drop_policy)
         slave = LinSlave(nad, supplier_id, function_id, variant_id, slave_driver, serial_number=serial_number)
         self.slaves.append(slave)
         self.slave_drivers.append(slave_driver)
+        self.slave_by_driver[slave_driver] = slave
+        self._index_slave(slave_driver, slave)
         return slave
@@ -1,6 +1,19 @@
+from array import array
+from collections import namedtuple
 from enum import IntEnum
 
-class LinEvent:
+_LinEventFields = namedtuple("LinEvent", ("event_id", "event_payload", "checksum_type", "direction", "timestamp",
+                                          "checksum", "checksum_error"))
+_LinEventFields.__new__.__defaults__ = (None, None, None, False)
+
+class LinEvent(_LinEventFields):
+    # An immutable tuple with no per-instance __dict__: captures hold millions
+    # of these, and immutability lets one instance be shared between queues
+    # instead of being copied. event_payload is expected to be bytes.
+    # checksum is the checksum byte seen on the bus, if the driver reports it,
+    # and checksum_error tags frames whose checksum did not verify.
+    __slots__ = ()
+
     class Direction(IntEnum):
         RX = 0
         TX = 1
@@ -9,16 +22,125 @@ class LinEvent:
         CLASSIC = 0
         ENHANCED = 1
 
-    def __init__(self, event_id, event_payload, checksum_type, direction=None, timestamp=None):
-        self.event_id = event_id
-        self.event_payload = event_payload
-        self.checksum_type = checksum_type
-        self.direction = direction
-        self.timestamp = timestamp
+    def replace(self, **changes):
+        return self._replace(**changes)
+
+    def stamped(self, direction, timestamp):
+        # Fast path of replace() for drivers stamping every frame they deliver
+        return tuple.__new__(LinEvent, (self[0], self[1], self[2], direction, timestamp, self[5], self[6]))
 
     def __str__(self):
         return repr(self)
 
     def __repr__(self):
         hex_dump = ", ".join([f"0x{x:x}" for x in self.event_payload])
-        return f"LinEvent(0x{self.event_id:X}, bytes([{hex_dump}]), {self.checksum_type}, {self.direction}, {self.timestamp})"
+        checksum = ""
+        if self.checksum is not None:
+            checksum = f", checksum=0x{self.checksum:02x}{', error' if self.checksum_error else ''}"
+        return f"LinEvent(0x{self.event_id:X}, bytes([{hex_dump}]), {self.checksum_type}, {self.direction}, {self.timestamp}{checksum})"
+
+
+class LinEventBatch:
+    # Column-wise storage of many frames in contiguous arrays. Each payload
+    # occupies an 8 byte slot of `payloads`, its real length is in `lengths`.
+    # Unknown directions and checksums are stored as -1 and unknown timestamps
+    # as NaN.
+    __slots__ = ("event_ids", "payloads", "lengths", "checksum_types", "directions", "timestamps",
+                 "checksums", "checksum_errors")
+
+    PAYLOAD_SIZE = 8
+
+    def __init__(self, events=None):
+        self.event_ids = array("B")
+        self.payloads = bytearray()
+        self.lengths = array("B")
+        self.checksum_types = array("B")
+        self.directions = array("b")
+        self.timestamps = array("d")
+        self.checksums = array("h")
+        self.checksum_errors = array("B")
+        if events is not None:
+            self.extend(events)
+
+    def __len__(self):
+        return len(self.event_ids)
+
+    def __iter__(self):
+        for index in range(len(self.event_ids)):
+            yield self[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            batch = LinEventBatch()
+            batch.event_ids = self.event_ids[index]
+            batch.lengths = self.lengths[index]
+            batch.checksum_types = self.checksum_types[index]
+            batch.directions = self.directions[index]
+            batch.timestamps = self.timestamps[index]
+            batch.checksums = self.checksums[index]
+            batch.checksum_errors = self.checksum_errors[index]
+            for position in range(*index.indices(len(self))):
+                start = position * LinEventBatch.PAYLOAD_SIZE
+                batch.payloads += self.payloads[start:start + LinEventBatch.PAYLOAD_SIZE]
+            return batch
+
+        if index < 0:
+            index += len(self)
+        direction = self.directions[index]
+        timestamp = self.timestamps[index]
+        checksum = self.checksums[index]
+        return LinEvent(self.event_ids[index],
+                        bytes(self.payload(index)),
+                        LinEvent.ChecksumType(self.checksum_types[index]),
+                        direction=None if direction < 0 else LinEvent.Direction(direction),
+                        timestamp=None if timestamp != timestamp else timestamp,
+                        checksum=None if checksum < 0 else checksum,
+                        checksum_error=bool(self.checksum_errors[index]))
+
+    def payload(self, index):
+        start = index * LinEventBatch.PAYLOAD_SIZE
+        return memoryview(self.payloads)[start:start + self.lengths[index]]
+
+    def append_frame(self, event_id, event_payload, checksum_type, direction=None, timestamp=None,
+                     checksum=None, checksum_error=False):
+        length = len(event_payload)
+        if length > LinEventBatch.PAYLOAD_SIZE:
+            raise ValueError(f"LIN frames carry at most {LinEventBatch.PAYLOAD_SIZE} bytes, got {length}")
+        self.event_ids.append(event_id)
+        self.payloads += event_payload
+        if length < LinEventBatch.PAYLOAD_SIZE:
+            self.payloads += bytes(LinEventBatch.PAYLOAD_SIZE - length)
+        self.lengths.append(length)
+        self.checksum_types.append(checksum_type)
+        self.directions.append(-1 if direction is None else direction)
+        self.timestamps.append(float("nan") if timestamp is None else timestamp)
+        self.checksums.append(-1 if checksum is None else checksum)
+        self.checksum_errors.append(1 if checksum_error else 0)
+
+    def append(self, event):
+        self.append_frame(event.event_id, event.event_payload, event.checksum_type, event.direction, event.timestamp,
+                          event.checksum, event.checksum_error)
+
+    def extend(self, events):
+        if isinstance(events, LinEventBatch):
+            self.event_ids.extend(events.event_ids)
+            self.payloads += events.payloads
+            self.lengths.extend(events.lengths)
+            self.checksum_types.extend(events.checksum_types)
+            self.directions.extend(events.directions)
+            self.timestamps.extend(events.timestamps)
+            self.checksums.extend(events.checksums)
+            self.checksum_errors.extend(events.checksum_errors)
+        else:
+            for event in events:
+                self.append(event)
+
+    def clear(self):
+        del self.event_ids[:]
+        del self.payloads[:]
+        del self.lengths[:]
+        del self.checksum_types[:]
+        del self.directions[:]
+        del self.timestamps[:]
+        del self.checksums[:]
+        del self.checksum_errors[:]
@@ -0,0 +1,488 @@
+from array import array
+from collections import namedtuple
+from hashlib import sha256
+import logging
+import os
+import pickle
+import re
+import sys
+import tempfile
+from .constants import MASTER_DIAGNOSTIC_FRAME_ID, SLAVE_DIAGNOSTIC_FRAME_ID
+from .schedule import ScheduleTable
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the pickled layout changes, so stale cache entries are not
+# picked up
+LDF_CACHE_VERSION = 1
+
+LdfSignal = namedtuple("LdfSignal", ("name", "size", "init_value", "publisher", "subscribers"))
+LdfFrame = namedtuple("LdfFrame", ("name", "frame_id", "publisher", "length", "signals"))
+LdfScheduleEntry = namedtuple("LdfScheduleEntry", ("command", "arguments", "delay"))
+# Schedule commands naming the diagnostic frames, valid without a
+# Diagnostic_frames section
+_DIAGNOSTIC_COMMANDS = {"MasterReq": MASTER_DIAGNOSTIC_FRAME_ID, "SlaveResp": SLAVE_DIAGNOSTIC_FRAME_ID}
+_LdfNodeFields = namedtuple("LdfNode", ("name", "protocol", "configured_nad", "initial_nad",
+                                        "supplier_id", "function_id", "variant_id", "p2_min", "st_min"))
+
+# Compiled layout of one signal. All LIN frames fit in 64 bits, so a signal
+# is extracted from the little endian payload word with one shift and mask.
+# physical holds (minimum, maximum, scale, offset) ranges, logical maps raw
+# values to their text.
+SignalLayout = namedtuple("SignalLayout", ("name", "bit_offset", "mask", "byte_size", "physical", "logical"))
+
+
+class LdfNode(_LdfNodeFields):
+    __slots__ = ()
+
+    @property
+    def identity(self):
+        # Keyword arguments for LinMaster.read_by_identifier() and friends
+        return dict(nad=self.configured_nad, supplier_id=self.supplier_id, function_id=self.function_id)
+
+
+class FrameDecoder:
+    def __init__(self, frame, layouts):
+        self.name = frame.name
+        self.frame_id = frame.frame_id
+        self.length = frame.length
+        self.signals = tuple(layouts)
+
+    def decode_raw(self, payload):
+        word = int.from_bytes(payload, "little")
+        return {signal.name: _extract(signal, word) for signal in self.signals}
+
+    def decode(self, payload):
+        word = int.from_bytes(payload, "little")
+        return {signal.name: _convert(signal, _extract(signal, word)) for signal in self.signals}
+
+    def decode_batch(self, batch, indices=None, words=None):
+        # Decodes every frame of this decoder's ID in a LinEventBatch, column by
+        # column. Returns the batch indices and a list of values per signal
+        if words is None:
+            words = _payload_words(batch)
+        if indices is None:
+            frame_id = self.frame_id
+            indices = [index for index, event_id in enumerate(batch.event_ids) if event_id == frame_id]
+        selected = [words[index] for index in indices]
+
+        values = dict()
+        for signal in self.signals:
+            bit_offset, mask = signal.bit_offset, signal.mask
+            raw = [(word >> bit_offset) & mask for word in selected]
+            if signal.byte_size is not None:
+                values[signal.name] = [value.to_bytes(signal.byte_size, "little") for value in raw]
+            elif signal.physical or signal.logical:
+                values[signal.name] = [_convert(signal, value) for value in raw]
+            else:
+                values[signal.name] = raw
+        return indices, values
+
+
+def _payload_words(batch):
+    # Each 8 byte payload slot of a batch as one little endian integer
+    words = array("Q")
+    words.frombytes(batch.payloads)
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words
+
+
+def _extract(signal, word):
+    raw = (word >> signal.bit_offset) & signal.mask
+    if signal.byte_size is not None:
+        return raw.to_bytes(signal.byte_size, "little")
+    return raw
+
+
+def _convert(signal, raw):
+    if signal.byte_size is not None:
+        return raw
+    if raw in signal.logical:
+        return signal.logical[raw]
+    for minimum, maximum, scale, offset in signal.physical:
+        if minimum <= raw <= maximum:
+            return raw * scale + offset
+    return raw
+
+
+class LinDescriptionFile:
+    def __init__(self):
+        self.protocol_version = None
+        self.language_version = None
+        self.baud_rate = None
+        self.master = None
+        self.slaves = []
+        self.signals = dict()
+        self.frames = dict()
+        self.nodes = dict()
+        self.schedule_tables = dict()
+        self.encodings = dict()
+        self.representations = dict()
+        self.decoders = dict()
+
+    def compile(self):
+        self.decoders = dict()
+        for frame in self.frames.values():
+            layouts = []
+            for signal_name, bit_offset in frame.signals:
+                signal = self.signals[signal_name]
+                byte_size = signal.size // 8 if isinstance(signal.init_value, list) else None
+                physical, logical = [], dict()
+                for encoding in self.encodings.get(self.representations.get(signal_name), ()):
+                    if encoding[0] == "logical_value":
+                        logical[encoding[1]] = encoding[2] if len(encoding) > 2 else encoding[1]
+                    elif encoding[0] == "physical_value":
+                        minimum, maximum, scale, offset = encoding[1:5]
+                        physical.append((minimum, maximum, scale, offset))
+                layouts.append(SignalLayout(signal_name, bit_offset, (1 << signal.size) - 1, byte_size, tuple(physical), logical))
+            self.decoders[frame.frame_id] = FrameDecoder(frame, layouts)
+        return self
+
+    def node(self, name):
+        return self.nodes[name]
+
+    def node_by_nad(self, nad):
+        for node in self.nodes.values():
+            if node.configured_nad == nad:
+                return node
+        return None
+
+    def decode(self, event):
+        # Signal values of an application frame, or None for unknown frames
+        decoder = self.decoders.get(event.event_id)
+        if decoder is None:
+            return None
+        return decoder.decode(event.event_payload)
+
+    def decode_batch(self, batch):
+        # {frame name: (batch indices, {signal: values})} for every known frame
+        # ID present in the batch
+        indices = dict()
+        for index, event_id in enumerate(batch.event_ids):
+            if event_id in self.decoders:
+                indices.setdefault(event_id, []).append(index)
+        words = _payload_words(batch)
+        return {self.decoders[frame_id].name: self.decoders[frame_id].decode_batch(batch, frame_indices, words)
+                for frame_id, frame_indices in indices.items()}
+
+    def schedule_table(self, name):
+        # MasterReq and SlaveResp become the slots diagnostic requests and
+        # responses use. Node configuration commands (AssignNAD, FreeFormat,
+        # ...) and event triggered or sporadic frames have no equivalent and
+        # raise ValueError, rather than turning into request slots that would
+        # send something else than the LDF says
+        table = ScheduleTable()
+        for entry in self.schedule_tables[name]:
+            frame = self.frames.get(entry.command)
+            if frame is None and entry.command in _DIAGNOSTIC_COMMANDS:
+                frame = LdfFrame(entry.command, _DIAGNOSTIC_COMMANDS[entry.command], None, 8, ())
+            if frame is None:
+                raise ValueError(f"Schedule table {name} entry {entry.command} is not an unconditional or diagnostic frame")
+            if frame.frame_id == MASTER_DIAGNOSTIC_FRAME_ID:
+                table.master_request(entry.delay)
+            elif frame.frame_id == SLAVE_DIAGNOSTIC_FRAME_ID:
+                table.slave_response(entry.delay)
+            elif frame.publisher == self.master:
+                table.unconditional(frame.frame_id, entry.delay, payload=self._initial_payload(frame))
+            else:
+                table.unconditional(frame.frame_id, entry.delay)
+        return table
+
+    def _initial_payload(self, frame):
+        word = 0
+        for signal_name, bit_offset in frame.signals:
+            init_value = self.signals[signal_name].init_value
+            if isinstance(init_value, list):
+                init_value = int.from_bytes(bytes(init_value), "little")
+            word |= (init_value & ((1 << self.signals[signal_name].size) - 1)) << bit_offset
+        return word.to_bytes(frame.length, "little")
+
+
+_TOKEN = re.compile(r'\s+|//[^\n]*|/\*.*?\*/|("[^"]*")|(-?(?:0[xX][0-9a-fA-F]+|\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+))'
+                    r'|([A-Za-z_][A-Za-z0-9_]*)|([{}();,:=])', re.S)
+
+_TIME_UNITS = {"ms": 0.001, "us": 0.000001, "s": 1}
+
+
+class _Tokens:
+    def __init__(self, text):
+        self._tokens = []
+        position = 0
+        while position < len(text):
+            match = _TOKEN.match(text, position)
+            if match is None:
+                raise ValueError(f"Unexpected character {text[position]!r} in LDF at offset {position}")
+            string, number, identifier, punctuation = match.groups()
+            if string is not None:
+                self._tokens.append(string[1:-1])
+            elif number is not None:
+                self._tokens.append(_number(number))
+            elif identifier is not None:
+                self._tokens.append(identifier)
+            elif punctuation is not None:
+                self._tokens.append(_Punctuation(punctuation))
+            position = match.end()
+        self._position = 0
+
+    def done(self):
+        return self._position >= len(self._tokens)
+
+    def peek(self):
+        if self.done():
+            return None
+        return self._tokens[self._position]
+
+    def next(self):
+        if self.done():
+            raise ValueError("Unexpected end of LDF")
+        token = self._tokens[self._position]
+        self._position += 1
+        return token
+
+    def accept(self, punctuation):
+        if self.peek() == punctuation and isinstance(self.peek(), _Punctuation):
+            self._position += 1
+            return True
+        return False
+
+    def expect(self, punctuation):
+        token = self.next()
+        if not (isinstance(token, _Punctuation) and token == punctuation):
+            raise ValueError(f"Expected {punctuation!r} in LDF, got {token!r}")
+
+    def values(self):
+        # Comma separated values up to the end of the statement, braces make a
+        # nested list
+        values = []
+        while not self.accept(";"):
+            if self.accept(","):
+                continue
+            if self.accept("{"):
+                nested = []
+                while not self.accept("}"):
+                    if not self.accept(","):
+                        nested.append(self.next())
+                values.append(nested)
+            else:
+                values.append(self.next())
+        return values
+
+    def skip_block(self, opened=False):
+        if not opened:
+            self.expect("{")
+        depth = 1
+        while depth:
+            token = self.next()
+            if isinstance(token, _Punctuation):
+                if token == "{":
+                    depth += 1
+                elif token == "}":
+                    depth -= 1
+
+
+class _Punctuation(str):
+    pass
+
+
+def _number(text):
+    if text.lstrip("-")[:2] in ("0x", "0X"):
+        return int(text, 16)
+    if "." in text or "e" in text or "E" in text:
+        return float(text)
+    return int(text, 10)
+
+
+def _seconds(values):
+    # [50, "ms"] -> 0.05
+    value = values[0]
+    unit = values[1] if len(values) > 1 else "ms"
+    return value * _TIME_UNITS.get(unit, 0.001)
+
+
+def _parse_nodes(tokens, ldf):
+    tokens.expect("{")
+    while not tokens.accept("}"):
+        role = tokens.next()
+        tokens.expect(":")
+        values = tokens.values()
+        if role == "Master":
+            ldf.master = values[0]
+        elif role == "Slaves":
+            ldf.slaves = values
+
+
+def _parse_signals(tokens, ldf):
+    tokens.expect("{")
+    while not tokens.accept("}"):
+        name = tokens.next()
+        tokens.expect(":")
+        values = tokens.values()
+        size, init_value = values[0], values[1]
+        publisher = values[2] if len(values) > 2 else None
+        ldf.signals[name] = LdfSignal(name, size, init_value, publisher, values[3:])
+
+
+def _parse_frames(tokens, ldf, diagnostic=False):
+    tokens.expect("{")
+    while not tokens.accept("}"):
+        name = tokens.next()
+        tokens.expect(":")
+        frame_id = tokens.next()
+        if diagnostic:
+            publisher, length = (ldf.master if frame_id == MASTER_DIAGNOSTIC_FRAME_ID else None), 8
+        else:
+            tokens.expect(",")
+            publisher = tokens.next()
+            tokens.expect(",")
+            length = tokens.next()
+        tokens.expect("{")
+        signals = []
+        while not tokens.accept("}"):
+            signal_name = tokens.next()
+            tokens.expect(",")
+            signals.append((signal_name, tokens.next()))
+            tokens.expect(";")
+        ldf.frames[name] = LdfFrame(name, frame_id, publisher, length, tuple(signals))
+
+
+def _parse_node_attributes(tokens, ldf):
+    tokens.expect("{")
+    while not tokens.accept("}"):
+        name = tokens.next()
+        tokens.expect("{")
+        attributes = dict()
+        while not tokens.accept("}"):
+            key = tokens.next()
+            if tokens.accept("{"):
+                # configurable_frames
+                tokens.skip_block(opened=True)
+            else:
+                tokens.expect("=")
+                attributes[key] = tokens.values()
+        product_id = attributes.get("product_id", [None, None, None])
+        product_id = product_id + [None] * (3 - len(product_id))
+        configured_nad = attributes.get("configured_NAD", attributes.get("initial_NAD", [None]))[0]
+        ldf.nodes[name] = LdfNode(name,
+                                  attributes.get("LIN_protocol", [None])[0],
+                                  configured_nad,
+                                  attributes.get("initial_NAD", [configured_nad])[0],
+                                  product_id[0], product_id[1], product_id[2],
+                                  _seconds(attributes["P2_min"]) if "P2_min" in attributes else None,
+                                  _seconds(attributes["ST_min"]) if "ST_min" in attributes else None)
+
+
+def _parse_schedule_tables(tokens, ldf):
+    tokens.expect("{")
+    while not tokens.accept("}"):
+        name = tokens.next()
+        tokens.expect("{")
+        entries = []
+        while not tokens.accept("}"):
+            command = tokens.next()
+            arguments = []
+            if tokens.accept("{"):
+                while not tokens.accept("}"):
+                    if not tokens.accept(","):
+                        arguments.append(tokens.next())
+            if tokens.next() != "delay":
+                raise ValueError(f"Expected delay for schedule entry {command} in LDF")
+            entries.append(LdfScheduleEntry(command, arguments, _seconds(tokens.values())))
+        ldf.schedule_tables[name] = entries
+
+
+def _parse_encoding_types(tokens, ldf):
+    tokens.expect("{")
+    while not tokens.accept("}"):
+        name = tokens.next()
+        tokens.expect("{")
+        encodings = []
+        while not tokens.accept("}"):
+            kind = tokens.next()
+            values = tokens.values() if not tokens.accept(";") else []
+            encodings.append(tuple([kind] + values))
+        ldf.encodings[name] = encodings
+
+
+def _parse_representations(tokens, ldf):
+    tokens.expect("{")
+    while not tokens.accept("}"):
+        encoding = tokens.next()
+        tokens.expect(":")
+        for signal_name in tokens.values():
+            ldf.representations[signal_name] = encoding
+
+
+_SECTIONS = {
+    "Nodes": _parse_nodes,
+    "Signals": _parse_signals,
+    "Diagnostic_signals": _parse_signals,
+    "Frames": _parse_frames,
+    "Diagnostic_frames": lambda tokens, ldf: _parse_frames(tokens, ldf, diagnostic=True),
+    "Node_attributes": _parse_node_attributes,
+    "Schedule_tables": _parse_schedule_tables,
+    "Signal_encoding_types": _parse_encoding_types,
+    "Signal_representation": _parse_representations,
+}
+
+
+def parse_ldf(text):
+    tokens = _Tokens(text)
+    ldf = LinDescriptionFile()
+    while not tokens.done():
+        name = tokens.next()
+        if tokens.accept(";"):
+            # LIN_description_file;
+            continue
+        if tokens.accept("="):
+            values = tokens.values()
+            if name == "LIN_protocol_version":
+                ldf.protocol_version = values[0]
+            elif name == "LIN_language_version":
+                ldf.language_version = values[0]
+            elif name == "LIN_speed":
+                ldf.baud_rate = int(round(values[0] * 1000)) if values[1:] == ["kbps"] else values[0]
+        elif name in _SECTIONS:
+            _SECTIONS[name](tokens, ldf)
+        else:
+            # Sporadic, event triggered and other sections carry nothing we decode
+            tokens.skip_block()
+    return ldf.compile()
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "lindiagnostics", "ldf")
+
+
+def load_ldf(path, cache_dir=None, use_cache=True):
+    # Parsed and compiled descriptions are pickled under the SHA-256 of the
+    # file, so an unchanged LDF is only parsed once
+    with open(path, "rb") as ldf_file:
+        content = ldf_file.read()
+    text = content.decode("utf-8", errors="replace")
+    if not use_cache:
+        return parse_ldf(text)
+
+    digest = sha256(bytes([LDF_CACHE_VERSION]) + content).hexdigest()
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    cache_path = os.path.join(cache_dir, f"{digest}.pickle")
+    try:
+        with open(cache_path, "rb") as cache_file:
+            return pickle.load(cache_file)
+    except FileNotFoundError:
+        pass
+    except (OSError, EOFError, AttributeError, ImportError, pickle.UnpicklingError) as e:
+        logger.warning(f"Ignoring unreadable LDF cache entry {cache_path}: {e}")
+
+    ldf = parse_ldf(text)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Written aside and renamed, so concurrent loads never see half a file
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False) as cache_file:
+            pickle.dump(ldf, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_file.name, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not cache compiled LDF in {cache_dir}: {e}")
+    return ldf
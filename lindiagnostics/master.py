@@ -1,24 +1,59 @@
-import time
 from .transport import Transport
+from .schedule import ScheduleEngine
+from .metrics import TransportMetrics
+from .cache import IdentityCache
 from .constants import *
 
-class LinMaster:
-    def __init__(self, driver):
-        self._driver = driver
-        self._transport = Transport(False, driver)
-        self._transport.run()
+class NegativeResponseError(NotImplementedError):
+    def __init__(self, sid, error_code, name=None):
+        self.sid = sid
+        self.error_code = error_code
+        if name is None:
+            name = f"SID 0x{sid:x}"
+        NotImplementedError.__init__(self, f"Slave did not support {name}. Error code: 0x{error_code:x}")
 
-    def __enter__(self):
-        return self
 
-    def __exit__(self, type, value, traceback):
-        self.close()
+# Identifiers describing what a node is rather than its state, which are
+# worth caching
+CACHED_IDENTIFIERS = (DATA_IDENTIFIER_LIN_PRODUCT_IDENTIFIER, DATA_IDENTIFIER_SERIAL_NUMBER)
+
+
+class LinMasterBase:
+    # What LinMaster and AsyncLinMaster share. Each node configuration service
+    # is a generator that yields the (nad, sid, payload, name, response_nad)
+    # requests it needs and gets their checked responses sent back, so that
+    # only _run() and _request(), which wait for the bus, differ between them.
+    def __init__(self, driver, poll_interval=0.010, burst=False, st_min=0, schedule=None, metrics=False,
+                 tx_queue_size=4096, rx_queue_size=256, identity_cache=False, response_timeout=1.0):
+        self._driver = driver
+        # metrics=True collects TransportMetrics, see self.metrics.snapshot()
+        if metrics is True:
+            metrics = TransportMetrics()
+        self.metrics = metrics or None
+        self._transport = Transport(False, driver, poll_interval=poll_interval, burst=burst, st_min=st_min, metrics=self.metrics,
+                                    tx_queue_size=tx_queue_size, rx_queue_size=rx_queue_size, response_timeout=response_timeout)
+        # With a ScheduleTable, diagnostic frames only go out in its request
+        # and response slots, between the application frames
+        self.scheduler = None
+        if schedule is not None:
+            self.scheduler = ScheduleEngine(self._transport, schedule)
+        self._transport.run()
+        # Seconds from the last request frame to the first response frame of
+        # the most recent request, i.e. the slave's P2 response time
+        self.last_response_time = None
+        # identity_cache=True answers repeated product identifier and serial
+        # number reads from an IdentityCache, forgotten when NADs change
+        if identity_cache is True:
+            identity_cache = IdentityCache(clock=self._transport.clock)
+        self.identity_cache = None if identity_cache is False else identity_cache
 
     def close(self):
         self._transport.close()
 
-    def assign_slave_frame_ids(self, start_index, frame_ids, nad=None, timeout=None):
-        sid = ASSIGN_FRAME_IDENTIFIER_RANGE_SID
+    def send_diagnostic(self, nad, sid, payload):
+        self._transport.transmit(nad, sid, payload)
+
+    def _assign_slave_frame_ids(self, start_index, frame_ids, nad):
         payload = bytearray([start_index, 0xff, 0xff, 0xff, 0xff])
         if len(frame_ids) > 4:
             raise ValueError("Can only assign 4 frame ID's at once")
@@ -26,110 +61,207 @@ class LinMaster:
             for i, frame_id in enumerate(frame_ids):
                 payload[1 + i] = frame_id
 
-        target_nad = BROADCAST_NAD
-        if nad is not None:
-            target_nad = nad
-        self._transport.transmit(target_nad, sid, bytes(payload))
-        start_time = time.time()
-        while True:
-            if timeout and time.time() - start_time > timeout:
-                raise TimeoutError("Timed out waiting for slave to respond to Assign NAD")
-            result = self._transport.receive()
-            if result is not None:
-                nad, rsid, _ = result
-                if rsid == sid + 0x40:
-                    return nad
+        nad, _ = yield nad, ASSIGN_FRAME_IDENTIFIER_RANGE_SID, bytes(payload), "Assign Frame Identifier Range", None
+        return nad
 
-    def assign_slave_nad(self, new_nad, supplier_id=BROADCAST_SUPPLIER_ID, function_id=BROADCAST_FUNCTION_ID, nad=BROADCAST_NAD, timeout=None):
-        sid = ASSIGN_NAD_SID
+    def _assign_slave_nad(self, new_nad, supplier_id, function_id, nad):
         payload = bytes([supplier_id & 0xff, supplier_id >> 8, function_id & 0xff, function_id >> 8, new_nad])
-        self._transport.transmit(nad, sid, payload)
-        start_time = time.time()
-        while True:
-            if timeout and time.time() - start_time > timeout:
-                raise TimeoutError("Timed out waiting for slave to respond to Assign NAD")
-            result = self._transport.receive()
-            if result is not None:
-                nad, rsid, _ = result
-                if rsid == sid + 0x40:
-                    return nad
+        target_nad = nad
+        try:
+            nad, _ = yield nad, ASSIGN_NAD_SID, payload, "Assign NAD", None
+        finally:
+            # Even without a response the node may have taken the new NAD
+            self._invalidate_identity(target_nad, new_nad)
+        return nad
 
-    def save_slave_configuration(self, nad=None, timeout=None):
-        sid = SAVE_CONFIGURATION_SID
-        payload = bytes()
-        self._transport.transmit(nad, sid, payload)
-        while True:
-            if timeout and time.time() - start_time > timeout:
-                raise TimeoutError("Timed out waiting for slave to respond to Read By Identifier")
-            result = self._transport.receive()
-            if result is not None:
-                nad, rsid, payload = result
-                if rsid == sid + 0x40:
-                    return nad
+    def _save_slave_configuration(self, nad):
+        target_nad = nad
+        try:
+            nad, _ = yield nad, SAVE_CONFIGURATION_SID, bytes(), "Save Configuration", None
+        finally:
+            self._invalidate_identity(target_nad)
+        return nad
 
-    def slave_data_dump(self, payload, nad=None, timeout=None):
-        sid = DATA_DUMP_SID
+    def _slave_data_dump(self, payload, nad):
         if len(payload) > 5:
             raise ValueError("Payload must be less than 5 bytes.")
-        self._transport.transmit(nad, sid, payload)
-        start_time = time.time()
-        while True:
-            if timeout and time.time() - start_time > timeout:
-                raise TimeoutError("Timed out waiting for slave to respond to Conditional Change NAD")
-            result = self._transport.receive()
-            if result is not None:
-                nad, rsid, payload = result
-                if rsid == sid + 0x40:
-                    return nad, payload
+        return (yield nad, DATA_DUMP_SID, payload, "Data Dump", None)
 
-    def get_slave_serial_number(self, supplier_id=BROADCAST_SUPPLIER_ID, function_id=BROADCAST_FUNCTION_ID, nad=BROADCAST_NAD, timeout=None):
-        nad, payload = self.read_by_identifier(DATA_IDENTIFIER_SERIAL_NUMBER, supplier_id=supplier_id, function_id=function_id, nad=nad, timeout=timeout)
+    def _get_slave_serial_number(self, supplier_id, function_id, nad):
+        nad, payload = yield from self._read_by_identifier(DATA_IDENTIFIER_SERIAL_NUMBER, supplier_id, function_id, nad)
         return nad, bytes([payload[0], payload[1], payload[2], payload[3]])
 
-    def get_slave_product_identifier(self, supplier_id=BROADCAST_SUPPLIER_ID, function_id=BROADCAST_FUNCTION_ID, nad=BROADCAST_NAD, timeout=None):
-        nad, payload = self.read_by_identifier(DATA_IDENTIFIER_LIN_PRODUCT_IDENTIFIER, supplier_id=supplier_id, function_id=function_id, nad=nad, timeout=timeout)
+    def _get_slave_product_identifier(self, supplier_id, function_id, nad):
+        nad, payload = yield from self._read_by_identifier(DATA_IDENTIFIER_LIN_PRODUCT_IDENTIFIER, supplier_id, function_id, nad)
         return nad, payload[0] | payload[1] << 8, payload[2] | payload[3] << 8, payload[4]
 
-    def conditional_change_slave_nad(self, id_type, id_byte_index, id_mask, id_invert, new_nad, nad=None, timeout=None):
-        sid = CONDITIONAL_CHANGE_NAD_SID
+    def _conditional_change_slave_nad(self, id_type, id_byte_index, id_mask, id_invert, new_nad, nad):
         payload = bytes([id_type, id_byte_index, id_mask, id_invert, new_nad])
-        self._transport.transmit(nad, sid, payload)
-        start_time = time.time()
-        while True:
-            if timeout and time.time() - start_time > timeout:
-                raise TimeoutError("Timed out waiting for slave to respond to Conditional Change NAD")
-            result = self._transport.receive()
-            if result is not None:
-                nad, rsid, payload = result
-                if rsid == sid + 0x40:
-                    return nad
+        # The slave responds using the NAD it has just been given
+        target_nad = nad
+        try:
+            nad, _ = yield nad, CONDITIONAL_CHANGE_NAD_SID, payload, "Conditional Change NAD", new_nad
+        finally:
+            self._invalidate_identity(target_nad, new_nad)
+        return nad
+
+    def _read_by_identifier(self, identifier, supplier_id, function_id, nad):
+        payload = self._identifier_payload(identifier, supplier_id, function_id)
+        cache = self.identity_cache if identifier in CACHED_IDENTIFIERS else None
+        if cache is not None:
+            key = (nad, identifier, supplier_id, function_id)
+            response = cache.get(key)
+            if response is not None:
+                return response
+        response = yield nad, READ_BY_IDENTIFIER_SID, payload, f"Read By Identifier 0x{identifier:x}", None
+        if cache is not None:
+            cache.put(key, response)
+        return response
+
+    def _request_diagnostic(self, nad, sid, payload):
+        return (yield nad, sid, payload, f"SID 0x{sid:x}", None)
+
+    def _invalidate_identity(self, *nads):
+        if self.identity_cache is not None:
+            for nad in nads:
+                self.identity_cache.invalidate(BROADCAST_NAD if nad is None else nad)
+
+    @staticmethod
+    def _identifier_payload(identifier, supplier_id, function_id):
+        return bytes([identifier, supplier_id & 0xff, supplier_id >> 8, function_id & 0xff, function_id >> 8])
+
+    @staticmethod
+    def _positive_responses(responses):
+        return {nad: data for nad, (rsid, data) in responses.items() if rsid != NEGATIVE_RESPONSE_SID}
+
+    def _request_functional(self, sid, payload, window, nad, expected):
+        if nad is None:
+            nad = BROADCAST_NAD
+        return self._transport.request_functional(nad, sid, bytes(payload), window, expected)
+
+    def _complete(self, request, result, name):
+        self.last_response_time = request.response_time
+        response_nad, rsid, response_payload = result
+        if rsid == NEGATIVE_RESPONSE_SID:
+            error_code = response_payload[1] if len(response_payload) > 1 else 0
+            raise NegativeResponseError(request.sid, error_code, name)
+        return response_nad, response_payload
+
+
+class LinMaster(LinMasterBase):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def assign_slave_frame_ids(self, start_index, frame_ids, nad=None, timeout=None):
+        return self._run(self._assign_slave_frame_ids(start_index, frame_ids, nad), timeout)
+
+    def assign_slave_nad(self, new_nad, supplier_id=BROADCAST_SUPPLIER_ID, function_id=BROADCAST_FUNCTION_ID, nad=BROADCAST_NAD, timeout=None):
+        return self._run(self._assign_slave_nad(new_nad, supplier_id, function_id, nad), timeout)
+
+    def save_slave_configuration(self, nad=None, timeout=None):
+        return self._run(self._save_slave_configuration(nad), timeout)
+
+    def slave_data_dump(self, payload, nad=None, timeout=None):
+        return self._run(self._slave_data_dump(payload, nad), timeout)
+
+    def get_slave_serial_number(self, supplier_id=BROADCAST_SUPPLIER_ID, function_id=BROADCAST_FUNCTION_ID, nad=BROADCAST_NAD, timeout=None):
+        return self._run(self._get_slave_serial_number(supplier_id, function_id, nad), timeout)
+
+    def get_slave_product_identifier(self, supplier_id=BROADCAST_SUPPLIER_ID, function_id=BROADCAST_FUNCTION_ID, nad=BROADCAST_NAD, timeout=None):
+        return self._run(self._get_slave_product_identifier(supplier_id, function_id, nad), timeout)
+
+    def conditional_change_slave_nad(self, id_type, id_byte_index, id_mask, id_invert, new_nad, nad=None, timeout=None):
+        return self._run(self._conditional_change_slave_nad(id_type, id_byte_index, id_mask, id_invert, new_nad, nad), timeout)
 
     def read_by_identifier(self, identifier, supplier_id=BROADCAST_SUPPLIER_ID, function_id=BROADCAST_FUNCTION_ID, nad=BROADCAST_NAD, timeout=None):
-        sid = READ_BY_IDENTIFIER_SID
-        payload = bytes([identifier, supplier_id & 0xff, supplier_id >> 8, function_id & 0xff, function_id >> 8])
-        self._transport.transmit(nad, sid, payload)
-        start_time = time.time()
-        while True:
-            if timeout and time.time() - start_time > timeout:
-                raise TimeoutError("Timed out waiting for slave to respond to Read By Identifier")
-            result = self._transport.receive()
-            if result is not None:
-                nad, rsid, payload = result
-                if rsid == sid + 0x40:
-                    return nad, payload
-                elif rsid == 0x7f:
-                    raise NotImplementedError("Slave did not support Read Identifier 0x{identifer:x}. Error code: 0x:{payload[1]}")
+        return self._run(self._read_by_identifier(identifier, supplier_id, function_id, nad), timeout)
 
-    def send_diagnostic(self, nad, sid, payload):
-        self._transport.transmit(nad, sid, payload)
+    def read_by_identifier_all(self, identifier, supplier_id=BROADCAST_SUPPLIER_ID, function_id=BROADCAST_FUNCTION_ID, window=0.1, expected=None):
+        # read_by_identifier() sent once to every slave. Returns a dict of NAD
+        # -> payload of the slaves that answered positively within window
+        payload = self._identifier_payload(identifier, supplier_id, function_id)
+        return self._positive_responses(self.functional_request(READ_BY_IDENTIFIER_SID, payload, window=window, expected=expected))
+
+    def functional_request(self, sid, payload, window=0.1, nad=None, expected=None):
+        # Sends one request, to every slave unless nad is given, and collects
+        # the responses of all slaves that answer within window seconds of it
+        # going out: a dict of NAD -> (RSID, payload), negative responses
+        # included. Returns early once `expected` slaves have answered
+        return self._transport.wait_for(self._request_functional(sid, payload, window, nad, expected))
+
+    def request_diagnostic(self, nad, sid, payload, timeout=None):
+        return self._run(self._request_diagnostic(nad, sid, payload), timeout)
+
+    def _run(self, service, timeout):
+        # Makes the requests a service yields, sending each response back in,
+        # or raising its error there so that the service can clean up
+        try:
+            args = next(service)
+            while True:
+                try:
+                    response = self._request(*args, timeout)
+                except BaseException as e:
+                    args = service.throw(e)
+                else:
+                    args = service.send(response)
+        except StopIteration as stop:
+            return stop.value
+
+    def _request(self, nad, sid, payload, name, response_nad, timeout):
+        request = self._submit(nad, sid, payload, timeout, response_nad)
+        try:
+            result = self._transport.wait_for(request, timeout)
+        except TimeoutError:
+            # Also frees the bus if the request is still queued or active
+            self._transport.cancel(request)
+            raise TimeoutError(f"Timed out waiting for slave to respond to {name}") from None
+        return self._complete(request, result, name)
+
+    def _submit(self, nad, sid, payload, timeout, response_nad=None, response_timeout=None):
+        if nad is None:
+            nad = BROADCAST_NAD
+        # timeout counts from now, time queued behind other requests included.
+        # Once on the bus the request holds it for at most response_timeout
+        # (the master's default if None), whether or not a timeout was given
+        return self._transport.request(nad, sid, payload, timeout=timeout, response_nad=response_nad, response_timeout=response_timeout)
+
+    def submit_diagnostic(self, nad, sid, payload, timeout=None, response_timeout=None):
+        # Raw request without waiting: returns a future of the (nad, sid, data)
+        # response, negative responses included. The bus is held for its
+        # response until it arrives, the timeout runs out or it is cancelled
+        return self._submit(nad, sid, payload, timeout, response_timeout=response_timeout)
+
+    def wait_diagnostic(self, request, timeout=None):
+        # Waits for a submit_diagnostic() response, cancelling the request if
+        # it does not arrive within timeout
+        try:
+            return self._transport.wait_for(request, timeout)
+        except TimeoutError:
+            self._transport.cancel(request)
+            raise
+
+    def cancel_diagnostic(self, request):
+        self._transport.cancel(request)
+
+    def receive_diagnostic(self, timeout=None, nad=None):
+        # Waits for a PDU that no request was waiting for, from nad if given.
+        # Returns None at the timeout, timeout=None waits indefinitely
+        return self._transport.receive(block=True, timeout=timeout, nad=nad)
+
+    def subscribe(self, nad):
+        # Keeps PDUs from nad apart from everyone else's, so that several
+        # receivers can each wait for their own slave
+        self._transport.subscribe(nad)
 
-    def receive_diagnostic(self, timeout=None):
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            return self._transport.receive()
+    def unsubscribe(self, nad):
+        self._transport.unsubscribe(nad)
 
-    def empty_rxqueue(self):
-        pass
+    def empty_rxqueue(self, nad=None):
+        # Like receive_diagnostic, nad=None is the queue of unsubscribed NADs
+        self._transport.clear_rx(nad)
 
-    def empty_txqueue(self):
-        pass
+    def empty_txqueue(self, nad=None):
+        self._transport.clear_tx(nad)
@@ -0,0 +1,144 @@
+from bisect import bisect_left
+from threading import Lock
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket
+# takes everything slower
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.010, 0.020, 0.050, 0.100, 0.200, 0.500, 1.0, 2.0, 5.0, 10.0)
+
+_PCI_NAMES = ("SF", "FF", "CF")
+
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+
+    def record(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.minimum is None or seconds < self.minimum:
+            self.minimum = seconds
+        if self.maximum is None or seconds > self.maximum:
+            self.maximum = seconds
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of samples, the
+        # maximum for the overflow bucket
+        if not self.count:
+            return None
+        threshold = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= threshold and count:
+                return self.buckets[index] if index < len(self.buckets) else self.maximum
+        return self.maximum
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.minimum,
+            "max": self.maximum,
+            "p50": self.percentile(0.50),
+            "p99": self.percentile(0.99),
+            "buckets": {("+inf" if index == len(self.buckets) else str(self.buckets[index])): count
+                        for index, count in enumerate(self.counts) if count},
+        }
+
+
+class TransportMetrics:
+    # Counters and histograms updated by a Transport. A transport without
+    # metrics only pays for `if self._metrics is not None` on its hot paths.
+    # Counters are only written from the thread driving the transport, the
+    # lock keeps snapshots consistent with requests completing concurrently.
+    def __init__(self):
+        self._lock = Lock()
+        self._gauges = []
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.frames_tx = [0, 0, 0]
+            self.frames_rx = [0, 0, 0]
+            self.cf_unexpected = 0
+            self.cf_out_of_order = 0
+            self.pdus_incomplete = 0
+            self.frames_malformed = 0
+            self.pdus_rx = 0
+            self.pdus_unsolicited = 0
+            self.pdus_dropped = 0
+            self.empty_responses = 0
+            self.checksum_errors = 0
+            self.requests = 0
+            self.timeouts = 0
+            self.tx_queue_full = 0
+            # (SID, NAD) -> LatencyHistogram
+            self.round_trip = dict()
+            self.response_time = dict()
+
+    def add_gauges(self, source):
+        # source() returns a dict of current values, read at snapshot time
+        self._gauges.append(source)
+
+    def frame_tx(self, payload):
+        if len(payload) > 1:
+            pci_type = payload[1] >> 4
+            if pci_type < 3:
+                self.frames_tx[pci_type] += 1
+
+    def frame_rx(self, pci_type):
+        self.frames_rx[pci_type] += 1
+
+    def request_completed(self, request, now):
+        key = (request.sid, request.response_nad)
+        with self._lock:
+            if request.submitted is not None:
+                self._histogram(self.round_trip, key).record(now - request.submitted)
+            response_time = request.response_time
+            if response_time is not None:
+                self._histogram(self.response_time, key).record(response_time)
+
+    def _histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = LatencyHistogram()
+        return histogram
+
+    def snapshot(self):
+        # Plain dicts and numbers, ready for JSON or a metrics exporter
+        with self._lock:
+            snapshot = {
+                "frames_tx": dict(zip(_PCI_NAMES, self.frames_tx)),
+                "frames_rx": dict(zip(_PCI_NAMES, self.frames_rx)),
+                "cf_unexpected": self.cf_unexpected,
+                "cf_out_of_order": self.cf_out_of_order,
+                "pdus_incomplete": self.pdus_incomplete,
+                "frames_malformed": self.frames_malformed,
+                "pdus_rx": self.pdus_rx,
+                "pdus_unsolicited": self.pdus_unsolicited,
+                "pdus_dropped": self.pdus_dropped,
+                "empty_responses": self.empty_responses,
+                "checksum_errors": self.checksum_errors,
+                "requests": self.requests,
+                "timeouts": self.timeouts,
+                "tx_queue_full": self.tx_queue_full,
+                "round_trip": {f"0x{sid:02x}/0x{nad:02x}": histogram.snapshot()
+                               for (sid, nad), histogram in sorted(self.round_trip.items())},
+                "response_time": {f"0x{sid:02x}/0x{nad:02x}": histogram.snapshot()
+                                  for (sid, nad), histogram in sorted(self.response_time.items())},
+            }
+        gauges = dict()
+        for source in self._gauges:
+            gauges.update(source())
+        snapshot["gauges"] = gauges
+        return snapshot
@@ -0,0 +1,137 @@
+from enum import IntEnum
+from collections import deque
+from threading import Condition
+import time
+
+class DropPolicy(IntEnum):
+    DROP_OLDEST = 0
+    DROP_NEWEST = 1
+
+
+class RingBuffer:
+    # Fixed capacity FIFO with O(1) put and get. When full, put() either
+    # overwrites the oldest item or discards the new one, depending on the drop
+    # policy, and counts the loss in overflow_count.
+    def __init__(self, capacity, drop_policy=DropPolicy.DROP_OLDEST):
+        if capacity < 1:
+            raise ValueError("RingBuffer capacity must be at least 1")
+        self.capacity = capacity
+        self.drop_policy = DropPolicy(drop_policy)
+        self.overflow_count = 0
+        self._items = [None] * capacity
+        self._head = 0
+        self._size = 0
+        self._not_empty = Condition()
+
+    def __len__(self):
+        return self._size
+
+    def empty(self):
+        return self._size == 0
+
+    def full(self):
+        return self._size == self.capacity
+
+    def put(self, item):
+        # Returns False if an item had to be dropped
+        with self._not_empty:
+            dropped = False
+            if self._size == self.capacity:
+                self.overflow_count += 1
+                dropped = True
+                if self.drop_policy == DropPolicy.DROP_NEWEST:
+                    return False
+                self._items[self._head] = None
+                self._head = (self._head + 1) % self.capacity
+                self._size -= 1
+            self._items[(self._head + self._size) % self.capacity] = item
+            self._size += 1
+            self._not_empty.notify()
+            return not dropped
+
+    def get(self, block=False, timeout=None):
+        # Returns None when nothing arrived in time
+        with self._not_empty:
+            if self._size == 0:
+                if not block:
+                    return None
+                deadline = None if timeout is None else time.monotonic() + timeout
+                while self._size == 0:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return None
+                    self._not_empty.wait(remaining)
+            item = self._items[self._head]
+            self._items[self._head] = None
+            self._head = (self._head + 1) % self.capacity
+            self._size -= 1
+            return item
+
+    def clear(self):
+        with self._not_empty:
+            self._items = [None] * self.capacity
+            self._head = 0
+            self._size = 0
+
+
+class BoundedQueue:
+    # Fixed capacity FIFO for producers that must not lose items. put_all()
+    # admits a group of items (the frames of one PDU) either completely or not
+    # at all, so a full queue never holds half a PDU. Producers wait for space
+    # with wait_for_space(), consumers never block.
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("BoundedQueue capacity must be at least 1")
+        self.capacity = capacity
+        self._items = deque()
+        self._not_full = Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+    def full(self):
+        return len(self._items) >= self.capacity
+
+    def put_all(self, items):
+        # Returns False, leaving the queue unchanged, if the items do not fit
+        if len(items) > self.capacity:
+            raise ValueError(f"{len(items)} items can never fit in a queue of {self.capacity}")
+        with self._not_full:
+            if len(self._items) + len(items) > self.capacity:
+                return False
+            self._items.extend(items)
+            return True
+
+    def wait_for_space(self, count, timeout=None):
+        # Returns False if there was still no room for count items at the timeout
+        with self._not_full:
+            return self._not_full.wait_for(lambda: len(self._items) + count <= self.capacity, timeout)
+
+    def get(self):
+        # Returns None when empty
+        with self._not_full:
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._not_full.notify_all()
+            return item
+
+    def remove(self, predicate):
+        # Removes the items predicate() is true for, called in queue order, and
+        # returns them
+        with self._not_full:
+            removed = []
+            kept = deque()
+            for item in self._items:
+                (removed if predicate(item) else kept).append(item)
+            self._items = kept
+            self._not_full.notify_all()
+            return removed
+
+    def clear(self):
+        with self._not_full:
+            self._items.clear()
+            self._not_full.notify_all()
@@ -0,0 +1,186 @@
+from collections import namedtuple
+from enum import IntEnum
+from threading import Thread, Event
+import logging
+from .constants import MASTER_DIAGNOSTIC_FRAME_ID, SLAVE_DIAGNOSTIC_FRAME_ID
+from .event import LinEvent
+
+logger = logging.getLogger(__name__)
+
+
+class SlotType(IntEnum):
+    UNCONDITIONAL = 0
+    MASTER_REQUEST = 1
+    SLAVE_RESPONSE = 2
+
+
+# delay is the slot length in seconds. Unconditional frames with a payload are
+# published by the master, without one only the header is sent and a slave
+# publishes the response.
+ScheduleSlot = namedtuple("ScheduleSlot", ("slot_type", "frame_id", "delay", "payload", "checksum_type"))
+ScheduleSlot.__new__.__defaults__ = (None, LinEvent.ChecksumType.ENHANCED)
+
+
+class ScheduleTable:
+    def __init__(self, slots=None):
+        self.slots = list(slots) if slots is not None else []
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __getitem__(self, index):
+        return self.slots[index]
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    @property
+    def cycle_time(self):
+        return sum(slot.delay for slot in self.slots)
+
+    def unconditional(self, frame_id, delay, payload=None, checksum_type=LinEvent.ChecksumType.ENHANCED):
+        self.slots.append(ScheduleSlot(SlotType.UNCONDITIONAL, frame_id, delay, payload, checksum_type))
+        return self
+
+    def master_request(self, delay):
+        self.slots.append(ScheduleSlot(SlotType.MASTER_REQUEST, MASTER_DIAGNOSTIC_FRAME_ID, delay))
+        return self
+
+    def slave_response(self, delay):
+        self.slots.append(ScheduleSlot(SlotType.SLAVE_RESPONSE, SLAVE_DIAGNOSTIC_FRAME_ID, delay))
+        return self
+
+    @staticmethod
+    def diagnostic(delay=0.010):
+        # The table a master runs while only diagnostics are going on
+        return ScheduleTable().master_request(delay).slave_response(delay)
+
+
+class JitterStats:
+    # Lateness of slot starts against their ideal, drift free start times.
+    # Slots later than `bound` are counted as violations, slots that started
+    # after the next one should already have begun as overruns.
+    def __init__(self, bound):
+        self.bound = bound
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max_jitter = 0.0
+        self.violations = 0
+        self.overruns = 0
+
+    @property
+    def mean_jitter(self):
+        return self.total / self.count if self.count else 0.0
+
+    def record(self, lateness):
+        self.count += 1
+        self.total += lateness
+        if lateness > self.max_jitter:
+            self.max_jitter = lateness
+        if lateness > self.bound:
+            self.violations += 1
+
+    def __repr__(self):
+        return (f"JitterStats(count={self.count}, mean={self.mean_jitter:.6f}, max={self.max_jitter:.6f}, "
+                f"bound={self.bound}, violations={self.violations}, overruns={self.overruns})")
+
+
+class ScheduleThread(Thread):
+    def __init__(self, engine):
+        Thread.__init__(self, daemon=True)
+        self._engine = engine
+        self._running = Event()
+
+    def run(self):
+        self._running.clear()
+        while not self._running.is_set():
+            self._engine.step()
+
+    def stop(self):
+        self._running.set()
+
+
+class ScheduleEngine:
+    # Runs a schedule table on a master transport. Slot start times are
+    # computed from the start of the schedule by adding up slot delays, never
+    # from when the previous slot actually ran, so lateness does not
+    # accumulate. Each wait sleeps until `spin` seconds before the slot and
+    # busy-waits the rest, which keeps jitter well below the OS sleep
+    # granularity.
+    def __init__(self, transport, table, spin=0.0005, jitter_bound=0.0005):
+        if len(table) == 0:
+            raise ValueError("A schedule table needs at least one slot")
+        self.transport = transport
+        self.table = table
+        self.spin = spin
+        self.clock = transport.clock
+        self.stats = JitterStats(jitter_bound)
+        self._driver = transport._driver
+        self._published = dict()
+        self._index = 0
+        self._next_time = None
+        self._thread = None
+        transport.set_scheduler(self)
+
+    def publish(self, frame_id, payload):
+        # Replaces the payload of the master published unconditional frame
+        self._published[frame_id] = bytes(payload)
+
+    def start(self):
+        # On a virtual clock slots are only run by step()
+        if self.clock.is_virtual or self._thread is not None:
+            return
+        self._thread = ScheduleThread(self)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread.join()
+            self._thread = None
+
+    def step(self):
+        slot = self.table[self._index]
+        if self._next_time is None:
+            self._next_time = self.clock.time()
+        self._wait_until(self._next_time)
+
+        lateness = self.clock.time() - self._next_time
+        self.stats.record(lateness)
+        if lateness > slot.delay:
+            # Too late to catch up, restart the schedule from now
+            self.stats.overruns += 1
+            logger.warning(f"Schedule slot 0x{slot.frame_id:x} started {lateness * 1000:.3f} ms late")
+            self._next_time = self.clock.time()
+
+        # Collect whatever arrived during the previous slot and expire requests
+        self.transport.execute()
+        self._run_slot(slot)
+
+        self._next_time += slot.delay
+        self._index = (self._index + 1) % len(self.table)
+
+    def _run_slot(self, slot):
+        if slot.slot_type == SlotType.MASTER_REQUEST:
+            self.transport.master_request_slot()
+        elif slot.slot_type == SlotType.SLAVE_RESPONSE:
+            self.transport.slave_response_slot()
+        else:
+            payload = self._published.get(slot.frame_id, slot.payload)
+            if payload is None:
+                self._driver.request_slave_response(slot.frame_id)
+            else:
+                self._driver.write_message(LinEvent(slot.frame_id, payload, slot.checksum_type))
+
+    def _wait_until(self, deadline):
+        remaining = deadline - self.clock.time()
+        if self.clock.is_virtual:
+            self.clock.sleep(remaining)
+            return
+        if remaining > self.spin:
+            self.clock.sleep(remaining - self.spin)
+        while self.clock.time() < deadline:
+            pass
@@ -2,8 +2,11 @@ from .constants import *
 from .transport import Transport
 
 from threading import Thread, Event
+import logging
 import time
 
+logger = logging.getLogger(__name__)
+
 class LinSlaveThread(Thread):
     def __init__(self, slave, step_size = 0.010):
         Thread.__init__(self)
@@ -61,7 +64,7 @@ class LinSlave:
         elif id_type == DATA_IDENTIFIER_SERIAL_NUMBER:
             return self._serial_number
         else:
-            print(f"Unsupported ID type: {id_type}")
+            logger.warning(f"Unsupported ID type: {id_type}")
             return None
 
     def transmit_negative_response(self, requested_sid, error_code):
@@ -157,7 +160,7 @@ class LinSlave:
                     self._transport.transmit(self._nad, sid + 0x40, bytes([data[0], data[1], 0x00, 0x01]))
             elif sid == 0x31:
                 # UDS Routine Contrl
-                print(f"Slave received Routine Control: {nad} {sid} {data}")
+                logger.debug(f"Slave received Routine Control: {nad} {sid} {data}")
                 if data[0] == 0x01 and data[1] == 0x00 and data[2] == 0x01:
                     self._transport.transmit(self._nad, sid + 0x40, data)
             elif sid == 0x3E:
@@ -0,0 +1,285 @@
+from bisect import bisect_left
+from functools import lru_cache
+from threading import Lock
+import mmap
+import os
+import struct
+from .event import LinEvent, LinEventBatch
+from .constants import TRACE_MAGIC, TRACE_VERSION, FLAG_CHECKSUM, FLAG_CHECKSUM_ERROR
+
+# File layout: a 16 byte header followed by fixed size 24 byte records, so that
+# record i lives at a known offset and the file can be appended to forever.
+#
+# Header: | magic (8) | version (2) | record size (2) | reserved (4) |
+# Record: | timestamp (8) | ID | length | checksum type | direction | flags | checksum | reserved (2) | payload (8) |
+#
+# Unknown timestamps are stored as NaN, unknown directions and checksum types
+# as 0xff. Payloads are padded with zeros to 8 bytes. The checksum byte is
+# only meaningful when FLAG_CHECKSUM is set.
+_HEADER = struct.Struct("<8sHH4x")
+_RECORD_FIELDS = struct.Struct("<dBBBBBB2x")
+_PAYLOAD_OFFSET = _RECORD_FIELDS.size
+_PAYLOAD_SIZE = LinEventBatch.PAYLOAD_SIZE
+RECORD_SIZE = _PAYLOAD_OFFSET + _PAYLOAD_SIZE
+
+_UNKNOWN = 0xff
+_NAN = float("nan")
+
+
+@lru_cache(maxsize=None)
+def trace_dtype():
+    # numpy structured dtype of a record. numpy is optional, so it is only
+    # imported by the functions that need it
+    import numpy
+    return numpy.dtype([("timestamp", "<f8"), ("event_id", "u1"), ("length", "u1"),
+                        ("checksum_type", "u1"), ("direction", "u1"), ("flags", "u1"),
+                        ("checksum", "u1"), ("reserved", "V2"), ("payload", "u1", (_PAYLOAD_SIZE,))])
+
+
+class TraceWriter:
+    # Records are packed into a preallocated chunk and the chunk is written out
+    # whenever it fills up, or on flush(). An existing trace is appended to.
+    def __init__(self, path, chunk_records=4096):
+        self._lock = Lock()
+        self._chunk = bytearray(RECORD_SIZE * chunk_records)
+        self._chunk_view = memoryview(self._chunk)
+        self._chunk_size = len(self._chunk)
+        self._offset = 0
+        self.record_count = 0
+
+        self._file = open(path, "a+b")
+        size = self._file.seek(0, os.SEEK_END)
+        if size == 0:
+            self._file.write(_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, RECORD_SIZE))
+        else:
+            self._file.seek(0)
+            _read_header(self._file.read(_HEADER.size))
+            # A record cut short by a crash is dropped before appending
+            self.record_count = (size - _HEADER.size) // RECORD_SIZE
+            self._file.truncate(_HEADER.size + self.record_count * RECORD_SIZE)
+            self._file.seek(0, os.SEEK_END)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def write(self, event):
+        with self._lock:
+            self._write_record(event.event_id, event.event_payload, event.checksum_type, event.direction, event.timestamp,
+                               event.checksum, event.checksum_error)
+
+    def write_batch(self, batch):
+        event_ids, lengths, checksum_types, directions, timestamps = \
+            batch.event_ids, batch.lengths, batch.checksum_types, batch.directions, batch.timestamps
+        checksums, checksum_errors = batch.checksums, batch.checksum_errors
+        payloads = memoryview(batch.payloads)
+        with self._lock:
+            for index in range(len(event_ids)):
+                direction = directions[index]
+                checksum = checksums[index]
+                flags = 0
+                if checksum >= 0:
+                    flags = FLAG_CHECKSUM | (FLAG_CHECKSUM_ERROR if checksum_errors[index] else 0)
+                offset = self._offset
+                _RECORD_FIELDS.pack_into(self._chunk, offset, timestamps[index], event_ids[index], lengths[index],
+                                         checksum_types[index], _UNKNOWN if direction < 0 else direction,
+                                         flags, checksum if checksum >= 0 else 0)
+                start = index * _PAYLOAD_SIZE
+                self._chunk_view[offset + _PAYLOAD_OFFSET:offset + RECORD_SIZE] = payloads[start:start + _PAYLOAD_SIZE]
+                self._advance()
+
+    def _write_record(self, event_id, payload, checksum_type, direction, timestamp, checksum, checksum_error):
+        offset = self._offset
+        length = len(payload)
+        flags = 0
+        if checksum is not None:
+            flags = FLAG_CHECKSUM | (FLAG_CHECKSUM_ERROR if checksum_error else 0)
+        _RECORD_FIELDS.pack_into(self._chunk, offset,
+                                 _NAN if timestamp is None else timestamp,
+                                 event_id, length,
+                                 _UNKNOWN if checksum_type is None else checksum_type,
+                                 _UNKNOWN if direction is None else direction,
+                                 flags, 0 if checksum is None else checksum)
+        start = offset + _PAYLOAD_OFFSET
+        self._chunk_view[start:start + length] = payload
+        if length < _PAYLOAD_SIZE:
+            self._chunk_view[start + length:offset + RECORD_SIZE] = bytes(_PAYLOAD_SIZE - length)
+        self._advance()
+
+    def _advance(self):
+        self._offset += RECORD_SIZE
+        self.record_count += 1
+        if self._offset == self._chunk_size:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        if self._offset > 0:
+            self._file.write(self._chunk_view[:self._offset])
+            self._offset = 0
+
+    def flush(self):
+        with self._lock:
+            self._write_chunk()
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._write_chunk()
+            self._file.close()
+            self._chunk_view.release()
+
+
+class TraceRecorder:
+    # Wraps a driver and records every event read from it, so it can be handed
+    # to a Transport or LinMaster in place of the driver itself. Everything
+    # else is passed through to the wrapped driver.
+    def __init__(self, driver, path, chunk_records=4096):
+        self.driver = driver
+        self.writer = TraceWriter(path, chunk_records=chunk_records)
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+    def read_event(self, timeout):
+        event = self.driver.read_event(timeout)
+        if event is not None:
+            self.writer.write(event)
+        return event
+
+    def read_events(self, timeout, max_events=None):
+        batch = self.driver.read_events(timeout, max_events)
+        self.writer.write_batch(batch)
+        return batch
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.close()
+        if hasattr(self.driver, "close"):
+            self.driver.close()
+
+
+class TraceReader:
+    # Memory-maps a trace for random access: nothing is read until a record is
+    # accessed, and payloads are served as views into the mapping. Records
+    # appended after opening are not visible until the trace is reopened.
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        try:
+            _read_header(self._file.read(_HEADER.size))
+            size = os.fstat(self._file.fileno()).st_size
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+        self._view = memoryview(self._mmap)
+        self._count = (size - _HEADER.size) // RECORD_SIZE
+        self.timestamps = _TimestampColumn(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+            self._mmap.close()
+            self._file.close()
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        return self.events()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.batch(*index.indices(self._count)[:2])
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("Trace record index out of range")
+        timestamp, event_id, length, checksum_type, direction, flags, checksum = self.record(index)
+        return LinEvent(event_id, bytes(self.payload(index)),
+                        None if checksum_type == _UNKNOWN else LinEvent.ChecksumType(checksum_type),
+                        direction=None if direction == _UNKNOWN else LinEvent.Direction(direction),
+                        timestamp=None if timestamp != timestamp else timestamp,
+                        checksum=checksum if flags & FLAG_CHECKSUM else None,
+                        checksum_error=bool(flags & FLAG_CHECKSUM_ERROR))
+
+    def record(self, index):
+        # (timestamp, event ID, length, checksum type, direction, flags, checksum)
+        return _RECORD_FIELDS.unpack_from(self._mmap, _HEADER.size + index * RECORD_SIZE)
+
+    def timestamp(self, index):
+        return struct.unpack_from("<d", self._mmap, _HEADER.size + index * RECORD_SIZE)[0]
+
+    def payload(self, index):
+        offset = _HEADER.size + index * RECORD_SIZE
+        # The length byte follows the timestamp and the ID
+        length = self._mmap[offset + 9]
+        start = offset + _PAYLOAD_OFFSET
+        return self._view[start:start + length]
+
+    def index_range(self, start_time=None, end_time=None):
+        # Records with start_time <= timestamp < end_time, found by bisection.
+        # Assumes timestamps are in ascending order, as recorded from one driver
+        start = 0 if start_time is None else bisect_left(self.timestamps, start_time)
+        end = self._count if end_time is None else bisect_left(self.timestamps, end_time, start)
+        return range(start, end)
+
+    def events(self, start_time=None, end_time=None):
+        for index in self.index_range(start_time, end_time):
+            yield self[index]
+
+    def batch(self, start=0, stop=None):
+        if stop is None:
+            stop = self._count
+        batch = LinEventBatch()
+        for index in range(start, stop):
+            timestamp, event_id, length, checksum_type, direction, flags, checksum = self.record(index)
+            batch.append_frame(event_id, self.payload(index), checksum_type,
+                               None if direction == _UNKNOWN else direction, timestamp,
+                               checksum if flags & FLAG_CHECKSUM else None, flags & FLAG_CHECKSUM_ERROR)
+        return batch
+
+    def as_array(self, start=0, stop=None):
+        # Zero-copy numpy structured array of the records, see trace_dtype()
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("numpy is required for TraceReader.as_array()") from None
+        if stop is None:
+            stop = self._count
+        return numpy.frombuffer(self._mmap, dtype=trace_dtype(), count=stop - start,
+                                offset=_HEADER.size + start * RECORD_SIZE)
+
+
+class _TimestampColumn:
+    # Sequence view over the timestamps of a trace, for bisect
+    def __init__(self, reader):
+        self._reader = reader
+
+    def __len__(self):
+        return len(self._reader)
+
+    def __getitem__(self, index):
+        return self._reader.timestamp(index)
+
+
+def _read_header(header):
+    if len(header) < _HEADER.size:
+        raise ValueError("Not a LIN trace: file is too short")
+    magic, version, record_size = _HEADER.unpack(header)
+    if magic != TRACE_MAGIC:
+        raise ValueError("Not a LIN trace: bad magic")
+    if version != TRACE_VERSION or record_size != RECORD_SIZE:
+        raise ValueError(f"Unsupported LIN trace version {version} with {record_size} byte records")
@@ -1,13 +1,20 @@
 from enum import IntEnum
-from threading import Thread, Event
-from queue import Queue
-import time
+from threading import Thread, Event, Lock
+from queue import Full
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 import logging
-from .constants import MASTER_DIAGNOSTIC_FRAME_ID, SLAVE_DIAGNOSTIC_FRAME_ID
+from .constants import MASTER_DIAGNOSTIC_FRAME_ID, SLAVE_DIAGNOSTIC_FRAME_ID, BROADCAST_NAD, NEGATIVE_RESPONSE_SID
 from .event import LinEvent
+from .clock import MonotonicClock
+from .queues import BoundedQueue, RingBuffer, DropPolicy
 
 logger = logging.getLogger(__name__)
 
+_PADDING = bytes([0xff] * 8)
+# PCI bytes of consecutive frames, the frame counter starts at 1 and wraps at 16.
+# Sized for the largest PDU the 12 bit FF length field allows
+_CF_PCI = bytes((2 << 4) | (i % 16) for i in range(1, (0xfff - 4 + 5) // 6 + 1))
+
 class TransportThread(Thread):
     def __init__(self, transport):
         Thread.__init__(self)
@@ -16,15 +23,85 @@ class TransportThread(Thread):
 
     def run(self):
         self._running.clear()
-        print("Starting thread")
-        while not self._running.is_set():
-            print("Cycling thread")
-            self._transport.execute()
-            time.sleep(0.010)
-        print("done thread")
+        logger.debug("Transport thread started")
+        try:
+            while not self._running.is_set():
+                # Clear before executing so that a wake-up raised while we are busy
+                # is not lost and simply causes another cycle
+                self._transport._wakeup.clear()
+                if not self._transport.execute():
+                    self._transport.wait(self._transport.idle_timeout())
+        except Exception as e:
+            # E.g. the driver lost its adapter. Nothing would complete the
+            # requests any more, so they fail now instead of hanging
+            logger.exception("Transport thread stopped by an error")
+            self._transport._fail(e)
+            return
+        logger.debug("Transport thread stopped")
 
     def stop(self):
         self._running.set()
+        self._transport.notify()
+
+
+class PendingRequest(Future):
+    # timeout bounds the whole request from submission, time spent queued
+    # behind other requests included. response_timeout bounds how long the
+    # request holds the bus waiting for its response, None for the transport's
+    # default
+    def __init__(self, nad, sid, timeout=None, response_nad=None, response_timeout=None):
+        Future.__init__(self)
+        self.nad = nad
+        self.sid = sid
+        self.timeout = timeout
+        self.response_timeout = response_timeout
+        # Slaves answer with their own NAD, which differs from the request's for
+        # broadcasts and for NAD changes that take effect before the response
+        self.response_nad = nad if response_nad is None else response_nad
+        self.deadline = None
+        # Seconds each response frame pushes the deadline out by, once active
+        self.frame_timeout = None
+        self.submitted = None
+        # When the request's last frame went out and the first frame of its
+        # response came in, twice: *_timestamp from the driver's events (the
+        # TX echo and the response frame), *_time from the transport's clock.
+        # The two time bases are never mixed, see response_time
+        self.tx_frame = None
+        self.tx_timestamp = None
+        self.rx_timestamp = None
+        self.tx_time = None
+        self.rx_time = None
+
+    @property
+    def key(self):
+        # Pending requests are registered by the (NAD, SID) of their response
+        return (self.response_nad, self.sid)
+
+    @property
+    def response_time(self):
+        # From the driver's timestamps where it provides both ends, the bus
+        # time, otherwise from the clock, which includes the host's latency
+        if self.tx_timestamp is not None and self.rx_timestamp is not None:
+            return self.rx_timestamp - self.tx_timestamp
+        if self.tx_time is None or self.rx_time is None:
+            return None
+        return self.rx_time - self.tx_time
+
+
+class FunctionalRequest(PendingRequest):
+    # A request answered by several slaves. Every response arriving within
+    # `window` seconds of the request going out is collected, and the result
+    # is a dict of NAD -> (RSID, data). With `expected` set it completes as
+    # soon as that many slaves have answered
+    def __init__(self, nad, sid, window, expected=None):
+        PendingRequest.__init__(self, nad, sid, response_nad=BROADCAST_NAD, response_timeout=window)
+        self.expected = expected
+        self.responses = dict()
+
+    @property
+    def key(self):
+        # Answered by any NAD, responses are collected while it is active
+        return (None, self.sid)
 
 
 class Transport:
@@ -33,131 +110,597 @@ class Transport:
         FF = 1
         CF = 2
 
-    def __init__(self, is_slave, driver):
+    def __init__(self, is_slave, driver, poll_interval=0.010, burst=False, st_min=0, clock=None, metrics=None,
+                 tx_queue_size=4096, rx_queue_size=256, rx_drop_policy=DropPolicy.DROP_OLDEST, response_timeout=1.0):
         self._thread = None
         self._is_slave = is_slave
-        self._tx_queue = Queue()
-        self._rx_queue = Queue()
+        # Both queues are bounded. The TX queue holds frames and only admits
+        # whole PDUs, producers wait or get queue.Full when it has no room. The
+        # RX queue holds unsolicited PDUs and drops by rx_drop_policy, counting
+        # the losses in rx_overflow_count
+        self._tx_queue = BoundedQueue(tx_queue_size)
+        self._rx_queue = RingBuffer(rx_queue_size, rx_drop_policy)
+        # NAD -> receive queue of the same size, for callers only interested in
+        # one slave. PDUs from other NADs go to the shared queue
+        self._rx_queues = dict()
+        self._rx_queue_size = rx_queue_size
+        self._rx_drop_policy = rx_drop_policy
+        self._closed = False
         self._reset_state()
         self._driver = driver
         self._scheduled_tx_event = None
-        self._timeout = 0.010
+        self._timeout = 0
+        self._wakeup = Event()
+        self.poll_interval = poll_interval
+        # When the next 0x3D header may go out. Headers nobody answers still
+        # come back from some drivers as empty events that wake the thread,
+        # which must not turn into polling back-to-back
+        self._next_poll = None
+        # In burst mode the master writes all frames of a PDU back-to-back,
+        # separated only by st_min seconds and the driver's own bus timing
+        self.burst = burst
+        self.st_min = st_min
+        self._lock = Lock()
+        self._pending_requests = dict()
+        self._active_request = None
+        # Longest a request holds the bus waiting for its response (ISO 17987
+        # N_Cr-like), so that a silent slave cannot stall every request behind it
+        self.response_timeout = response_timeout
+        if clock is None:
+            clock = getattr(driver, "clock", None) or MonotonicClock()
+        self.clock = clock
+        self._step_lock = Lock()
+        self._scheduler = None
+        # Optional TransportMetrics, every hook is skipped when it is None
+        self._metrics = metrics
+        if metrics is not None:
+            metrics.add_gauges(self._gauges)
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def rx_overflow_count(self):
+        return self._rx_queue.overflow_count + sum(queue.overflow_count for queue in list(self._rx_queues.values()))
+
+    def _gauges(self):
+        return {
+            "tx_queue": len(self._tx_queue),
+            "rx_queue": len(self._rx_queue) + sum(len(queue) for queue in list(self._rx_queues.values())),
+            "pending_requests": sum(len(requests) for requests in self._pending_requests.values()),
+        }
+
+    @property
+    def stepped(self):
+        # On a virtual clock nothing runs in the background, callers waiting for
+        # a result drive the transport themselves and time advances instantly
+        # while idle. This keeps simulations deterministic.
+        return self.clock.is_virtual
+
+    def set_scheduler(self, scheduler):
+        # With a schedule table the master only writes diagnostic frames in
+        # the table's request and response slots, and the scheduler drives the
+        # transport instead of the transport's own thread
+        self._scheduler = scheduler
 
     def run(self):
+        if self._scheduler is not None:
+            self._scheduler.start()
+            return
+        if self.stepped:
+            return
+        # Drivers that can signal incoming events let the thread sleep until
+        # something actually happens on the bus
+        if hasattr(self._driver, "set_event_callback"):
+            self._driver.set_event_callback(self.notify)
         self._thread = TransportThread(self)
         self._thread.start()
 
+    def notify(self):
+        self._wakeup.set()
+
+    def wait(self, timeout):
+        return self._wakeup.wait(timeout)
+
+    def idle_timeout(self):
+        timeout = self.poll_interval
+        now = self.clock.time()
+        if self._next_poll is not None and not self._is_slave:
+            timeout = min(timeout, self._next_poll - now)
+        request = self._active_request
+        if request is not None and request.deadline is not None:
+            timeout = min(timeout, request.deadline - now)
+        return max(0, timeout)
+
+    def step(self):
+        if self._scheduler is not None:
+            self._scheduler.step()
+            return
+        with self._step_lock:
+            if not self.execute():
+                self.clock.sleep(self.idle_timeout())
+
+    def wait_for(self, request, timeout=None):
+        # timeout bounds the wait, on top of the request's own deadline on the
+        # bus. Raises TimeoutError when either runs out
+        if self.stepped:
+            deadline = None if timeout is None else self.clock.time() + timeout
+            expired = False
+            while not request.done():
+                if expired:
+                    raise TimeoutError(f"Gave up waiting for NAD 0x{request.response_nad:x} to respond to SID 0x{request.sid:x}")
+                # One more cycle after the deadline lets the transport expire
+                # a request whose own deadline is the same
+                expired = deadline is not None and self.clock.time() >= deadline
+                self.step()
+        try:
+            return request.result(timeout)
+        except FutureTimeoutError:
+            raise TimeoutError(f"Gave up waiting for NAD 0x{request.response_nad:x} to respond to SID 0x{request.sid:x}") from None
+
     def close(self):
+        self._closed = True
+        if self._scheduler is not None:
+            self._scheduler.stop()
         if self._thread is not None:
             self._thread.stop()
             self._thread.join()
             self._thread = None
+            if hasattr(self._driver, "set_event_callback"):
+                self._driver.set_event_callback(None)
+
+        self._fail(ConnectionError("Transport was closed"))
+
+    def _fail(self, error):
+        self._closed = True
+        with self._lock:
+            requests = [request for requests in self._pending_requests.values() for request in requests]
+            self._pending_requests.clear()
+            self._active_request = None
+        # Also wakes up producers waiting for room
+        self._tx_queue.clear()
+        for request in requests:
+            if not request.done():
+                request.set_exception(error)
 
     def execute(self):
-        while True:
-           event = self._driver.read_event(self._timeout)
-           print(event)
-           if event is None:
-               break
-           else:
-               self._receive_from_driver(event)
+        # Returns True when there is more work pending, in which case the caller
+        # should cycle again straight away instead of waiting for a wake-up
+        received = False
+        if getattr(self._driver, "native_batches", False):
+            batch = self._driver.read_events(self._timeout)
+            received = self.receive_batch(batch)
+        else:
+            while True:
+               event = self._driver.read_event(self._timeout)
+               if event is None:
+                   break
+               else:
+                   received = received or len(event.event_payload) > 0
+                   self._receive_from_driver(event)
 
         if self._is_slave:
             if self._scheduled_tx_event is None and not self._tx_queue.empty():
-                event = self._tx_queue.get()
-                self._driver.schedule_slave_response(event)
-                self._scheduled_tx_event = event
+                self._schedule_next()
+            return False
         else:
-            if not self._tx_queue.empty():
-                event = self._tx_queue.get()
-                self._driver.write_message(event)
+            request = self._active_request
+            if request is not None:
+                if request.done():
+                    self._active_request = None
+                elif request.deadline is not None and self.clock.time() >= request.deadline:
+                    self._expire(request)
+
+            if self._scheduler is not None:
+                return False
+
+            # Only one request may be outstanding on the bus, the slave response
+            # has to be collected (or time out) before the next one goes out
+            if self._active_request is None and not self._tx_queue.empty():
+                event, request, last = self._tx_queue.get()
+                self._write(event)
+                if self.burst:
+                    while not last:
+                        if self.st_min > 0:
+                            self.clock.sleep(self.st_min)
+                        event, request, last = self._tx_queue.get()
+                        self._write(event)
+                elif self.st_min > 0 and not last:
+                    self.clock.sleep(self.st_min)
+                self._activate(event, request)
+                # Either more frames are queued or the slave response should be
+                # polled for immediately
+                return True
             else:
-                self._driver.request_slave_response(SLAVE_DIAGNOSTIC_FRAME_ID)
-
-    def receive(self):
-        if self._rx_queue.empty():
-            return None
+                # A slave that just answered may have more frames to send and is
+                # polled again straight away, otherwise once per poll_interval
+                now = self.clock.time()
+                if received or self._next_poll is None or now >= self._next_poll:
+                    self._driver.request_slave_response(SLAVE_DIAGNOSTIC_FRAME_ID)
+                    self._next_poll = now + self.poll_interval
+                return received
+
+    def _write(self, event):
+        self._driver.write_message(event)
+        if self._metrics is not None:
+            self._metrics.frame_tx(event.event_payload)
+
+    def _schedule_next(self):
+        # Slave side: hand the next frame to the driver for the next 0x3D header
+        event, _, _ = self._tx_queue.get()
+        self._driver.schedule_slave_response(event)
+        self._scheduled_tx_event = event
+        if self._metrics is not None:
+            self._metrics.frame_tx(event.event_payload)
+
+    def _activate(self, event, request):
+        if request is not None and not request.done():
+            now = self.clock.time()
+            response_timeout = self.response_timeout if request.response_timeout is None else request.response_timeout
+            if request.timeout is not None:
+                # The caller's bound on the whole request
+                request.deadline = request.submitted + request.timeout
+            elif response_timeout is not None:
+                request.deadline = now + response_timeout
+                # A long response keeps the bus as long as its frames keep
+                # coming, a collection window does not
+                if not isinstance(request, FunctionalRequest):
+                    request.frame_timeout = response_timeout
+            # The response is polled for as soon as the request is out
+            self._next_poll = None
+            # tx_timestamp comes with the frame's TX echo, if the driver has one
+            request.tx_frame = event.event_payload
+            request.tx_time = now
+            self._active_request = request
+
+    def master_request_slot(self):
+        # Called by the scheduler in a master request frame slot. Writes one
+        # frame, unless a request is still waiting for its response. Returns
+        # True if the slot was used
+        if self._active_request is not None or self._tx_queue.empty():
+            return False
+        event, request, _ = self._tx_queue.get()
+        self._write(event)
+        self._activate(event, request)
+        return True
+
+    def slave_response_slot(self):
+        self._driver.request_slave_response(SLAVE_DIAGNOSTIC_FRAME_ID)
+
+    def request(self, nad, sid, data, timeout=None, response_nad=None, block=True, queue_timeout=None, response_timeout=None):
+        # See PendingRequest for timeout and response_timeout, queue_timeout
+        # applies to waiting for room in a full TX queue
+        request = PendingRequest(nad, sid, timeout=timeout, response_nad=response_nad, response_timeout=response_timeout)
+        request.submitted = self.clock.time()
+        events = self._segment(nad, sid, data)
+        self._enqueue(events, request, block, queue_timeout)
+        if self._metrics is not None:
+            self._metrics.requests += 1
+        return request
+
+    def request_functional(self, nad, sid, data, window, expected=None, block=True, queue_timeout=None):
+        # Sent once, answered by every slave the request addresses, see
+        # FunctionalRequest
+        request = FunctionalRequest(nad, sid, window, expected)
+        request.submitted = self.clock.time()
+        self._enqueue(self._segment(nad, sid, data), request, block, queue_timeout)
+        if self._metrics is not None:
+            self._metrics.requests += 1
+        return request
+
+    def cancel(self, request):
+        self._discard(request)
+        if request.cancel():
+            self.notify()
+
+    def _discard(self, request):
+        with self._lock:
+            key = request.key
+            requests = self._pending_requests.get(key)
+            if requests is not None and request in requests:
+                requests.remove(request)
+                if not requests:
+                    del self._pending_requests[key]
+
+    def _expire(self, request):
+        if isinstance(request, FunctionalRequest):
+            # The end of the collection window, not a failure
+            self._complete_functional(request)
+            return
+        self._discard(request)
+        self._active_request = None
+        if self._metrics is not None:
+            self._metrics.timeouts += 1
+        if not request.done():
+            request.set_exception(TimeoutError(f"Timed out waiting for NAD 0x{request.response_nad:x} to respond to SID 0x{request.sid:x}"))
+
+    def _dispatch(self, nad, sid, data, timestamp=None, received=None):
+        # Route a reassembled PDU to the request waiting for it, falling back to
+        # the receive queue for anything that nobody asked for. timestamp and
+        # received are the driver's and the clock's time of its first frame
+        if received is None:
+            received = self.clock.time()
+        if self._metrics is not None:
+            self._metrics.pdus_rx += 1
+        request_sid = sid - 0x40
+        if sid == NEGATIVE_RESPONSE_SID and len(data) > 0:
+            request_sid = data[0]
+
+        request = self._active_request
+        if isinstance(request, FunctionalRequest) and request.sid == request_sid and not request.done():
+            if request.rx_time is None:
+                request.rx_timestamp = timestamp
+                request.rx_time = received
+            request.responses[nad] = (sid, data)
+            if request.expected is not None and len(request.responses) >= request.expected:
+                self._complete_functional(request)
+            return
+
+        # Only the request on the bus can be answered. A late response to an
+        # earlier, expired request must not complete one that is still queued
+        if (request is None or isinstance(request, FunctionalRequest) or request.done() or
+                request.sid != request_sid or request.response_nad not in (nad, BROADCAST_NAD)):
+            request = None
         else:
-            return self._rx_queue.get()
+            self._discard(request)
+
+        if request is None or not request.set_running_or_notify_cancel():
+            if self._metrics is not None:
+                self._metrics.pdus_unsolicited += 1
+            rx_queue = self._rx_queues.get(nad, self._rx_queue)
+            if not rx_queue.put((nad, sid, data)):
+                # A consumer that stopped polling would otherwise flood the log
+                if rx_queue.overflow_count == 1:
+                    logger.warning("Receive queue is full, dropping PDUs. Further drops are counted in rx_overflow_count")
+                if self._metrics is not None:
+                    self._metrics.pdus_dropped += 1
+        else:
+            request.rx_timestamp = timestamp
+            request.rx_time = received
+            if self._metrics is not None:
+                self._metrics.request_completed(request, self.clock.time())
+            request.set_result((nad, sid, data))
+            if request is self._active_request:
+                self._active_request = None
+            self.notify()
+
+    def _complete_functional(self, request):
+        self._discard(request)
+        if request is self._active_request:
+            self._active_request = None
+        if request.set_running_or_notify_cancel():
+            if self._metrics is not None:
+                self._metrics.request_completed(request, self.clock.time())
+            request.set_result(dict(request.responses))
+        self.notify()
+
+    def subscribe(self, nad):
+        # Unsolicited PDUs from nad go to their own queue from now on, read with
+        # receive(nad=nad)
+        with self._lock:
+            rx_queue = self._rx_queues.get(nad)
+            if rx_queue is None:
+                rx_queue = self._rx_queues[nad] = RingBuffer(self._rx_queue_size, self._rx_drop_policy)
+        return rx_queue
+
+    def unsubscribe(self, nad):
+        # PDUs still queued for nad are discarded
+        with self._lock:
+            self._rx_queues.pop(nad, None)
+
+    def receive(self, block=False, timeout=None, nad=None):
+        # Returns None if nothing arrived within the timeout
+        rx_queue = self._rx_queue
+        if nad is not None:
+            rx_queue = self._rx_queues.get(nad)
+            if rx_queue is None:
+                rx_queue = self.subscribe(nad)
+        if block and self.stepped:
+            deadline = None if timeout is None else self.clock.time() + timeout
+            while rx_queue.empty():
+                if deadline is not None and self.clock.time() >= deadline:
+                    return None
+                self.step()
+            block = False
+        return rx_queue.get(block=block, timeout=timeout)
+
+    def clear_rx(self, nad=None):
+        # Discards the unsolicited PDUs queued for nad, or with None those of
+        # the NADs nobody subscribed to, as read by receive(). Other receivers'
+        # queues are theirs to clear
+        if nad is None:
+            self._rx_queue.clear()
+        elif nad in self._rx_queues:
+            self._rx_queues[nad].clear()
+
+    def clear_tx(self, nad=None):
+        # Discards queued PDUs addressed to nad, or all of them, that have not
+        # started going out. The rest of a PDU already partly on the bus is
+        # kept, as the slave could not make sense of a truncated one. Requests
+        # whose frames are discarded are cancelled
+        in_progress = True
+
+        def discard(item):
+            nonlocal in_progress
+            event, _, last = item
+            payload = event.event_payload
+            if in_progress:
+                if payload[1] >> 4 == _CF:
+                    in_progress = not last
+                    return False
+                in_progress = False
+            return nad is None or payload[0] == nad
+
+        for _, request, _ in self._tx_queue.remove(discard):
+            if request is not None:
+                self.cancel(request)
 
     def _reset_state(self):
-        self._current_frame_data = bytearray()
+        self._current_frame_data = None
+        self._current_frame_view = None
+        self._current_offset = 0
         self._current_sid = None
         self._current_nad = None
+        self._current_timestamp = None
+        self._current_received = None
         self._current_frame_counter = 0
         self._remaining_bytes = 0
 
-    def transmit(self, nad, sid, data):
+    def transmit(self, nad, sid, data, block=True, timeout=None):
+        self._enqueue(self._segment(nad, sid, data), None, block, timeout)
+
+    def _enqueue(self, events, request=None, block=True, timeout=None):
+        # The request is attached to the last frame so that its deadline starts
+        # once the whole request is on the bus
+        frames = [(event, None, False) for event in events[:-1]]
+        frames.append((events[-1], request, True))
+        deadline = None
+        while True:
+            if self._closed:
+                raise ConnectionError("Transport was closed")
+            # The frames of one PDU go in together so they never interleave with
+            # another caller's. Requests are registered with queueing so that
+            # clear_tx() and close() find them wherever they are
+            with self._lock:
+                if self._tx_queue.put_all(frames):
+                    if request is not None:
+                        self._pending_requests.setdefault(request.key, []).append(request)
+                    break
+            if deadline is None:
+                if self._metrics is not None:
+                    self._metrics.tx_queue_full += 1
+                deadline = float("inf") if timeout is None else self.clock.time() + timeout
+            remaining = deadline - self.clock.time()
+            if not block or remaining <= 0:
+                raise Full(f"Transmit queue is full, {len(frames)} frames did not fit")
+            if self.stepped:
+                # Nothing drains the queue in the background
+                self.step()
+            else:
+                self._tx_queue.wait_for_space(len(frames), None if timeout is None else remaining)
+        self.notify()
+
+    def _segment(self, nad, sid, data):
         event_id = MASTER_DIAGNOSTIC_FRAME_ID
         if self._is_slave:
             event_id = SLAVE_DIAGNOSTIC_FRAME_ID
 
-        print(f"Transmitting: {event_id} {nad} {sid} {[hex(x) for x in data]}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Transmitting: {event_id} {nad} {sid} {bytes(data).hex()}")
 
-        if len(data) <= 5:
-            print("Using SF")
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data)
+        length = len(data)
+        if length <= 5:
             # SF
             # Pad with 0xff
             # The length shall then be set to the number of used data bytes plus one (for the SID or RSID)
-            pci = (Transport.PCIType.SF << 4) | (len(data) + 1)
-            response = bytearray([nad, pci, sid, 0xff, 0xff, 0xff, 0xff, 0xff])
-            # Copy over pyaload
-            for i, byte in enumerate(data):
-                response[3 + i] = byte
-            self._tx_queue.put(LinEvent(event_id, bytes(response), LinEvent.ChecksumType.CLASSIC))
-        else:
-            # FF
-            pci = (Transport.PCIType.FF << 4) | ((len(data) >> 8) & 0xf)
-            response = bytearray([nad, pci, len(data) & 0xff, sid, 0xff, 0xff, 0xff, 0xff])
-            current_byte = 0
-            # Copy over pyaload
-            for i, byte in enumerate(data[current_byte:current_byte + 4]):
-                response[4 + i] = byte
-            self._tx_queue.put(LinEvent(event_id, bytes(response), LinEvent.ChecksumType.CLASSIC))
-            current_byte = 4
-
-            # CF
-            current_frame = 0
-            while current_byte < len(data):
-                current_frame = (current_frame + 1) % 16
-                pci = (Transport.PCIType.CF << 4) | current_frame
-                response = bytearray([nad, pci, 0xff, 0xff, 0xff, 0xff, 0xff, 0xff])
-                # Copy over pyaload
-                end_byte = min(len(data), current_byte + 6)
-                for i, byte in enumerate(data[current_byte:end_byte]):
-                    response[2 + i] = byte
-                current_byte = end_byte
-                self._tx_queue.put(LinEvent(event_id, bytes(response), LinEvent.ChecksumType.CLASSIC))
-
+            pci = (_SF << 4) | (length + 1)
+            frame = bytearray(_PADDING)
+            frame[0:3] = (nad, pci, sid)
+            frame[3:3 + length] = data
+            return [LinEvent(event_id, bytes(frame), LinEvent.ChecksumType.CLASSIC)]
+
+        # The whole PDU is laid out in one preallocated buffer of 8 byte frames,
+        # padded with 0xff, and filled column by column with strided slices:
+        #
+        # | NAD | PCI | LEN | SID | D1 | D2 | D3 | D4 |   FF
+        # | NAD | PCI | D5  | D6  | D7 | D8 | D9 | D10 |  CF 1
+        # | NAD | PCI | D11 | ...                        CF 2
+        cf_count = (length - 4 + 5) // 6
+        frame_count = 1 + cf_count
+        buffer = bytearray(_PADDING * frame_count)
+        view = memoryview(buffer)
+        pci = (_FF << 4) | ((length >> 8) & 0xf)
+        view[0:4] = bytes((nad, pci, length & 0xff, sid))
+        view[4:8] = data[0:4]
+        end = 8 * frame_count
+        view[8:end:8] = bytes((nad,)) * cf_count
+        view[9:end:8] = _CF_PCI[:cf_count]
+        for column in range(6):
+            column_data = data[4 + column::6]
+            start = 10 + column
+            view[start:start + 8 * len(column_data):8] = column_data
+        view.release()
+
+        pdu = bytes(buffer)
+        return [LinEvent(event_id, pdu[offset:offset + 8], LinEvent.ChecksumType.CLASSIC) for offset in range(0, end, 8)]
+
+    def receive_batch(self, batch):
+        # Feed a LinEventBatch straight from its columns, without creating an
+        # event object per frame. Returns True if any frame carried data
+        received = False
+        event_ids, lengths, directions, timestamps = batch.event_ids, batch.lengths, batch.directions, batch.timestamps
+        checksum_errors = batch.checksum_errors
+        payloads = memoryview(batch.payloads)
+        for index in range(len(event_ids)):
+            if checksum_errors[index]:
+                logger.warning(f"Dropping frame 0x{event_ids[index]:x} with a bad checksum")
+                if self._metrics is not None:
+                    self._metrics.checksum_errors += 1
+                continue
+            length = lengths[index]
+            start = index * 8
+            direction = directions[index]
+            timestamp = timestamps[index]
+            received = received or length > 0
+            self._receive_frame(event_ids[index], payloads[start:start + length],
+                                None if direction < 0 else direction,
+                                None if timestamp != timestamp else timestamp)
+        return received
 
     def _receive_from_driver(self, event):
-        event_id, frame_bytes, frame_length = event.event_id, event.event_payload, len(event.event_payload)
-
-        if self._is_slave and event.direction == LinEvent.Direction.TX and self._scheduled_tx_event is not None:
-            if (self._scheduled_tx_event.event_id == event.event_id) and (self._scheduled_tx_event.event_payload == event.event_payload):
+        if event.checksum_error:
+            # Whatever it carried cannot be trusted, the PDU it belonged to will
+            # be discarded as incomplete
+            logger.warning(f"Dropping frame with a bad checksum: {event}")
+            if self._metrics is not None:
+                self._metrics.checksum_errors += 1
+            return
+        self._receive_frame(event.event_id, event.event_payload, event.direction, event.timestamp)
+
+    def _receive_frame(self, event_id, frame_bytes, direction, timestamp=None):
+        frame_length = len(frame_bytes)
+
+        if self._is_slave and direction == _TX and self._scheduled_tx_event is not None:
+            if (self._scheduled_tx_event.event_id == event_id) and (self._scheduled_tx_event.event_payload == frame_bytes):
                 self._scheduled_tx_event = None
                 if not self._tx_queue.empty():
-                    event = self._tx_queue.get()
-                    self._driver.schedule_slave_response(event)
-                    self._scheduled_tx_event = event
-
-
-        elif ((event.direction == LinEvent.Direction.RX) and
-              (self._is_slave and event.event_id == MASTER_DIAGNOSTIC_FRAME_ID) or
-              (not self._is_slave and event.event_id == SLAVE_DIAGNOSTIC_FRAME_ID)):
+                    self._schedule_next()
+
+        elif not self._is_slave and direction == _TX and event_id == MASTER_DIAGNOSTIC_FRAME_ID:
+            # The echo of the active request's last frame tells when it was
+            # actually on the bus
+            request = self._active_request
+            if request is not None and timestamp is not None and request.tx_frame == frame_bytes:
+                request.tx_timestamp = timestamp
+
+        elif ((direction == _RX) and
+              (self._is_slave and event_id == MASTER_DIAGNOSTIC_FRAME_ID) or
+              (not self._is_slave and event_id == SLAVE_DIAGNOSTIC_FRAME_ID)):
             if not self._is_slave and frame_length == 0:
                 # Master's will see non-responsive slaves as empty messages
+                if self._metrics is not None:
+                    self._metrics.empty_responses += 1
                 return
 
             if frame_length < 8:
                 # If a PDU is not completely filled (applies to CF and SF PDUs only) the unused bytes shall be filled with ones, i.e. their value shall be 255 (0xFF).
-                raise ValueError("SF Frames with unused bytes shall be padded to 8 bytes with ones")
+                self._drop_malformed(f"{frame_length} byte frame, diagnostic frames are padded to 8 bytes")
+                return
 
             nad, pci = frame_bytes[0], frame_bytes[1]
-            pci_type = Transport.PCIType(pci >> 4)
+            pci_type = pci >> 4
             additional_information = pci & 0x0f
+            if self._metrics is not None and pci_type <= _CF:
+                self._metrics.frame_rx(pci_type)
+            if pci_type != _SF and not self._is_slave:
+                request = self._active_request
+                if request is not None and request.frame_timeout is not None:
+                    request.deadline = self.clock.time() + request.frame_timeout
             
-            if pci_type == Transport.PCIType.SF:
+            if pci_type == _SF:
                 # Single Frame
 
                 # Request:
@@ -169,18 +712,22 @@ class Transport:
                 #    0     1      2     3    4    5    6    7
 
                 if self._remaining_bytes > 0:
-                    logger.warn("Received a First-Frame before completing the last one. Previous frame dropped")
+                    logger.warning("Received a First-Frame before completing the last one. Previous frame dropped")
+                    if self._metrics is not None:
+                        self._metrics.pdus_incomplete += 1
                     self._reset_state()
 
-                sid = frame_bytes[2]
                 # The length shall then be set to the number of used data bytes plus one (for the SID or RSID)
+                if not 1 <= additional_information <= 6:
+                    self._drop_malformed(f"Single Frame length {additional_information}")
+                    return
+                sid = frame_bytes[2]
                 length = additional_information - 1
-                data = frame_bytes[3:3+length]
+                data = bytes(frame_bytes[3:3+length])
                 self._reset_state()
-                self._rx_queue.put((nad, sid, data))
+                self._dispatch(nad, sid, data, timestamp)
 
-            elif pci_type == Transport.PCIType.FF:
-                print("Received FF")
+            elif pci_type == _FF:
                 # First Frame
                 # Request:
                 # | NAD | PCI | LEN | SID | D1 | D2 | D3 | D4 |
@@ -191,43 +738,77 @@ class Transport:
                 #    0     1     2      3     4    5    6    7
 
                 if self._remaining_bytes > 0:
-                    logger.warn("Received a First-Frame before completing the last one. Previous frame dropped")
+                    logger.warning("Received a First-Frame before completing the last one. Previous frame dropped")
+                    if self._metrics is not None:
+                        self._metrics.pdus_incomplete += 1
                     self._reset_state()
 
                 length = (additional_information << 8) | frame_bytes[2]
                 sid = frame_bytes[3]
-                self._remaining_bytes = length - 4
-                self._current_frame_data += frame_bytes[4:]
+                # Preallocate the whole PDU from the length field, consecutive
+                # frames are then copied straight into place
+                first_length = min(length, 4)
+                self._current_frame_data = bytearray(length)
+                self._current_frame_view = memoryview(self._current_frame_data)
+                self._current_frame_view[0:first_length] = frame_bytes[4:4 + first_length]
+                self._current_offset = first_length
+                self._remaining_bytes = length - first_length
                 self._current_nad = nad
                 self._current_sid = sid
-                print(f"Remaining bytes: {self._remaining_bytes}")
+                self._current_timestamp = timestamp
+                self._current_received = self.clock.time()
 
-            elif pci_type == Transport.PCIType.CF:
-                print("Received CF")
+            elif pci_type == _CF:
                 # Consecutive Frame
                 # Request/Response:
                 # | NAD | PCI | D1 | D2 | D3 | D4 | D5 | D6 |
                 #    0     1     2    3    4    5    6    7
 
                 if self._remaining_bytes == 0:
-                    logger.warn("Received a Consecutive Frame but was not expecting more bytes. Discarding")
+                    logger.warning("Received a Consecutive Frame but was not expecting more bytes. Discarding")
+                    if self._metrics is not None:
+                        self._metrics.cf_unexpected += 1
                     self._reset_state()
                     return
 
                 frame_counter = additional_information
                 next_frame_counter = (self._current_frame_counter + 1) % 16
                 if frame_counter != next_frame_counter:
-                    logger.warn("Received an out-of-order Consecutive Frame but was not expecting more bytes. Discarding")
+                    logger.warning("Received an out-of-order Consecutive Frame but was not expecting more bytes. Discarding")
+                    if self._metrics is not None:
+                        self._metrics.cf_out_of_order += 1
                     self._reset_state()
                     return
 
                 length = min(self._remaining_bytes, 6)
+                offset = self._current_offset
+                self._current_frame_view[offset:offset + length] = frame_bytes[2:2 + length]
+                self._current_offset = offset + length
                 self._remaining_bytes -= length
-                self._current_frame_data += frame_bytes[2:2 + length]
                 self._current_frame_counter = next_frame_counter
 
-                print(f"Remaining bytes: {self._remaining_bytes}")
                 if (self._remaining_bytes == 0):
                     nad, sid, data = self._current_nad, self._current_sid, self._current_frame_data
+                    timestamp, received = self._current_timestamp, self._current_received
+                    self._current_frame_view.release()
                     self._reset_state()
-                    self._rx_queue.put((nad, sid, data))
+                    self._dispatch(nad, sid, data, timestamp, received)
+
+            else:
+                self._drop_malformed(f"{pci_type} is not a valid PCIType")
+
+    def _drop_malformed(self, reason):
+        # A slave sending garbage must not take the transport down with it. The
+        # PDU being reassembled, if any, cannot be completed either
+        logger.warning(f"Dropping malformed diagnostic frame: {reason}")
+        if self._metrics is not None:
+            self._metrics.frames_malformed += 1
+            if self._remaining_bytes > 0:
+                self._metrics.pdus_incomplete += 1
+        self._reset_state()
+
+
+# Plain ints of the enums used on the per-frame path, where attribute lookups on
+# the enum classes are a measurable share of the cost
+_SF, _FF, _CF = int(Transport.PCIType.SF), int(Transport.PCIType.FF), int(Transport.PCIType.CF)
+_RX, _TX = int(LinEvent.Direction.RX), int(LinEvent.Direction.TX)
@@ -19,5 +19,8 @@ setuptools.setup(name='lindiagnostics',
           "Operating System :: OS Independent",
           "Topic :: Scientific/Engineering :: Interface Engine/Protocol Translator",
       ],
-      python_requires='>=3.6'
+      python_requires='>=3.6',
+      extras_require={
+          'analysis': ['numpy'],
+      }
      )
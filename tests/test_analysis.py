@@ -0,0 +1,59 @@
+import pytest
+from lindiagnostics import LinMaster
+from lindiagnostics.drivers import SimulatedLinNetwork
+from lindiagnostics.clock import VirtualClock
+from lindiagnostics.event import LinEvent
+from lindiagnostics.trace import TraceRecorder, TraceReader, TraceWriter
+from lindiagnostics.transport import Transport
+from lindiagnostics.constants import *
+
+numpy = pytest.importorskip("numpy")
+from lindiagnostics.analysis import decode_pdus, pdu_data
+
+SLAVE_NAD = 0x01
+
+def test_decode_recorded_session(tmp_path):
+    path = tmp_path / "session.lintrace"
+    network = SimulatedLinNetwork(clock=VirtualClock())
+    network.register_slave(SLAVE_NAD, 0x1234, 0x5678, 0x01, serial_number=bytes([1, 2, 3, 4]))
+    recorder = TraceRecorder(network.get_master_driver(), path)
+    with LinMaster(recorder) as lin_master:
+        lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1)
+        response_time = lin_master.last_response_time
+        lin_master.slave_data_dump(bytes(range(5)), nad=SLAVE_NAD, timeout=1)
+    recorder.close()
+
+    with TraceReader(path) as reader:
+        table = decode_pdus(reader)
+        assert list(table["frame_id"]) == [MASTER_DIAGNOSTIC_FRAME_ID, SLAVE_DIAGNOSTIC_FRAME_ID] * 2
+        assert list(table["sid"]) == [READ_BY_IDENTIFIER_SID, READ_BY_IDENTIFIER_SID + 0x40, DATA_DUMP_SID, DATA_DUMP_SID + 0x40]
+        assert list(table["nad"]) == [SLAVE_NAD] * 4
+        assert numpy.isnan(table["latency"][0])
+        # Latency is measured from the end of the request, the master from its
+        # last frame's timestamp, which is when the frame starts
+        assert table["latency"][1] == pytest.approx(response_time - (table["end_timestamp"][0] - table["timestamp"][0]))
+        assert pdu_data(reader, table[3]) == bytes(range(5))
+        del table
+
+def test_decode_multi_frame_and_broken_pdus(tmp_path):
+    path = tmp_path / "frames.lintrace"
+    transport = Transport(False, None)
+    good = transport._segment(SLAVE_NAD, 0x22, bytes(range(40)))
+    broken = transport._segment(SLAVE_NAD, 0x22, bytes(range(20)))
+    broken[1], broken[2] = broken[2], broken[1]
+    timestamp = 0.0
+    with TraceWriter(path) as writer:
+        for event in good + broken + transport._segment(SLAVE_NAD, 0x10, bytes([1])):
+            writer.write(event.stamped(LinEvent.Direction.TX, timestamp))
+            # Unrelated application frames in between
+            writer.write(LinEvent(0x10, bytes([0xaa, 0xbb]), LinEvent.ChecksumType.ENHANCED, LinEvent.Direction.RX, timestamp))
+            timestamp += 0.01
+
+    with TraceReader(path) as reader:
+        table = decode_pdus(reader)
+        assert list(table["sid"]) == [0x22, 0x10]
+        assert list(table["length"]) == [40, 1]
+        assert list(table["frame_count"]) == [len(good), 1]
+        assert pdu_data(reader, table[0]) == bytes(range(40))
+        assert pdu_data(reader, table[1]) == bytes([1])
+        del table
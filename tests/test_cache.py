@@ -0,0 +1,93 @@
+import asyncio
+import pytest
+from lindiagnostics import LinMaster, AsyncLinMaster, NegativeResponseError
+from lindiagnostics.cache import IdentityCache
+from lindiagnostics.clock import VirtualClock
+from lindiagnostics.drivers import SimulatedLinNetwork
+from lindiagnostics.constants import *
+
+SLAVE_NAD = 0x01
+SERIAL_NUMBER = bytes([1, 2, 3, 4])
+
+def test_ttl():
+    clock = VirtualClock()
+    cache = IdentityCache(ttl=10, clock=clock)
+    cache.put((1, 0, 0x7fff, 0xffff), (1, b"id"))
+    clock.advance(9)
+    assert cache.get((1, 0, 0x7fff, 0xffff)) == (1, b"id")
+    clock.advance(2)
+    assert cache.get((1, 0, 0x7fff, 0xffff)) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert len(cache) == 0
+
+def test_lru_eviction():
+    cache = IdentityCache(max_size=2)
+    cache.put(1, (1, b"a"))
+    cache.put(2, (2, b"b"))
+    cache.get(1)
+    cache.put(3, (3, b"c"))
+    assert cache.get(2) is None
+    assert cache.get(1) == (1, b"a")
+    assert cache.get(3) == (3, b"c")
+
+def test_invalidate():
+    cache = IdentityCache()
+    cache.put((1, 0), (1, b"a"))
+    cache.put((2, 0), (2, b"b"))
+    cache.put((BROADCAST_NAD, 0), (2, b"b"))
+    cache.invalidate(1)
+    assert [cache.get((1, 0)), cache.get((2, 0)), cache.get((BROADCAST_NAD, 0))] == [None, (2, b"b"), None]
+    cache.put((BROADCAST_NAD, 1), (3, b"c"))
+    # Answered with NAD 3, so it describes that node
+    cache.invalidate(3)
+    assert cache.get((BROADCAST_NAD, 1)) is None
+    cache.invalidate(BROADCAST_NAD)
+    assert len(cache) == 0
+
+@pytest.fixture
+def network():
+    network = SimulatedLinNetwork(clock=VirtualClock())
+    network.register_slave(SLAVE_NAD, 0x1234, 0x5678, 0x01, serial_number=SERIAL_NUMBER)
+    return network
+
+def test_repeated_lookups_stay_off_the_bus(network):
+    with LinMaster(network.get_master_driver(), metrics=True, identity_cache=True) as lin_master:
+        for _ in range(10):
+            assert lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1) == (SLAVE_NAD, SERIAL_NUMBER)
+            assert lin_master.get_slave_product_identifier(nad=SLAVE_NAD, timeout=1) == (SLAVE_NAD, 0x1234, 0x5678, 0x01)
+        assert lin_master.metrics.requests == 2
+        assert lin_master.identity_cache.hits == 18
+
+def test_nad_changes_invalidate(network):
+    new_nad = SLAVE_NAD + 1
+    with LinMaster(network.get_master_driver(), identity_cache=True) as lin_master:
+        lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1)
+        lin_master.get_slave_serial_number(timeout=1)
+        lin_master.assign_slave_nad(new_nad, nad=SLAVE_NAD, timeout=1)
+        assert len(lin_master.identity_cache) == 0
+        with pytest.raises(TimeoutError):
+            lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=0.1)
+        assert lin_master.get_slave_serial_number(nad=new_nad, timeout=1) == (new_nad, SERIAL_NUMBER)
+
+        lin_master.conditional_change_slave_nad(0, 0, 0, 0, SLAVE_NAD, nad=new_nad, timeout=1)
+        assert lin_master.identity_cache.get((new_nad, DATA_IDENTIFIER_SERIAL_NUMBER, BROADCAST_SUPPLIER_ID, BROADCAST_FUNCTION_ID)) is None
+        assert lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1) == (SLAVE_NAD, SERIAL_NUMBER)
+
+        lin_master.save_slave_configuration(nad=SLAVE_NAD, timeout=1)
+        assert len(lin_master.identity_cache) == 0
+
+def test_async_master_shares_the_cache_logic(network):
+    new_nad = SLAVE_NAD + 1
+
+    async def main():
+        async with AsyncLinMaster(network.get_master_driver(), metrics=True, identity_cache=True) as lin_master:
+            for _ in range(3):
+                assert await lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1) == (SLAVE_NAD, SERIAL_NUMBER)
+            assert (lin_master.metrics.requests, lin_master.identity_cache.hits) == (1, 2)
+            with pytest.raises(NegativeResponseError):
+                await lin_master.read_by_identifier(3, nad=SLAVE_NAD, timeout=1)
+            assert await lin_master.assign_slave_nad(new_nad, nad=SLAVE_NAD, timeout=1) == SLAVE_NAD
+            assert len(lin_master.identity_cache) == 0
+            assert await lin_master.get_slave_serial_number(nad=new_nad, timeout=1) == (new_nad, SERIAL_NUMBER)
+
+    asyncio.run(main())
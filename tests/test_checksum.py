@@ -0,0 +1,81 @@
+import random
+import pytest
+from lindiagnostics.checksum import (protected_id, frame_id_from_pid, checksum, verify_event, verify_batch,
+                                     verify_records, with_checksum, CHECKSUM_TABLE)
+from lindiagnostics.event import LinEvent, LinEventBatch
+from lindiagnostics.trace import TraceWriter, TraceReader
+from lindiagnostics.constants import *
+
+def carry_sum_checksum(data):
+    total = 0
+    for byte in data:
+        total += byte
+        if total > 0xff:
+            total -= 0xff
+    return ~total & 0xff
+
+def test_protected_ids():
+    assert [protected_id(frame_id) for frame_id in (0x00, 0x01, 0x10, 0x3C, 0x3D)] == [0x80, 0xC1, 0x50, 0x3C, 0x7D]
+    assert all(frame_id_from_pid(protected_id(frame_id)) == frame_id for frame_id in range(64))
+    with pytest.raises(ValueError):
+        frame_id_from_pid(0x3C | 0x40)
+
+def test_checksum_matches_carry_sum():
+    # Example from the LIN specification: PID 0x4A with data 0x55 0x93 0xE5
+    assert CHECKSUM_TABLE[0x4A + 0x55 + 0x93 + 0xE5] == 0xE6
+    generator = random.Random(0)
+    for _ in range(1000):
+        frame_id = generator.randrange(0x3C)
+        data = bytes(generator.randrange(256) for _ in range(generator.randrange(1, 9)))
+        assert checksum(frame_id, data, LinEvent.ChecksumType.CLASSIC) == carry_sum_checksum(data)
+        assert checksum(frame_id, data, LinEvent.ChecksumType.ENHANCED) == carry_sum_checksum(bytes([protected_id(frame_id)]) + data)
+    # Diagnostic frames always use the classic checksum
+    assert checksum(MASTER_DIAGNOSTIC_FRAME_ID, bytes(8), LinEvent.ChecksumType.ENHANCED) == 0xff
+
+def test_verify_event_tags_bad_frames():
+    event = with_checksum(LinEvent(0x10, bytes([1, 2, 3]), LinEvent.ChecksumType.ENHANCED))
+    assert verify_event(event) is event
+    corrupted = event._replace(event_payload=bytes([1, 2, 4]))
+    assert verify_event(corrupted).checksum_error
+    unknown = LinEvent(0x10, bytes([1, 2, 4]), LinEvent.ChecksumType.ENHANCED)
+    assert verify_event(unknown) is unknown
+
+def make_events():
+    events = [with_checksum(LinEvent(frame_id, bytes([frame_id, 0x55]), LinEvent.ChecksumType.ENHANCED, LinEvent.Direction.RX, float(frame_id)))
+              for frame_id in range(10)]
+    events[3] = events[3]._replace(checksum=events[3].checksum ^ 0x01)
+    events[7] = events[7]._replace(event_payload=bytes([0, 0]))
+    events.append(LinEvent(0x11, bytes([1]), LinEvent.ChecksumType.ENHANCED))
+    return events
+
+def test_verify_batch():
+    batch = LinEventBatch(make_events())
+    assert verify_batch(batch) == [3, 7]
+    assert [event.checksum_error for event in batch] == [index in (3, 7) for index in range(11)]
+
+def test_verify_trace_records(tmp_path):
+    pytest.importorskip("numpy")
+    path = tmp_path / "bus.lintrace"
+    events = make_events()
+    with TraceWriter(path) as writer:
+        for event in events:
+            writer.write(event)
+    with TraceReader(path) as reader:
+        assert list(reader) == events
+        bad = verify_records(reader.as_array())
+        assert list(bad.nonzero()[0]) == [3, 7]
+        del bad
+
+def test_transport_drops_corrupted_frames():
+    from lindiagnostics.transport import Transport
+    sender = Transport(True, None)
+    receiver = Transport(False, None)
+    events = [with_checksum(event).stamped(LinEvent.Direction.RX, None) for event in sender._segment(0x01, 0x62, bytes(range(10)))]
+    # A bit flip in the first consecutive frame
+    corrupted = events[1]._replace(event_payload=bytes([events[1].event_payload[0] ^ 0x80]) + events[1].event_payload[1:])
+    for event in [events[0], verify_event(corrupted)] + events[2:]:
+        receiver._receive_from_driver(event)
+    assert receiver.receive() is None
+    for event in events:
+        receiver._receive_from_driver(event)
+    assert receiver.receive() == (0x01, 0x62, bytes(range(10)))
@@ -0,0 +1,16 @@
+import pytest
+from lindiagnostics.clock import TimestampMapper
+
+def test_timestamp_mapper_tracks_minimum_offset():
+    mapper = TimestampMapper(max_drift=0)
+    assert mapper.map(10.0, host_time=105.0) == 105.0
+    # A frame that reached the host faster improves the estimate
+    assert mapper.map(11.0, host_time=105.5) == 105.5
+    # Delayed frames keep the best offset
+    assert mapper.map(12.0, host_time=110.0) == pytest.approx(106.5)
+
+def test_timestamp_mapper_follows_drift():
+    mapper = TimestampMapper(max_drift=0.001)
+    mapper.map(0.0, host_time=100.0)
+    # The device clock runs slow, a bounded share of the gap is accepted
+    assert mapper.map(10.0, host_time=110.5) == pytest.approx(110.0105)
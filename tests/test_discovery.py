@@ -0,0 +1,72 @@
+from lindiagnostics import LinMaster
+from lindiagnostics.drivers import SimulatedLinNetwork
+from lindiagnostics.clock import VirtualClock
+from lindiagnostics.discovery import scan, scan_channels, SlaveInfo
+from lindiagnostics.constants import DATA_IDENTIFIER_LIN_PRODUCT_IDENTIFIER
+
+SUPPLIER_ID = 0x1234
+FUNCTION_ID = 0x5678
+
+def make_network(nads):
+    network = SimulatedLinNetwork(clock=VirtualClock())
+    for nad in nads:
+        network.register_slave(nad, SUPPLIER_ID, FUNCTION_ID, nad & 0xff, serial_number=bytes([nad] * 4))
+    return network
+
+def expected_inventory(nads):
+    return [SlaveInfo(nad, SUPPLIER_ID, FUNCTION_ID, nad, bytes([nad] * 4)) for nad in sorted(nads)]
+
+def test_scan():
+    nads = [0x01, 0x20, 0x7d]
+    network = make_network(nads)
+    with LinMaster(network.get_master_driver()) as lin_master:
+        start_time = network.clock.time()
+        assert scan(lin_master, timeout=0.05, retries=0) == expected_inventory(nads)
+        # Every silent NAD costs about one deadline, not a full transport cycle
+        # per poll or a default timeout
+        assert network.clock.time() - start_time < 0x7d * 0.05 * 1.5
+
+def test_scan_defaults():
+    nads = [0x01, 0x20, 0x7d]
+    network = make_network(nads)
+    with LinMaster(network.get_master_driver()) as lin_master:
+        start_time = network.clock.time()
+        assert scan(lin_master) == expected_inventory(nads)
+        # Silent NADs are asked once, about one 150 ms deadline each
+        assert network.clock.time() - start_time < 0x7d * 0.15 * 1.2
+
+def test_scan_retries_incomplete_identities():
+    network = make_network([0x01, 0x02])
+    slave = network.slaves[0]
+    get_id_bytes = slave.get_id_bytes
+    failures = []
+    def fail_once(id_type):
+        # A negative response to the first product identifier read
+        if not failures:
+            failures.append(id_type)
+            return None
+        return get_id_bytes(id_type)
+    slave.get_id_bytes = fail_once
+    with LinMaster(network.get_master_driver()) as lin_master:
+        inventory = scan(lin_master, nads=range(0x01, 0x04), timeout=0.05, retries=0)
+        assert inventory == [SlaveInfo(0x01, None, None, None, bytes([0x01] * 4))] + expected_inventory([0x02])
+        failures.clear()
+        assert scan(lin_master, nads=range(0x01, 0x04), timeout=0.05) == expected_inventory([0x01, 0x02])
+    assert failures == [DATA_IDENTIFIER_LIN_PRODUCT_IDENTIFIER]
+
+def test_scan_range_without_serial_numbers():
+    network = make_network([0x05, 0x06, 0x30])
+    with LinMaster(network.get_master_driver()) as lin_master:
+        inventory = scan(lin_master, nads=range(0x01, 0x10), serial_numbers=False)
+    assert inventory == [SlaveInfo(0x05, SUPPLIER_ID, FUNCTION_ID, 0x05, None), SlaveInfo(0x06, SUPPLIER_ID, FUNCTION_ID, 0x06, None)]
+
+def test_scan_channels():
+    channels = [[0x01, 0x02], [], [0x10]]
+    networks = [make_network(nads) for nads in channels]
+    lin_masters = [LinMaster(network.get_master_driver()) for network in networks]
+    try:
+        inventories = scan_channels(lin_masters, nads=range(0x01, 0x20), timeout=0.02)
+    finally:
+        for lin_master in lin_masters:
+            lin_master.close()
+    assert inventories == [expected_inventory(nads) for nads in channels]
@@ -0,0 +1,53 @@
+import math
+import pytest
+from lindiagnostics.event import LinEvent, LinEventBatch
+
+def test_lin_event_is_immutable():
+    event = LinEvent(0x3C, bytes([1, 2, 3]), LinEvent.ChecksumType.CLASSIC)
+    with pytest.raises(AttributeError):
+        event.timestamp = 1.0
+    with pytest.raises(AttributeError):
+        event.extra = 1
+    stamped = event.replace(direction=LinEvent.Direction.TX, timestamp=1.0)
+    assert event.direction is None and event.timestamp is None
+    assert stamped == LinEvent(0x3C, bytes([1, 2, 3]), LinEvent.ChecksumType.CLASSIC, LinEvent.Direction.TX, 1.0)
+
+def test_batch_round_trip():
+    events = [
+        LinEvent(0x3C, bytes(range(8)), LinEvent.ChecksumType.CLASSIC, LinEvent.Direction.TX, 1.5),
+        LinEvent(0x3D, bytes(), LinEvent.ChecksumType.CLASSIC, LinEvent.Direction.RX, 2.5),
+        LinEvent(0x10, bytes([0xAA, 0xBB]), LinEvent.ChecksumType.ENHANCED),
+    ]
+    batch = LinEventBatch(events)
+    assert len(batch) == 3
+    assert list(batch) == events
+    assert batch[-1] == events[-1]
+    assert list(batch[1:]) == events[1:]
+    assert len(batch.payloads) == 3 * LinEventBatch.PAYLOAD_SIZE
+    assert math.isnan(batch.timestamps[2]) and batch.directions[2] == -1
+
+    other = LinEventBatch()
+    other.extend(batch)
+    other.extend(events[:1])
+    assert list(other) == events + events[:1]
+    other.clear()
+    assert len(other) == 0
+
+def test_batch_rejects_long_payload():
+    with pytest.raises(ValueError):
+        LinEventBatch().append_frame(0x3C, bytes(9), LinEvent.ChecksumType.CLASSIC)
+
+def test_simulated_driver_reads_batches():
+    from lindiagnostics.drivers import SimulatedLinNetwork
+    driver = SimulatedLinNetwork().get_master_driver()
+    assert driver.native_batches
+    events = [
+        LinEvent(0x3D, bytes(range(8)), LinEvent.ChecksumType.CLASSIC, LinEvent.Direction.RX, 1.5, 0x12),
+        LinEvent(0x10, bytes([0xAA]), LinEvent.ChecksumType.ENHANCED, checksum=0x34, checksum_error=True),
+        LinEvent(0x3C, bytes(), LinEvent.ChecksumType.CLASSIC, LinEvent.Direction.TX, 2.5),
+    ]
+    for event in events:
+        driver.put_event(event)
+    assert list(driver.read_events(0, max_events=2)) == events[:2]
+    assert list(driver.read_events(0)) == events[2:]
+    assert len(driver.read_events(0)) == 0
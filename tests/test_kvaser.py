@@ -0,0 +1,222 @@
+import queue
+import time
+from types import SimpleNamespace
+import pytest
+from lindiagnostics import LinMaster
+from lindiagnostics.drivers import kvaser
+from lindiagnostics.drivers.kvaser import KvaserLinDriver
+from lindiagnostics.event import LinEvent
+from lindiagnostics.checksum import checksum
+from lindiagnostics.constants import *
+
+
+# Just enough of canlib's linlib for the driver to run against FakeChannel
+class LinNoMessageError(Exception):
+    pass
+
+
+MessageFlag = SimpleNamespace(TX=0x01, NODATA=0x02, CSUM_ERROR=0x04, PARITY_ERROR=0x08)
+
+
+class FakeFrame:
+    def __init__(self, id, data, flags=0, timestamp=None):
+        self.id = id
+        self.data = bytes(data)
+        self.flags = flags
+        self.timestamp = timestamp if timestamp is not None else time.monotonic() * 1000
+        self.info = SimpleNamespace(timestamp=self.timestamp, checkSum=checksum(id, self.data))
+
+
+class FakeChannel:
+    # Frames written are echoed back as TX frames unless echo is False. Items
+    # put in `incoming` are returned by read(), exceptions are raised by it
+    def __init__(self):
+        self.incoming = queue.Queue()
+        self.written = []
+        self.echo = True
+        self.headers = 0
+        # Raised by the next writeMessage()
+        self.write_error = None
+
+    def read(self, timeout):
+        try:
+            item = self.incoming.get(timeout=timeout / 1000)
+        except queue.Empty:
+            raise LinNoMessageError() from None
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def requestMessage(self, frame_id):
+        # Like the adapter, a header nobody answers comes back as an empty frame
+        self.headers += 1
+        self.incoming.put(FakeFrame(frame_id, bytes(), flags=MessageFlag.NODATA))
+
+    def writeMessage(self, frame):
+        if self.write_error is not None:
+            error, self.write_error = self.write_error, None
+            raise error
+        self.written.append(frame)
+        if self.echo:
+            self.incoming.put(FakeFrame(frame.id, frame.data, flags=MessageFlag.TX))
+
+    def getCanHandle(self):
+        return 0
+
+    def busOn(self):
+        pass
+
+    def busOff(self):
+        pass
+
+    def setupLIN(self, flags, bps):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def channel(monkeypatch):
+    channel = FakeChannel()
+    linlib = SimpleNamespace(openMaster=lambda index: channel, openSlave=lambda index: channel,
+                             Setup=SimpleNamespace(ENHANCED_CHECKSUM=0x01, VARIABLE_DLC=0x02),
+                             MessageFlag=MessageFlag,
+                             exceptions=SimpleNamespace(LinNoMessageError=LinNoMessageError))
+    monkeypatch.setattr(kvaser, "linlib", linlib, raising=False)
+    monkeypatch.setattr(kvaser, "LINFrame", lambda id, data: SimpleNamespace(id=id, data=bytes(data)), raising=False)
+    return channel
+
+
+@pytest.fixture
+def make_driver(channel):
+    drivers = []
+    def make_driver(**kwargs):
+        driver = KvaserLinDriver(0, False, **kwargs)
+        drivers.append(driver)
+        return driver
+    yield make_driver
+    for driver in drivers:
+        driver.close()
+
+
+def request_event(index):
+    return LinEvent(MASTER_DIAGNOSTIC_FRAME_ID, bytes([0x01, 0x06, 0xb2, index, 0xff, 0x7f, 0xff, 0xff]), LinEvent.ChecksumType.CLASSIC)
+
+
+def test_write_waits_for_echo(make_driver):
+    driver = make_driver()
+    confirmation = driver.write_message(request_event(0))
+    assert confirmation.done()
+    echo = confirmation.result()
+    assert echo.direction == LinEvent.Direction.TX and echo.event_payload == request_event(0).event_payload
+    assert driver.read_event(1) == echo
+
+
+def test_full_window_is_reported(channel, make_driver):
+    errors = []
+    channel.echo = False
+    driver = make_driver(tx_window=2, on_tx_error=lambda event, error: errors.append((event, error)))
+    driver.write_message(request_event(0), timeout=10)
+    driver.write_message(request_event(1), timeout=10)
+    with pytest.raises(TimeoutError):
+        driver.write_message(request_event(2), timeout=0.05)
+    assert len(channel.written) == 2
+    assert [(event, type(error)) for event, error in errors] == [(request_event(2), TimeoutError)]
+
+
+def test_unconfirmed_frames_expire_out_of_order(channel, make_driver):
+    errors = []
+    channel.echo = False
+    driver = make_driver(tx_window=2, on_tx_error=lambda event, error: errors.append((event, error)))
+    slow = driver.write_message(request_event(0), timeout=10)
+    fast = driver.write_message(request_event(1), timeout=0.05)
+    # The reader thread expires the second frame although the first one,
+    # ahead of it, has not expired
+    with pytest.raises(TimeoutError):
+        fast.result(1)
+    assert not slow.done()
+    assert [event for event, _ in errors] == [request_event(1)]
+
+    # Room in the window again, and the late echo still confirms the first
+    channel.incoming.put(FakeFrame(MASTER_DIAGNOSTIC_FRAME_ID, request_event(0).event_payload, flags=MessageFlag.TX))
+    assert slow.result(1).event_payload == request_event(0).event_payload
+    driver.write_message(request_event(2), timeout=0.05)
+
+
+def test_failed_write_frees_the_window(channel, make_driver):
+    errors = []
+    driver = make_driver(on_tx_error=lambda event, error: errors.append((event, error)))
+    channel.write_error = OSError("write failed")
+    with pytest.raises(OSError):
+        driver.write_message(request_event(0), timeout=0.1)
+    assert [(event, type(error)) for event, error in errors] == [(request_event(0), OSError)]
+    # The next frame goes out straight away, and nothing times out later
+    start = time.monotonic()
+    assert driver.write_message(request_event(1), timeout=0.5).result(0).event_payload == request_event(1).event_payload
+    assert time.monotonic() - start < 0.1
+    time.sleep(0.2)
+    assert len(errors) == 1
+
+
+def slave_frame(index):
+    return FakeFrame(SLAVE_DIAGNOSTIC_FRAME_ID, bytes([0x01, 0x01, index, 0xff, 0xff, 0xff, 0xff, 0xff]))
+
+
+def test_reader_survives_bad_frames(channel, make_driver):
+    driver = make_driver()
+    unstamped = slave_frame(0)
+    unstamped.timestamp = unstamped.info.timestamp = None
+    channel.incoming.put(unstamped)
+    channel.incoming.put(slave_frame(1))
+    assert driver.read_event(1).event_payload == slave_frame(1).data
+
+    def failing_callback():
+        raise RuntimeError("callback failed")
+    driver.set_event_callback(failing_callback)
+    channel.incoming.put(slave_frame(2))
+    channel.incoming.put(slave_frame(3))
+    assert [driver.read_event(1).event_payload for _ in range(2)] == [slave_frame(2).data, slave_frame(3).data]
+    assert driver.reader_error is None
+
+
+def test_channel_error_stops_the_reader_visibly(channel, make_driver):
+    errors = []
+    channel.echo = False
+    driver = make_driver(tx_window=2, on_tx_error=lambda event, error: errors.append((event, error)))
+    confirmation = driver.write_message(request_event(0), timeout=10)
+    channel.incoming.put(slave_frame(0))
+    channel.incoming.put(RuntimeError("adapter removed"))
+
+    with pytest.raises(ConnectionError):
+        confirmation.result(1)
+    assert [event for event, _ in errors] == [request_event(0)]
+    assert isinstance(driver.reader_error, RuntimeError)
+    # What was read before the error is still delivered
+    assert driver.read_event(1).event_payload == slave_frame(0).data
+    with pytest.raises(ConnectionError):
+        driver.read_event(None)
+    with pytest.raises(ConnectionError):
+        driver.write_message(request_event(1))
+
+
+def test_channel_error_fails_requests(channel, make_driver):
+    driver = make_driver()
+    with LinMaster(driver) as lin_master:
+        request = lin_master.submit_diagnostic(0x01, READ_BY_IDENTIFIER_SID, bytes([0, 0xff, 0x7f, 0xff, 0xff]), timeout=10)
+        while not channel.written:
+            time.sleep(0.001)
+        channel.incoming.put(RuntimeError("adapter removed"))
+        with pytest.raises(ConnectionError):
+            lin_master.wait_diagnostic(request, timeout=5)
+        with pytest.raises(ConnectionError):
+            lin_master.submit_diagnostic(0x01, READ_BY_IDENTIFIER_SID, bytes([0, 0xff, 0x7f, 0xff, 0xff]))
+
+
+def test_idle_master_polls_at_poll_interval(channel, make_driver):
+    driver = make_driver()
+    with LinMaster(driver, poll_interval=0.1):
+        time.sleep(0.5)
+    # Each unanswered header wakes the transport, which must not make it poll
+    # again before poll_interval has passed
+    assert 3 <= channel.headers <= 8
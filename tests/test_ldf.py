@@ -0,0 +1,166 @@
+import pytest
+from lindiagnostics import LinMaster
+from lindiagnostics.drivers import SimulatedLinNetwork
+from lindiagnostics.clock import VirtualClock
+from lindiagnostics.event import LinEvent, LinEventBatch
+from lindiagnostics.ldf import parse_ldf, load_ldf
+from lindiagnostics.schedule import SlotType
+from lindiagnostics.constants import *
+
+LDF = """
+/* Example description */
+LIN_description_file;
+LIN_protocol_version = "2.1";
+LIN_language_version = "2.1";
+LIN_speed = 19.2 kbps;
+
+Nodes {
+  Master: BCM, 5 ms, 0.1 ms;
+  Slaves: Mirror;
+}
+
+Signals {
+  MirrorFold: 1, 0, BCM, Mirror;
+  MirrorTilt: 7, 0, BCM, Mirror;
+  MirrorTemp: 8, 50, Mirror, BCM;
+  MirrorState: 2, 0, Mirror, BCM;
+  MirrorSerial: 32, {0, 0, 0, 0}, Mirror, BCM;
+}
+
+Diagnostic_signals {
+  MasterReqB0: 8, 0;
+  SlaveRespB0: 8, 0;
+}
+
+Frames {
+  MirrorCommand: 0x10, BCM, 1 {
+    MirrorFold, 0;
+    MirrorTilt, 1;
+  }
+  MirrorStatus: 0x11, Mirror, 6 {
+    MirrorTemp, 0;
+    MirrorState, 8;
+    MirrorSerial, 16;
+  }
+}
+
+Diagnostic_frames {
+  MasterReq: 0x3c { MasterReqB0, 0; }
+  SlaveResp: 0x3d { SlaveRespB0, 0; }
+}
+
+Node_attributes {
+  Mirror {
+    LIN_protocol = "2.1";
+    configured_NAD = 0x0A;
+    initial_NAD = 0x0B;
+    product_id = 0x1234, 0x5678, 2;
+    response_error = MirrorState;
+    P2_min = 50 ms;
+    ST_min = 0 ms;
+    configurable_frames { MirrorCommand; MirrorStatus; }
+  }
+}
+
+Schedule_tables {
+  Normal {
+    MirrorCommand delay 10 ms;
+    MirrorStatus delay 10 ms;
+    MasterReq delay 10 ms;
+    SlaveResp delay 10 ms;
+  }
+}
+
+Signal_encoding_types {
+  Temperature {
+    logical_value, 255, "invalid";
+    physical_value, 0, 254, 0.5, -40, "degC";
+  }
+  State {
+    logical_value, 0, "idle";
+    logical_value, 1, "moving";
+  }
+}
+
+Signal_representation {
+  Temperature: MirrorTemp;
+  State: MirrorState;
+}
+"""
+
+@pytest.fixture
+def ldf():
+    return parse_ldf(LDF)
+
+def test_parse(ldf):
+    assert ldf.protocol_version == "2.1"
+    assert ldf.baud_rate == 19200
+    assert ldf.master == "BCM"
+    assert ldf.slaves == ["Mirror"]
+    assert ldf.frames["MirrorStatus"].frame_id == 0x11
+    node = ldf.node("Mirror")
+    assert (node.configured_nad, node.initial_nad) == (0x0A, 0x0B)
+    assert (node.supplier_id, node.function_id, node.variant_id) == (0x1234, 0x5678, 2)
+    assert node.p2_min == pytest.approx(0.05)
+    assert ldf.node_by_nad(0x0A) is node
+
+def test_decode_event(ldf):
+    assert ldf.decode(LinEvent(0x10, bytes([0x05]), LinEvent.ChecksumType.ENHANCED)) == {"MirrorFold": 1, "MirrorTilt": 2}
+    status = ldf.decode(LinEvent(0x11, bytes([100, 0x01, 1, 2, 3, 4]), LinEvent.ChecksumType.ENHANCED))
+    assert status == {"MirrorTemp": 10.0, "MirrorState": "moving", "MirrorSerial": bytes([1, 2, 3, 4])}
+    assert ldf.decode(LinEvent(0x11, bytes([255, 0x03, 0, 0, 0, 0]), 1))["MirrorTemp"] == "invalid"
+    assert ldf.decode(LinEvent(0x20, bytes([0]), 1)) is None
+
+def test_decode_batch_matches_single_events(ldf):
+    events = [LinEvent(0x11, bytes([i, i % 2, 0, 0, 0, i]), 1) for i in range(10)]
+    events.insert(3, LinEvent(0x10, bytes([0x03]), 1))
+    events.insert(5, LinEvent(0x30, bytes([0xff]), 1))
+    decoded = ldf.decode_batch(LinEventBatch(events))
+    indices, values = decoded["MirrorStatus"]
+    assert [events[index].event_id for index in indices] == [0x11] * 10
+    for position, index in enumerate(indices):
+        single = ldf.decode(events[index])
+        assert {name: column[position] for name, column in values.items()} == single
+    assert decoded["MirrorCommand"] == ([3], {"MirrorFold": [1], "MirrorTilt": [1]})
+
+def test_schedule_table(ldf):
+    table = ldf.schedule_table("Normal")
+    assert [slot.slot_type for slot in table] == [SlotType.UNCONDITIONAL, SlotType.UNCONDITIONAL, SlotType.MASTER_REQUEST, SlotType.SLAVE_RESPONSE]
+    # The master publishes MirrorCommand with its initial values
+    assert table[0].payload == bytes([0])
+    assert table[1].payload is None
+    assert table.cycle_time == pytest.approx(0.040)
+
+@pytest.mark.parametrize('command', ("AssignNAD { Mirror }", "MirrorEvent", "MirrorSporadic"))
+def test_schedule_table_rejects_unsupported_entries(command):
+    ldf = parse_ldf(LDF.replace("MasterReq delay 10 ms;", f"{command} delay 10 ms;") + """
+Event_triggered_frames {
+  MirrorEvent: MirrorCollisions, 0x12, MirrorStatus;
+}
+Sporadic_frames {
+  MirrorSporadic: MirrorCommand;
+}
+""")
+    with pytest.raises(ValueError):
+        ldf.schedule_table("Normal")
+
+def test_compiled_ldf_is_cached(tmp_path, monkeypatch):
+    path = tmp_path / "mirror.ldf"
+    path.write_text(LDF)
+    cache_dir = tmp_path / "cache"
+    first = load_ldf(path, cache_dir=cache_dir)
+    assert len(list(cache_dir.iterdir())) == 1
+
+    import lindiagnostics.ldf
+    monkeypatch.setattr(lindiagnostics.ldf, "parse_ldf", lambda text: pytest.fail("LDF parsed again"))
+    second = load_ldf(path, cache_dir=cache_dir)
+    assert second.node("Mirror") == first.node("Mirror")
+    assert second.decode(LinEvent(0x10, bytes([0x05]), 1)) == {"MirrorFold": 1, "MirrorTilt": 2}
+
+def test_node_identity_for_read_by_identifier(ldf):
+    node = ldf.node("Mirror")
+    network = SimulatedLinNetwork(clock=VirtualClock())
+    network.register_slave(node.configured_nad, node.supplier_id, node.function_id, node.variant_id)
+    with LinMaster(network.get_master_driver()) as lin_master:
+        nad, supplier_id, function_id, variant_id = lin_master.get_slave_product_identifier(timeout=1, **node.identity)
+        assert (nad, supplier_id, function_id, variant_id) == (node.configured_nad, node.supplier_id, node.function_id, node.variant_id)
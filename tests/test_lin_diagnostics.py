@@ -1,6 +1,8 @@
 import pytest
-from lindiagnostics import LinMaster
+from lindiagnostics import LinMaster, NegativeResponseError
 from lindiagnostics.drivers import SimulatedLinNetwork
+from lindiagnostics.clock import VirtualClock, lin_frame_duration
+from lindiagnostics.event import LinEvent
 from lindiagnostics.constants import *
 
 SLAVE_NAD = 1
@@ -9,8 +11,10 @@ SLAVE_FUNCTION_ID = 3
 SLAVE_VARIANT_ID = 4
 SLAVE_SERIAL_NUMBER = bytes([1,2,3,4])
 
-@pytest.fixture
-def simulated_lin_network():
+@pytest.fixture(params=('real_time', 'virtual_time'))
+def simulated_lin_network(request):
+    if request.param == 'virtual_time':
+        return SimulatedLinNetwork(clock=VirtualClock())
     return SimulatedLinNetwork()
 
 @pytest.fixture
@@ -43,6 +47,9 @@ def test_read_serial_number(lin_slave, lin_master, target_function_id, target_su
 def test_read_bad_sid(lin_slave, lin_master, target_function_id, target_supplier_id, target_nad):
     with pytest.raises(NotImplementedError) as excinfo:
         result = lin_master.read_by_identifier(3, supplier_id=target_supplier_id, function_id=target_function_id, nad=target_nad)
+    assert isinstance(excinfo.value, NegativeResponseError)
+    assert excinfo.value.sid == READ_BY_IDENTIFIER_SID
+    assert excinfo.value.error_code == 0x12
 
 @pytest.mark.parametrize('target_nad', (SLAVE_NAD, BROADCAST_NAD))
 @pytest.mark.parametrize('target_supplier_id', (SLAVE_SUPPLIER_ID, BROADCAST_SUPPLIER_ID))
@@ -59,6 +66,11 @@ def test_save_configuration(lin_slave, lin_master, target_nad):
     assert SLAVE_NAD == result
     assert lin_slave.saved_nad == SLAVE_NAD
 
+def test_save_configuration_timeout(lin_master):
+    # No slave registered on the network
+    with pytest.raises(TimeoutError):
+        lin_master.save_slave_configuration(nad=SLAVE_NAD, timeout=0.1)
+
 @pytest.mark.parametrize('target_nad', (SLAVE_NAD, BROADCAST_NAD))
 def test_assign_frame_ids(lin_slave, lin_master, target_nad):
     result = lin_master.assign_slave_frame_ids(1, [0x80, 0xc1, 0x42, 0x0], nad=target_nad)
@@ -115,3 +127,219 @@ def test_data_dump(lin_slave, lin_master, target_nad):
     payload = bytes(list(range(5)))
     result = lin_master.slave_data_dump(payload, nad=target_nad)
     assert SLAVE_NAD, payload == result
+
+def test_transport_wakes_on_events(simulated_lin_network, lin_slave):
+    # With a very long idle poll interval, only wake-ups from transmit() and the
+    # driver can make the request complete in time
+    master_driver = simulated_lin_network.get_master_driver()
+    with LinMaster(master_driver, poll_interval=60) as lin_master:
+        result = lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=5)
+        assert result == (SLAVE_NAD, SLAVE_SERIAL_NUMBER)
+
+def test_pipelined_requests_to_different_nads(simulated_lin_network, lin_slave, lin_master):
+    from concurrent.futures import ThreadPoolExecutor
+    other_nad = SLAVE_NAD + 1
+    other_serial_number = bytes([5, 6, 7, 8])
+    simulated_lin_network.register_slave(other_nad, SLAVE_SUPPLIER_ID, SLAVE_FUNCTION_ID, SLAVE_VARIANT_ID, serial_number=other_serial_number)
+
+    nads = [SLAVE_NAD, other_nad] * 10
+    with ThreadPoolExecutor(max_workers=len(nads)) as executor:
+        results = list(executor.map(lambda nad: lin_master.get_slave_serial_number(nad=nad, timeout=5), nads))
+
+    for nad, result in zip(nads, results):
+        expected_serial_number = SLAVE_SERIAL_NUMBER if nad == SLAVE_NAD else other_serial_number
+        assert result == (nad, expected_serial_number)
+
+def test_async_master_multiple_buses():
+    import asyncio
+    from lindiagnostics import AsyncLinMaster
+
+    networks = [SimulatedLinNetwork() for _ in range(4)]
+    for i, network in enumerate(networks):
+        network.register_slave(SLAVE_NAD, SLAVE_SUPPLIER_ID, SLAVE_FUNCTION_ID, SLAVE_VARIANT_ID, serial_number=bytes([i, 2, 3, 4]))
+
+    async def interrogate(network):
+        async with AsyncLinMaster(network.get_master_driver()) as lin_master:
+            product = await lin_master.get_slave_product_identifier(nad=SLAVE_NAD, timeout=5)
+            serial = await lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=5)
+            with pytest.raises(TimeoutError):
+                await lin_master.save_slave_configuration(nad=SLAVE_NAD + 1, timeout=0.1)
+            return product, serial
+
+    async def main():
+        return await asyncio.gather(*[interrogate(network) for network in networks])
+
+    results = asyncio.run(main())
+    for i, (product, serial) in enumerate(results):
+        assert product == (SLAVE_NAD, SLAVE_SUPPLIER_ID, SLAVE_FUNCTION_ID, SLAVE_VARIANT_ID)
+        assert serial == (SLAVE_NAD, bytes([i, 2, 3, 4]))
+
+@pytest.mark.parametrize('burst', (False, True))
+def test_large_transfer(simulated_lin_network, lin_slave, burst):
+    master_driver = simulated_lin_network.get_master_driver()
+    # UDS Routine Control, mirrored back by the simulated slave
+    payload = bytes([0x01, 0x00, 0x01]) + bytes(range(256)) * 15 + bytes(252)
+    assert len(payload) == 4095
+    with LinMaster(master_driver, burst=burst) as lin_master:
+        result = lin_master.request_diagnostic(SLAVE_NAD, 0x31, payload, timeout=10)
+        assert result == (SLAVE_NAD, payload)
+
+def test_nad_index_follows_nad_changes(simulated_lin_network, lin_slave, lin_master):
+    other_nad = 0x10
+    other_slave = simulated_lin_network.register_slave(other_nad, 5, 6, 7, serial_number=bytes([5, 6, 7, 8]))
+    new_nad = 0x20
+    assert lin_master.assign_slave_nad(new_nad, nad=SLAVE_NAD, timeout=1) == SLAVE_NAD
+    assert lin_slave.nad == new_nad
+    assert [slave for _, slave in simulated_lin_network.slaves_by_nad[new_nad]] == [lin_slave]
+    assert SLAVE_NAD not in simulated_lin_network.slaves_by_nad
+
+    assert lin_master.get_slave_serial_number(nad=new_nad, timeout=1) == (new_nad, SLAVE_SERIAL_NUMBER)
+    with pytest.raises(TimeoutError):
+        lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=0.1)
+
+    # Conditional Change NAD: (1 ^ 1) & 0xff == 0 for the first byte of the serial
+    assert lin_master.conditional_change_slave_nad(1, 1, 0xff, 0x5, SLAVE_NAD, nad=other_nad, timeout=1) == SLAVE_NAD
+    assert other_slave.nad == SLAVE_NAD
+    assert lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1) == (SLAVE_NAD, bytes([5, 6, 7, 8]))
+
+    # Broadcasts still reach every slave
+    lin_master.save_slave_configuration(nad=BROADCAST_NAD, timeout=1)
+    assert lin_slave.saved_nad == new_nad
+    assert other_slave.saved_nad == SLAVE_NAD
+
+def test_virtual_time_is_deterministic_and_fast():
+    import time
+
+    def run():
+        clock = VirtualClock()
+        network = SimulatedLinNetwork(clock=clock, baud_rate=19200)
+        network.register_slave(SLAVE_NAD, SLAVE_SUPPLIER_ID, SLAVE_FUNCTION_ID, SLAVE_VARIANT_ID, serial_number=SLAVE_SERIAL_NUMBER)
+        with LinMaster(network.get_master_driver()) as lin_master:
+            assert lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1) == (SLAVE_NAD, SLAVE_SERIAL_NUMBER)
+            # One request and one response frame of 8 bytes each, plus the empty
+            # slave response slot polled in the same cycle the response completes
+            assert clock.time() == pytest.approx(2 * lin_frame_duration(8, 19200) + lin_frame_duration(0, 19200))
+            with pytest.raises(TimeoutError):
+                lin_master.save_slave_configuration(nad=SLAVE_NAD + 1, timeout=30)
+        return clock.time()
+
+    start = time.monotonic()
+    first, second = run(), run()
+    assert first == second
+    assert first > 30
+    assert time.monotonic() - start < 5
+
+def test_response_time_from_frame_timestamps():
+    clock = VirtualClock()
+    network = SimulatedLinNetwork(clock=clock, baud_rate=19200)
+    network.register_slave(SLAVE_NAD, SLAVE_SUPPLIER_ID, SLAVE_FUNCTION_ID, SLAVE_VARIANT_ID, serial_number=SLAVE_SERIAL_NUMBER)
+    with LinMaster(network.get_master_driver()) as lin_master:
+        assert lin_master.last_response_time is None
+        lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1)
+        # The simulated network stamps frames when they start, the response
+        # follows straight after the request frame
+        assert lin_master.last_response_time == pytest.approx(lin_frame_duration(8, 19200))
+
+class EchoLessDriver:
+    # Drops the echoes of written frames and stamps the rest on its own time
+    # base, like an adapter whose timestamps are not mapped onto the host's
+    def __init__(self, driver, offset):
+        self._driver = driver
+        self.clock = driver.clock
+        self.offset = offset
+
+    def set_event_callback(self, callback):
+        self._driver.set_event_callback(callback)
+
+    def read_event(self, timeout):
+        while True:
+            event = self._driver.read_event(timeout)
+            if event is None:
+                return None
+            if event.direction != LinEvent.Direction.TX:
+                return event.replace(timestamp=event.timestamp + self.offset)
+
+    def write_message(self, lin_event):
+        self._driver.write_message(lin_event)
+
+    def request_slave_response(self, message_id):
+        self._driver.request_slave_response(message_id)
+
+def test_response_time_without_tx_echoes():
+    clock = VirtualClock()
+    network = SimulatedLinNetwork(clock=clock, baud_rate=19200)
+    network.register_slave(SLAVE_NAD, SLAVE_SUPPLIER_ID, SLAVE_FUNCTION_ID, SLAVE_VARIANT_ID, serial_number=SLAVE_SERIAL_NUMBER)
+    with LinMaster(EchoLessDriver(network.get_master_driver(), offset=1000)) as lin_master:
+        lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1)
+        # Both ends come from the clock, the driver's time base is never
+        # compared with it. The clock also counts the wait for the next 10 ms poll
+        assert lin_frame_duration(8, 19200) <= lin_master.last_response_time <= lin_frame_duration(8, 19200) + 0.010
+
+def test_requests_wait_for_room_in_a_full_queue(simulated_lin_network, lin_slave):
+    from concurrent.futures import ThreadPoolExecutor
+    with LinMaster(simulated_lin_network.get_master_driver(), tx_queue_size=2) as lin_master:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=5), range(16)))
+    assert results == [(SLAVE_NAD, SLAVE_SERIAL_NUMBER)] * 16
+
+def test_simulated_driver_queue_is_bounded():
+    network = SimulatedLinNetwork(clock=VirtualClock(), buffer_size=4)
+    master_driver = network.get_master_driver()
+    for _ in range(10):
+        master_driver.write_message(LinEvent(0x10, bytes([1, 2]), LinEvent.ChecksumType.ENHANCED))
+    # The master sees the TX echo of every frame, only the latest are kept
+    assert len(master_driver.event_queue) == 4
+    assert master_driver.overflow_count == 6
+
+def test_functional_read_by_identifier(simulated_lin_network, lin_slave, lin_master):
+    serial_numbers = {SLAVE_NAD: SLAVE_SERIAL_NUMBER}
+    for nad in range(SLAVE_NAD + 1, SLAVE_NAD + 5):
+        serial_numbers[nad] = bytes([nad] * 4)
+        simulated_lin_network.register_slave(nad, SLAVE_SUPPLIER_ID, SLAVE_FUNCTION_ID, SLAVE_VARIANT_ID, serial_number=serial_numbers[nad])
+    responses = lin_master.read_by_identifier_all(DATA_IDENTIFIER_SERIAL_NUMBER, window=0.5)
+    assert {nad: payload[:4] for nad, payload in responses.items()} == serial_numbers
+
+def test_functional_request_completes_with_expected_responses():
+    clock = VirtualClock()
+    network = SimulatedLinNetwork(clock=clock)
+    for nad in (1, 2, 3):
+        network.register_slave(nad, SLAVE_SUPPLIER_ID, SLAVE_FUNCTION_ID, SLAVE_VARIANT_ID)
+    with LinMaster(network.get_master_driver()) as lin_master:
+        start_time = clock.time()
+        # Multi-frame responses (UDS Routine Control), one slave after the other
+        payload = bytes([0x01, 0x00, 0x01] + [0x55] * 10)
+        responses = lin_master.functional_request(0x31, payload, window=10, expected=3)
+        assert clock.time() - start_time < 1
+    assert responses == {nad: (0x71, payload) for nad in (1, 2, 3)}
+
+def test_silent_nad_does_not_stall_other_requests(simulated_lin_network, lin_slave):
+    from concurrent.futures import ThreadPoolExecutor
+    silent_nad = SLAVE_NAD + 4
+    with LinMaster(simulated_lin_network.get_master_driver()) as lin_master:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            # Without a timeout the silent NAD still only holds the bus for the
+            # master's response timeout
+            silent = executor.submit(lin_master.get_slave_serial_number, nad=silent_nad)
+            while lin_master._transport._active_request is None and not silent.done():
+                pass
+            answered = executor.submit(lin_master.get_slave_serial_number, nad=SLAVE_NAD, timeout=2)
+            assert answered.result(timeout=5) == (SLAVE_NAD, SLAVE_SERIAL_NUMBER)
+            with pytest.raises(TimeoutError):
+                silent.result(timeout=5)
+
+def test_timeout_includes_time_queued():
+    from concurrent.futures import ThreadPoolExecutor
+    # Real time only: on a virtual clock the two callers' steps race for time
+    network = SimulatedLinNetwork()
+    network.register_slave(SLAVE_NAD, SLAVE_SUPPLIER_ID, SLAVE_FUNCTION_ID, SLAVE_VARIANT_ID, serial_number=SLAVE_SERIAL_NUMBER)
+    with LinMaster(network.get_master_driver()) as lin_master:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            silent = executor.submit(lin_master.get_slave_serial_number, nad=SLAVE_NAD + 4, timeout=1)
+            while lin_master._transport._active_request is None and not silent.done():
+                pass
+            # Queued behind a request holding the bus for longer than it may wait
+            queued = executor.submit(lin_master.get_slave_serial_number, nad=SLAVE_NAD, timeout=0.2)
+            with pytest.raises(TimeoutError):
+                queued.result(timeout=5)
+            with pytest.raises(TimeoutError):
+                silent.result(timeout=5)
@@ -0,0 +1,62 @@
+import json
+import pytest
+from lindiagnostics import LinMaster
+from lindiagnostics.drivers import SimulatedLinNetwork
+from lindiagnostics.clock import VirtualClock
+from lindiagnostics.metrics import LatencyHistogram, TransportMetrics
+from lindiagnostics.transport import Transport
+from lindiagnostics.event import LinEvent
+from lindiagnostics.constants import *
+
+SLAVE_NAD = 0x01
+
+def test_latency_histogram():
+    histogram = LatencyHistogram()
+    for seconds in (0.0005, 0.003, 0.003, 0.004, 20.0):
+        histogram.record(seconds)
+    assert histogram.count == 5
+    assert histogram.mean == pytest.approx(20.0105 / 5)
+    assert histogram.percentile(0.5) == 0.005
+    assert histogram.percentile(1.0) == 20.0
+    assert histogram.snapshot()["buckets"] == {"0.001": 1, "0.005": 3, "+inf": 1}
+
+def test_master_metrics():
+    network = SimulatedLinNetwork(clock=VirtualClock())
+    network.register_slave(SLAVE_NAD, 0x1234, 0x5678, 0x01, serial_number=bytes([1, 2, 3, 4]))
+    with LinMaster(network.get_master_driver(), metrics=True) as lin_master:
+        lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1)
+        lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1)
+        with pytest.raises(TimeoutError):
+            lin_master.save_slave_configuration(nad=SLAVE_NAD + 1, timeout=0.1)
+        snapshot = lin_master.metrics.snapshot()
+
+    # Snapshots are plain data
+    json.dumps(snapshot)
+    assert snapshot["requests"] == 3
+    assert snapshot["timeouts"] == 1
+    assert snapshot["frames_tx"] == {"SF": 3, "FF": 0, "CF": 0}
+    assert snapshot["frames_rx"] == {"SF": 2, "FF": 0, "CF": 0}
+    assert snapshot["empty_responses"] == 0
+    assert snapshot["gauges"] == {"tx_queue": 0, "rx_queue": 0, "pending_requests": 0}
+    round_trip = snapshot["round_trip"][f"0x{READ_BY_IDENTIFIER_SID:02x}/0x{SLAVE_NAD:02x}"]
+    assert round_trip["count"] == 2
+    assert snapshot["response_time"][f"0x{READ_BY_IDENTIFIER_SID:02x}/0x{SLAVE_NAD:02x}"]["count"] == 2
+
+def test_metrics_are_optional():
+    network = SimulatedLinNetwork(clock=VirtualClock())
+    with LinMaster(network.get_master_driver()) as lin_master:
+        assert lin_master.metrics is None
+
+def test_reassembly_errors_are_counted():
+    metrics = TransportMetrics()
+    sender = Transport(True, None)
+    receiver = Transport(False, None, metrics=metrics)
+    events = [event.stamped(LinEvent.Direction.RX, None) for event in sender._segment(0x01, 0x62, bytes(range(20)))]
+    # Second CF before the first, then a stray CF and a complete PDU
+    for event in [events[0], events[2], events[1]] + events:
+        receiver._receive_from_driver(event)
+    snapshot = metrics.snapshot()
+    assert snapshot["cf_out_of_order"] == 1
+    assert snapshot["cf_unexpected"] == 1
+    assert snapshot["frames_rx"] == {"SF": 0, "FF": 2, "CF": 2 + len(events) - 1}
+    assert snapshot["pdus_rx"] == snapshot["pdus_unsolicited"] == 1
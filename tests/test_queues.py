@@ -0,0 +1,55 @@
+import threading
+import pytest
+from lindiagnostics.queues import RingBuffer, BoundedQueue, DropPolicy
+
+def test_ring_buffer_fifo():
+    ring = RingBuffer(3)
+    assert ring.get() is None
+    for i in range(3):
+        assert ring.put(i)
+    assert ring.full()
+    assert [ring.get(), ring.get(), ring.get()] == [0, 1, 2]
+    assert ring.empty()
+
+def test_ring_buffer_drop_oldest():
+    ring = RingBuffer(3, DropPolicy.DROP_OLDEST)
+    results = [ring.put(i) for i in range(5)]
+    assert results == [True, True, True, False, False]
+    assert ring.overflow_count == 2
+    assert [ring.get() for _ in range(len(ring))] == [2, 3, 4]
+
+def test_ring_buffer_drop_newest():
+    ring = RingBuffer(3, DropPolicy.DROP_NEWEST)
+    for i in range(5):
+        ring.put(i)
+    assert ring.overflow_count == 2
+    assert [ring.get() for _ in range(len(ring))] == [0, 1, 2]
+
+def test_ring_buffer_blocking_get():
+    ring = RingBuffer(1)
+    assert ring.get(block=True, timeout=0.01) is None
+    threading.Timer(0.01, ring.put, args=(42,)).start()
+    assert ring.get(block=True, timeout=5) == 42
+
+def test_ring_buffer_capacity():
+    with pytest.raises(ValueError):
+        RingBuffer(0)
+
+def test_bounded_queue_admits_groups_whole():
+    bounded = BoundedQueue(5)
+    assert bounded.put_all([0, 1, 2])
+    assert not bounded.put_all([3, 4, 5])
+    assert len(bounded) == 3
+    assert bounded.put_all([3, 4])
+    assert bounded.full()
+    with pytest.raises(ValueError):
+        bounded.put_all(list(range(6)))
+    assert [bounded.get() for _ in range(5)] == [0, 1, 2, 3, 4]
+    assert bounded.get() is None
+
+def test_bounded_queue_wait_for_space():
+    bounded = BoundedQueue(2)
+    bounded.put_all([0, 1])
+    assert not bounded.wait_for_space(1, timeout=0.01)
+    threading.Timer(0.01, bounded.get).start()
+    assert bounded.wait_for_space(1, timeout=5)
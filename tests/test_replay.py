@@ -0,0 +1,65 @@
+import pytest
+from lindiagnostics import LinMaster
+from lindiagnostics.drivers import SimulatedLinNetwork, ReplayLinDriver
+from lindiagnostics.clock import VirtualClock
+from lindiagnostics.trace import TraceRecorder
+from lindiagnostics.constants import *
+
+SLAVE_NAD = 0x01
+SLAVE_SERIAL_NUMBER = bytes([1, 2, 3, 4])
+
+@pytest.fixture
+def recorded_session(tmp_path):
+    path = tmp_path / "session.lintrace"
+    network = SimulatedLinNetwork(clock=VirtualClock())
+    network.register_slave(SLAVE_NAD, 0x1234, 0x5678, 0x01, serial_number=SLAVE_SERIAL_NUMBER)
+    network.register_slave(SLAVE_NAD + 1, 0x1234, 0x5678, 0x01, serial_number=bytes([5, 6, 7, 8]))
+    recorder = TraceRecorder(network.get_master_driver(), path)
+    with LinMaster(recorder) as lin_master:
+        lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1)
+        response_time = lin_master.last_response_time
+        lin_master.read_by_identifier(DATA_IDENTIFIER_LIN_PRODUCT_IDENTIFIER, nad=SLAVE_NAD + 1, timeout=1)
+    recorder.close()
+    return path, response_time
+
+def test_replay_as_fast_as_possible(recorded_session):
+    path, _ = recorded_session
+    driver = ReplayLinDriver(path, speed=None, clock=VirtualClock())
+    with LinMaster(driver) as lin_master:
+        assert lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1) == (SLAVE_NAD, SLAVE_SERIAL_NUMBER)
+        nad, payload = lin_master.read_by_identifier(DATA_IDENTIFIER_LIN_PRODUCT_IDENTIFIER, nad=SLAVE_NAD + 1, timeout=1)
+        assert nad == SLAVE_NAD + 1
+    driver.close()
+    assert driver.finished
+    assert driver.mismatches == []
+
+@pytest.mark.parametrize("speed", [1.0, 4.0])
+def test_replay_scales_response_times(recorded_session, speed):
+    path, response_time = recorded_session
+    driver = ReplayLinDriver(path, speed=speed, clock=VirtualClock())
+    with LinMaster(driver, poll_interval=0.0001) as lin_master:
+        lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1)
+        assert lin_master.last_response_time == pytest.approx(response_time / speed, abs=0.0002)
+    driver.close()
+
+def test_replay_reports_mismatches(recorded_session):
+    path, _ = recorded_session
+    driver = ReplayLinDriver(path, speed=None, clock=VirtualClock())
+    with LinMaster(driver) as lin_master:
+        with pytest.raises(TimeoutError):
+            # The recorded slave answers for a different NAD
+            lin_master.get_slave_serial_number(nad=SLAVE_NAD + 2, timeout=1)
+    driver.close()
+    assert len(driver.mismatches) == 1
+    mismatch = driver.mismatches[0]
+    assert mismatch.index == 0
+    assert mismatch.expected.event_payload[0] == SLAVE_NAD
+    assert mismatch.actual.event_payload[0] == SLAVE_NAD + 2
+
+def test_replay_in_real_time(recorded_session):
+    path, _ = recorded_session
+    driver = ReplayLinDriver(path, speed=10.0)
+    with LinMaster(driver) as lin_master:
+        assert lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1) == (SLAVE_NAD, SLAVE_SERIAL_NUMBER)
+    driver.close()
+    assert driver.mismatches == []
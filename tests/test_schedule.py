@@ -0,0 +1,52 @@
+import pytest
+from lindiagnostics import LinMaster, ScheduleTable
+from lindiagnostics.drivers import SimulatedLinNetwork
+from lindiagnostics.clock import VirtualClock
+from lindiagnostics.constants import *
+
+SLAVE_NAD = 0x01
+SLAVE_SERIAL_NUMBER = bytes([1, 2, 3, 4])
+
+def make_network(clock=None):
+    network = SimulatedLinNetwork(clock=clock)
+    slave = network.register_slave(SLAVE_NAD, 0x1234, 0x5678, 0x01, serial_number=SLAVE_SERIAL_NUMBER)
+    return network, slave
+
+def test_diagnostics_interleaved_with_application_frames():
+    clock = VirtualClock()
+    network, _ = make_network(clock)
+    table = ScheduleTable().unconditional(0x10, 0.010, payload=bytes([1, 2])).master_request(0.010).slave_response(0.010)
+    written = []
+    master_driver = network.get_master_driver()
+    write_message = master_driver.write_message
+    master_driver.write_message = lambda event: (written.append((event.event_id, clock.time())), write_message(event))
+
+    with LinMaster(master_driver, schedule=table) as lin_master:
+        lin_master.scheduler.publish(0x10, bytes([3, 4]))
+        assert lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1) == (SLAVE_NAD, SLAVE_SERIAL_NUMBER)
+        stats = lin_master.scheduler.stats
+
+    # Every frame starts exactly on its slot, whatever the frames before took
+    assert written[:2] == [(0x10, pytest.approx(0.0)), (MASTER_DIAGNOSTIC_FRAME_ID, pytest.approx(0.010))]
+    assert stats.max_jitter == 0
+    assert stats.violations == 0
+
+def test_request_waits_for_its_slot():
+    clock = VirtualClock()
+    network, _ = make_network(clock)
+    table = ScheduleTable.diagnostic(0.020)
+    with LinMaster(network.get_master_driver(), schedule=table) as lin_master:
+        lin_master.save_slave_configuration(nad=SLAVE_NAD, timeout=1)
+        # One request slot, then the response slot
+        assert clock.time() == pytest.approx(0.040)
+        with pytest.raises(TimeoutError):
+            lin_master.save_slave_configuration(nad=SLAVE_NAD + 1, timeout=0.1)
+
+def test_real_time_schedule_reports_jitter():
+    network, _ = make_network()
+    table = ScheduleTable.diagnostic(0.002)
+    with LinMaster(network.get_master_driver(), schedule=table) as lin_master:
+        assert lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1) == (SLAVE_NAD, SLAVE_SERIAL_NUMBER)
+        stats = lin_master.scheduler.stats
+        assert stats.count > 0
+        assert stats.max_jitter >= stats.mean_jitter >= 0
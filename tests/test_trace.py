@@ -0,0 +1,80 @@
+import pytest
+from lindiagnostics import LinMaster
+from lindiagnostics.drivers import SimulatedLinNetwork
+from lindiagnostics.clock import VirtualClock
+from lindiagnostics.event import LinEvent, LinEventBatch
+from lindiagnostics.trace import TraceWriter, TraceRecorder, TraceReader, RECORD_SIZE
+from lindiagnostics.constants import *
+
+SLAVE_NAD = 0x01
+
+def test_write_and_read_back(tmp_path):
+    path = tmp_path / "bus.lintrace"
+    events = [
+        LinEvent(0x3C, bytes([1, 2, 3, 4, 5, 6, 7, 8]), LinEvent.ChecksumType.CLASSIC, LinEvent.Direction.TX, 1.5),
+        LinEvent(0x3D, bytes(), LinEvent.ChecksumType.CLASSIC, LinEvent.Direction.RX, 2.0),
+        LinEvent(0x10, bytes([0xaa, 0xbb]), LinEvent.ChecksumType.ENHANCED),
+    ]
+    with TraceWriter(path, chunk_records=2) as writer:
+        for event in events:
+            writer.write(event)
+    assert path.stat().st_size == 16 + 3 * RECORD_SIZE
+
+    with TraceReader(path) as reader:
+        assert len(reader) == 3
+        assert list(reader) == events
+        assert reader[-1] == events[2]
+        assert bytes(reader.payload(1)) == bytes()
+        assert list(reader[0:2]) == events[:2]
+
+def test_append_and_time_range(tmp_path):
+    path = tmp_path / "bus.lintrace"
+    with TraceWriter(path) as writer:
+        writer.write_batch(LinEventBatch(LinEvent(0x3C, bytes([i]), 0, LinEvent.Direction.TX, float(i)) for i in range(5)))
+    with TraceWriter(path) as writer:
+        assert writer.record_count == 5
+        writer.write(LinEvent(0x3C, bytes([5]), 0, LinEvent.Direction.TX, 5.0))
+
+    with TraceReader(path) as reader:
+        assert len(reader) == 6
+        assert reader.index_range(1.5, 4.0) == range(2, 4)
+        assert [event.timestamp for event in reader.events(start_time=4.0)] == [4.0, 5.0]
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"not a trace at all")
+    with pytest.raises(ValueError):
+        TraceReader(path)
+
+def test_record_master_session(tmp_path):
+    path = tmp_path / "session.lintrace"
+    network = SimulatedLinNetwork(clock=VirtualClock())
+    network.register_slave(SLAVE_NAD, 0x1234, 0x5678, 0x01, serial_number=bytes([1, 2, 3, 4]))
+    recorder = TraceRecorder(network.get_master_driver(), path)
+    with LinMaster(recorder) as lin_master:
+        lin_master.get_slave_serial_number(nad=SLAVE_NAD, timeout=1)
+    recorder.close()
+
+    with TraceReader(path) as reader:
+        frames = [(event.event_id, event.direction) for event in reader if event.event_payload]
+        assert frames == [(MASTER_DIAGNOSTIC_FRAME_ID, LinEvent.Direction.TX), (SLAVE_DIAGNOSTIC_FRAME_ID, LinEvent.Direction.RX)]
+
+def test_numpy_view(tmp_path):
+    numpy = pytest.importorskip("numpy")
+    path = tmp_path / "bus.lintrace"
+    with TraceWriter(path) as writer:
+        for i in range(4):
+            writer.write(LinEvent(0x3D, bytes([i, i]), 0, LinEvent.Direction.RX, i * 0.01))
+    with TraceReader(path) as reader:
+        records = reader.as_array()
+        assert list(records["length"]) == [2] * 4
+        assert numpy.allclose(records["timestamp"], [0, 0.01, 0.02, 0.03])
+        assert list(records["payload"][:, 1]) == [0, 1, 2, 3]
+        del records
+
+def test_numpy_is_imported_lazily():
+    import subprocess
+    import sys
+    code = ("import sys, lindiagnostics, lindiagnostics.drivers, lindiagnostics.trace, lindiagnostics.checksum, lindiagnostics.analysis\n"
+            "assert 'numpy' not in sys.modules")
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,132 @@
+import pytest
+from queue import Full
+from lindiagnostics.transport import Transport
+from lindiagnostics.event import LinEvent, LinEventBatch
+from lindiagnostics.constants import *
+
+def test_segment_layout():
+    transport = Transport(False, None)
+    events = transport._segment(0x01, 0x31, bytes(range(1, 15)))
+    assert [event.event_id for event in events] == [MASTER_DIAGNOSTIC_FRAME_ID] * 3
+    assert [event.event_payload for event in events] == [
+        bytes([0x01, 0x10, 14, 0x31, 1, 2, 3, 4]),
+        bytes([0x01, 0x21, 5, 6, 7, 8, 9, 10]),
+        bytes([0x01, 0x22, 11, 12, 13, 14, 0xff, 0xff]),
+    ]
+
+    events = transport._segment(0x01, 0xB6, bytes())
+    assert [event.event_payload for event in events] == [bytes([0x01, 0x01, 0xB6, 0xff, 0xff, 0xff, 0xff, 0xff])]
+
+@pytest.mark.parametrize('length', list(range(0, 40)) + [100, 4095])
+def test_segment_reassemble_round_trip(length):
+    transmitter = Transport(False, None)
+    receiver = Transport(True, None)
+    data = bytes((i * 7) & 0xff for i in range(length))
+    events = transmitter._segment(0x05, 0x22, data)
+    # Frame counters wrap from 0xF back to 0x0
+    assert [event.event_payload[1] & 0xf for event in events[1:17]] == [(i % 16) for i in range(1, len(events[1:17]) + 1)]
+    for event in events:
+        receiver._receive_from_driver(LinEvent(event.event_id, event.event_payload, event.checksum_type, direction=LinEvent.Direction.RX))
+    assert receiver.receive() == (0x05, 0x22, data)
+    assert receiver.receive() is None
+
+def test_out_of_order_consecutive_frame_discarded():
+    transmitter = Transport(False, None)
+    receiver = Transport(True, None)
+    events = transmitter._segment(0x05, 0x22, bytes(20))
+    del events[1]
+    for event in events:
+        receiver._receive_from_driver(LinEvent(event.event_id, event.event_payload, event.checksum_type, direction=LinEvent.Direction.RX))
+    assert receiver.receive() is None
+
+def test_receive_batch():
+    transmitter = Transport(False, None)
+    receiver = Transport(True, None)
+    data = bytes(range(30))
+    batch = LinEventBatch(event.replace(direction=LinEvent.Direction.RX) for event in transmitter._segment(0x05, 0x22, data))
+    assert receiver.receive_batch(batch)
+    assert receiver.receive() == (0x05, 0x22, data)
+
+def test_transmit_queue_full():
+    transmitter = Transport(False, None, tx_queue_size=4)
+    transmitter.transmit(0x05, 0x22, bytes(10))
+    # A PDU is only queued when all of its frames fit
+    with pytest.raises(Full):
+        transmitter.transmit(0x05, 0x22, bytes(20), block=False)
+    with pytest.raises(Full):
+        transmitter.transmit(0x05, 0x22, bytes(20), timeout=0.01)
+    transmitter.transmit(0x05, 0x22, bytes(5), block=False)
+    assert len(transmitter._tx_queue) == 3
+
+def test_receive_queue_drops_oldest():
+    transmitter = Transport(False, None)
+    receiver = Transport(True, None, rx_queue_size=2)
+    for sid in (0x22, 0x23, 0x24):
+        for event in transmitter._segment(0x05, sid, bytes(3)):
+            receiver._receive_from_driver(event.stamped(LinEvent.Direction.RX, None))
+    assert receiver.rx_overflow_count == 1
+    assert [receiver.receive()[1], receiver.receive()[1]] == [0x23, 0x24]
+
+def test_receive_per_nad():
+    transmitter = Transport(False, None)
+    receiver = Transport(True, None)
+    receiver.subscribe(0x06)
+    for nad in (0x05, 0x06, 0x07):
+        for event in transmitter._segment(nad, 0x22, bytes(3)):
+            receiver._receive_from_driver(event.stamped(LinEvent.Direction.RX, None))
+    assert receiver.receive(nad=0x06) == (0x06, 0x22, bytes(3))
+    assert receiver.receive(nad=0x06) is None
+    assert [receiver.receive()[0], receiver.receive()[0]] == [0x05, 0x07]
+    assert receiver.receive(block=True, timeout=0.01, nad=0x06) is None
+
+def test_clear_tx_keeps_pdu_in_progress():
+    transmitter = Transport(False, None)
+    transmitter.transmit(0x05, 0x22, bytes(20))
+    transmitter.transmit(0x06, 0x22, bytes(3))
+    request = transmitter.request(0x05, 0x22, bytes(3))
+    # The first frame of the first PDU is already on the bus
+    transmitter._tx_queue.get()
+    transmitter.clear_tx(0x05)
+    assert [event.event_payload[0] for event, _, _ in transmitter._tx_queue.remove(lambda item: True)] == [0x05, 0x05, 0x05, 0x06]
+    assert request.cancelled()
+
+def test_stale_response_does_not_complete_queued_request():
+    master = Transport(False, None)
+    slave = Transport(True, None)
+    active = master.request(0x02, 0xB2, bytes(5))
+    queued = master.request(0x01, 0xB2, bytes(5))
+    event, request, _ = master._tx_queue.get()
+    master._activate(event, request)
+    # A late answer from NAD 1 to an earlier request, while NAD 2 is asked
+    for event in slave._segment(0x01, 0xF2, bytes([0xAA])):
+        master._receive_from_driver(event.stamped(LinEvent.Direction.RX, None))
+    assert not queued.done() and not active.done()
+    assert master.receive() == (0x01, 0xF2, bytes([0xAA]))
+
+    for event in slave._segment(0x02, 0xF2, bytes([0xBB])):
+        master._receive_from_driver(event.stamped(LinEvent.Direction.RX, None))
+    assert active.result(0) == (0x02, 0xF2, bytes([0xBB]))
+    assert not queued.done()
+
+def test_malformed_frames_are_dropped():
+    from lindiagnostics.metrics import TransportMetrics
+    metrics = TransportMetrics()
+    sender = Transport(True, None)
+    receiver = Transport(False, None, metrics=metrics)
+    events = [event.stamped(LinEvent.Direction.RX, None) for event in sender._segment(0x01, 0x62, bytes(range(20)))]
+    sf = sender._segment(0x01, 0x62, bytes(3))[0].stamped(LinEvent.Direction.RX, None)
+    malformed = [
+        sf.replace(event_payload=sf.event_payload[:5]),
+        # Truncated CF in the middle of a PDU
+        events[0], events[1].replace(event_payload=events[1].event_payload[:4]),
+        # Reserved PCI type and a Single Frame claiming more than 6 bytes
+        sf.replace(event_payload=bytes([0x01, 0x30]) + sf.event_payload[2:]),
+        sf.replace(event_payload=bytes([0x01, 0x07]) + sf.event_payload[2:]),
+    ]
+    for event in malformed + events + [sf]:
+        receiver._receive_from_driver(event)
+    assert metrics.frames_malformed == 4
+    assert metrics.pdus_incomplete == 1
+    assert receiver.receive() == (0x01, 0x62, bytes(range(20)))
+    assert receiver.receive() == (0x01, 0x62, bytes(3))
+    assert receiver.receive() is None
@@ -1,7 +1,9 @@
+import time
 import pytest
 from lindiagnostics import LinMaster
 from lindiagnostics.drivers import SimulatedLinNetwork
 from lindiagnostics.connectors import LinDiagnosticsUDSConnector
+from lindiagnostics.constants import BROADCAST_NAD
 from udsoncan.client import Client
 import udsoncan
 
@@ -51,3 +53,70 @@ def test_read_data_by_identifier():
                 result = uds_client.read_data_by_identifier(0x1234)
                 assert result.valid
                 assert result.service_data.values[0x1234][0] == 1
+
+def test_clients_share_a_master():
+    from concurrent.futures import ThreadPoolExecutor
+    simulated_network = SimulatedLinNetwork()
+    nads = [1, 2, 3, 4]
+    for nad in nads:
+        simulated_network.register_slave(nad, 2, 3, 4)
+    master_driver = simulated_network.get_master_driver()
+
+    def routine(lin_master, nad):
+        with LinDiagnosticsUDSConnector(lin_master, nad) as lin_diagnostic_connector:
+            with Client(lin_diagnostic_connector) as uds_client:
+                return [uds_client.start_routine(0x1, data=bytes([nad] * 10)).data for _ in range(5)]
+
+    with LinMaster(master_driver) as lin_master:
+        with ThreadPoolExecutor(max_workers=len(nads)) as executor:
+            results = list(executor.map(lambda nad: routine(lin_master, nad), nads))
+    for nad, responses in zip(nads, results):
+        assert responses == [bytes([0x01, 0x00, 0x01] + [nad] * 10)] * 5
+
+def test_wait_frame_timeout_does_not_spin():
+    simulated_network = SimulatedLinNetwork()
+    master_driver = simulated_network.get_master_driver()
+    with LinMaster(master_driver) as lin_master:
+        with LinDiagnosticsUDSConnector(lin_master, 1).open() as lin_diagnostic_connector:
+            start_time, start_cpu = time.monotonic(), time.process_time()
+            with pytest.raises(udsoncan.exceptions.TimeoutException):
+                lin_diagnostic_connector.wait_frame(timeout=0.2, exception=True)
+            assert time.monotonic() - start_time < 1
+            assert time.process_time() - start_cpu < 0.1
+
+def test_empty_queues():
+    simulated_network = SimulatedLinNetwork()
+    simulated_network.register_slave(1, 2, 3, 4)
+    master_driver = simulated_network.get_master_driver()
+    with LinMaster(master_driver) as lin_master:
+        with LinDiagnosticsUDSConnector(lin_master, 1).open() as lin_diagnostic_connector:
+            lin_diagnostic_connector.send(bytes([0x3E, 0x00]))
+            assert lin_diagnostic_connector.wait_frame(timeout=5) == bytes([0x7E, 0x00])
+            lin_diagnostic_connector.send(bytes([0x3E, 0x00]))
+            time.sleep(0.2)
+            lin_diagnostic_connector.empty_rxqueue()
+            assert lin_diagnostic_connector.wait_frame(timeout=0.1) is None
+
+def test_empty_queues_leaves_other_connectors_alone():
+    simulated_network = SimulatedLinNetwork()
+    master_driver = simulated_network.get_master_driver()
+    with LinMaster(master_driver) as lin_master:
+        with LinDiagnosticsUDSConnector(lin_master, 1).open() as addressed, \
+                LinDiagnosticsUDSConnector(lin_master, BROADCAST_NAD).open() as broadcast:
+            # Unsolicited PDUs, from a subscribed and from an unsubscribed NAD
+            lin_master._transport._dispatch(1, 0x7E, bytes([0x00]))
+            lin_master._transport._dispatch(2, 0x7E, bytes([0x00]))
+            broadcast.empty_rxqueue()
+            assert broadcast.wait_frame(timeout=0.1) is None
+            assert addressed.wait_frame(timeout=1) == bytes([0x7E, 0x00])
+
+def test_functional_request():
+    simulated_network = SimulatedLinNetwork()
+    nads = [1, 2, 3]
+    for nad in nads:
+        simulated_network.register_slave(nad, 2, 3, 4)
+    master_driver = simulated_network.get_master_driver()
+    with LinMaster(master_driver) as lin_master:
+        with LinDiagnosticsUDSConnector(lin_master, BROADCAST_NAD).open() as lin_diagnostic_connector:
+            responses = lin_diagnostic_connector.functional_request(bytes([0x3E, 0x00]), window=0.5)
+    assert responses == {nad: bytes([0x7E, 0x00]) for nad in nads}